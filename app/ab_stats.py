@@ -0,0 +1,64 @@
+import math
+from statistics import NormalDist
+
+from fastapi import APIRouter, Query
+
+from app.message_writer import message_writer
+from app.variant_stats import totals_query
+from db.database import AsyncSessionLocal
+
+router = APIRouter()
+
+
+def wilson_interval(successes, n, z):
+    """Wilson score interval of a proportion; stays within [0, 1] for small counts."""
+    if not n:
+        return None
+    p = successes / n
+    denominator = 1 + z * z / n
+    centre = (p + z * z / (2 * n)) / denominator
+    margin = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denominator
+    return [max(0.0, centre - margin), min(1.0, centre + margin)]
+
+
+def mean_interval(total, squares, n, z):
+    """Normal interval of a mean from its count, sum and sum of squares."""
+    if n < 2:
+        return None
+    mean = total / n
+    variance = max(squares - n * mean * mean, 0) / (n - 1)
+    margin = z * math.sqrt(variance / n)
+    return [mean - margin, mean + margin]
+
+
+def variant_summary(row, z):
+    rated = row.thumbs_up + row.thumbs_down
+    return {
+        "variant": row.variant or None,
+        "conversations": row.conversations,
+        "turns": row.turns,
+        "thumbs_up": row.thumbs_up,
+        "thumbs_down": row.thumbs_down,
+        "commented": row.commented,
+        "feedback_rate": rated / row.turns if row.turns else None,
+        "thumbs_up_rate": {
+            "value": row.thumbs_up / rated if rated else None,
+            "interval": wilson_interval(row.thumbs_up, rated, z),
+        },
+        "evaluations": row.evaluations,
+        "mean_score": {
+            "value": row.score_sum / row.evaluations if row.evaluations else None,
+            "interval": mean_interval(row.score_sum, row.score_sq_sum, row.evaluations, z),
+        },
+    }
+
+
+@router.get("/ab-stats")
+async def ab_stats(confidence: float = Query(0.95, gt=0, lt=1)):
+    """Feedback and evaluation results per variant, read from the maintained counters."""
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    # Turns still in the write-behind buffer aren't counted yet
+    await message_writer.sync()
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(totals_query())).all()
+    return {"confidence": confidence, "variants": [variant_summary(row, z) for row in rows]}
@@ -0,0 +1,122 @@
+import os
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException
+
+from app.completion_cache import completion_cache
+from app.history_cache import history_cache
+from app.llm import limiter
+from app.message_writer import message_writer
+from app.refinement import queue_stats
+from app.retrieval import knowledge_index
+from app.routing import variant_router
+from app.telemetry import turn_stats_query
+from app.variant_stats import rebuild as rebuild_variant_stats
+from app.variants import registry
+from db.database import AsyncSessionLocal
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    # Admin endpoints are open unless ADMIN_TOKEN is configured
+    if ADMIN_TOKEN and x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+router = APIRouter(prefix="/admin", dependencies=[Depends(require_admin)])
+
+
+@router.get("/variants")
+def get_variants():
+    snapshot = registry.snapshot
+    return {
+        "version": snapshot.version,
+        "digest": snapshot.digest,
+        "loaded_at": snapshot.loaded_at.isoformat(),
+        "path": registry.path,
+        "variants": {
+            name: variant.model_dump() for name, variant in snapshot.variants.items()
+        },
+    }
+
+
+@router.post("/variants/reload")
+def reload_variants():
+    try:
+        registry.load()
+    except (OSError, ValueError) as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return {"version": registry.snapshot.version}
+
+
+@router.get("/routing")
+def get_routing():
+    return variant_router.stats()
+
+
+@router.post("/routing/reload")
+def reload_routing():
+    try:
+        policy = variant_router.load()
+    except (OSError, ValueError) as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return {"weights": policy.weights}
+
+
+@router.get("/knowledge-index")
+def get_knowledge_index():
+    return knowledge_index.stats()
+
+
+@router.post("/knowledge-index/reload")
+def reload_knowledge_index():
+    try:
+        index = knowledge_index.load()
+    except (OSError, ValueError, KeyError) as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return {"chunks": len(index)}
+
+
+@router.get("/history-cache")
+def get_history_cache():
+    return history_cache.stats()
+
+
+@router.get("/completion-cache")
+def get_completion_cache():
+    return completion_cache.stats()
+
+
+@router.get("/message-writer")
+def get_message_writer():
+    return message_writer.metrics()
+
+
+@router.get("/refinement-queue")
+async def get_refinement_queue():
+    async with AsyncSessionLocal() as db:
+        return await queue_stats(db)
+
+
+@router.get("/turn-stats")
+async def get_turn_stats(hours: float = 24):
+    async with AsyncSessionLocal() as db:
+        if db.bind.dialect.name != "postgresql":
+            raise HTTPException(status_code=501, detail="Turn stats need Postgres (percentile_cont)")
+        rows = await db.execute(turn_stats_query(hours))
+        return [dict(row._mapping) for row in rows]
+
+
+@router.post("/ab-stats/rebuild")
+async def rebuild_ab_stats():
+    await message_writer.sync()
+    async with AsyncSessionLocal() as db:
+        await rebuild_variant_stats(db)
+        await db.commit()
+    return {"success": True}
+
+
+@router.get("/rate-limits")
+def get_rate_limits():
+    return limiter.metrics()
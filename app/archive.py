@@ -0,0 +1,246 @@
+"""
+Cold archival of old conversations.
+
+Conversations that started more than ARCHIVE_AFTER_DAYS ago are moved, in batches,
+out of the hot tables into segment files under ARCHIVE_DIR. A segment is a series of
+gzip members, one per conversation, each holding one JSON line: `zcat` turns a segment
+into plain JSONL, and one conversation is read back by decompressing only its member.
+The `archived_conversations` catalog keeps each conversation's segment, offset and
+length, plus what /talks-data filters on.
+"""
+import asyncio
+import gzip
+import json
+import mmap
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import timedelta
+from pathlib import Path
+
+from sqlalchemy import delete, insert, select
+
+from app.log import get_logger
+from db.database import engine
+from db.models import (
+    ArchivedConversation, Conversation, ConversationSummary, Message, RefinementFeedback, utcnow,
+)
+from db.partitions import drop_empty_partitions, ensure_partitions, month_start
+
+logger = get_logger("archive")
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "data/archive")
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", "180"))
+
+# Conversations moved per transaction, and per segment file
+BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "200"))
+
+# Segments kept mapped by the reader
+MAX_OPEN_SEGMENTS = 64
+
+MESSAGE_FIELDS = (
+    "id", "seq", "role", "content", "model", "prompt_tokens", "completion_tokens", "ttft_ms", "latency_ms",
+    "timestamp", "thumbs_up", "thumbs_down", "feedback_text",
+)
+
+
+def message_record(msg):
+    record = {field: getattr(msg, field) for field in MESSAGE_FIELDS}
+    record["id"] = str(msg.id)
+    record["timestamp"] = msg.timestamp.isoformat() if msg.timestamp else None
+    return record
+
+
+def conversation_record(convo, messages, summary=None):
+    return {
+        "conversation_id": str(convo.id),
+        "config": convo.config,
+        "started_at": convo.started_at.isoformat(),
+        "prompt_profile_id": str(convo.prompt_profile_id) if convo.prompt_profile_id else None,
+        "knowledge_set_id": str(convo.knowledge_set_id) if convo.knowledge_set_id else None,
+        "summary": summary,
+        "messages": [message_record(msg) for msg in messages],
+    }
+
+
+def catalog_entry(convo, messages, segment, offset, length):
+    flag = lambda attribute: sum(1 for msg in messages if getattr(msg, attribute))
+    return {
+        "id": convo.id,
+        "started_at": convo.started_at,
+        "config": convo.config,
+        "has_feedback": any(msg.thumbs_up or msg.thumbs_down or msg.feedback_text is not None for msg in messages),
+        "message_count": len(messages),
+        "turns": sum(1 for msg in messages if msg.role == "assistant"),
+        "thumbs_up": flag("thumbs_up"),
+        "thumbs_down": flag("thumbs_down"),
+        "commented": flag("feedback_text"),
+        "segment": segment,
+        "offset": offset,
+        "length": length,
+        "archived_at": utcnow(),
+    }
+
+
+class SegmentWriter:
+    """Writes one segment; it only appears under its final name once complete and synced."""
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.name = f"{utcnow():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}.jsonl.gz"
+        self._tmp = self.directory / f".{self.name}.tmp"
+        self._file = open(self._tmp, "wb")
+        self._offset = 0
+
+    def add(self, record):
+        """Append a record as its own gzip member. Returns its (offset, length)."""
+        member = gzip.compress((json.dumps(record) + "\n").encode("utf-8"), mtime=0)
+        self._file.write(member)
+        offset, self._offset = self._offset, self._offset + len(member)
+        return offset, len(member)
+
+    def commit(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self._tmp, self.directory / self.name)
+        directory = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+    def abort(self):
+        self._file.close()
+        self._tmp.unlink(missing_ok=True)
+
+
+class ArchiveReader:
+    """
+    Reads archived conversations out of memory-mapped segments.
+
+    A read touches only the pages of its own gzip member, so it costs the same in a
+    segment of a hundred conversations or of a million. Recently used segments stay
+    mapped.
+    """
+
+    def __init__(self, directory=ARCHIVE_DIR, max_open=MAX_OPEN_SEGMENTS):
+        self.directory = directory
+        self.max_open = max_open
+        self._maps = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _segment(self, name):
+        with self._lock:
+            mapped = self._maps.get(name)
+            if mapped is not None:
+                self._maps.move_to_end(name)
+                return mapped
+            with open(Path(self.directory) / name, "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[name] = mapped
+            while len(self._maps) > self.max_open:
+                _, oldest = self._maps.popitem(last=False)
+                oldest.close()
+            return mapped
+
+    def read(self, segment, offset, length):
+        member = self._segment(segment)[offset:offset + length]
+        return json.loads(gzip.decompress(member))
+
+    def read_entry(self, entry):
+        return self.read(entry.segment, entry.offset, entry.length)
+
+    def close(self):
+        with self._lock:
+            for mapped in self._maps.values():
+                mapped.close()
+            self._maps.clear()
+
+
+archive_reader = ArchiveReader()
+
+
+async def read_archived(entries):
+    """The records of catalog `entries`, read off the event loop."""
+    if not entries:
+        return []
+    return await asyncio.to_thread(lambda: [archive_reader.read_entry(entry) for entry in entries])
+
+
+async def archive_batch(db, cutoff, batch_size=BATCH_SIZE, directory=ARCHIVE_DIR):
+    """
+    Move up to `batch_size` conversations started before `cutoff` into one segment, and
+    delete them from the hot tables in the same transaction as their catalog entries.
+    Returns how many were moved.
+    """
+    stmt = (
+        select(Conversation)
+        .where(Conversation.started_at < cutoff)
+        .order_by(Conversation.started_at, Conversation.id)
+        .limit(batch_size)
+    )
+    if db.bind.dialect.name == "postgresql":
+        # A concurrent run takes the next conversations instead of waiting on these
+        stmt = stmt.with_for_update(skip_locked=True)
+    conversations = (await db.scalars(stmt)).all()
+    if not conversations:
+        return 0
+
+    ids = [convo.id for convo in conversations]
+    # The batch's start times bound the partitions its messages are read and deleted from
+    in_batch = (
+        Message.conversation_id.in_(ids),
+        Message.conversation_started_at.between(conversations[0].started_at, conversations[-1].started_at),
+    )
+    messages = {}
+    for msg in await db.scalars(select(Message).where(*in_batch).order_by(Message.conversation_id, Message.seq)):
+        messages.setdefault(msg.conversation_id, []).append(msg)
+    summaries = dict((await db.execute(
+        select(ConversationSummary.conversation_id, ConversationSummary.content)
+        .where(ConversationSummary.conversation_id.in_(ids))
+    )).all())
+
+    writer = SegmentWriter(directory)
+    try:
+        entries = []
+        for convo in conversations:
+            convo_messages = messages.get(convo.id, [])
+            offset, length = writer.add(conversation_record(convo, convo_messages, summaries.get(convo.id)))
+            entries.append(catalog_entry(convo, convo_messages, writer.name, offset, length))
+        # On disk for good before anything is deleted; a failure below only orphans the file
+        writer.commit()
+    except BaseException:
+        writer.abort()
+        raise
+
+    await db.execute(insert(ArchivedConversation).values(entries))
+    await db.execute(delete(RefinementFeedback).where(RefinementFeedback.conversation_id.in_(ids)))
+    await db.execute(delete(ConversationSummary).where(ConversationSummary.conversation_id.in_(ids)))
+    await db.execute(delete(Message).where(*in_batch))
+    await db.execute(delete(Conversation).where(Conversation.id.in_(ids)))
+    await db.commit()
+    return len(conversations)
+
+
+async def run_archival(session_factory, days=ARCHIVE_AFTER_DAYS, batch_size=BATCH_SIZE, directory=ARCHIVE_DIR):
+    """
+    Archive every conversation older than `days`, batch by batch, then drop the
+    monthly partitions left empty. Returns what was done.
+    """
+    cutoff = utcnow() - timedelta(days=days)
+    archived = 0
+    while True:
+        async with session_factory() as db:
+            moved = await archive_batch(db, cutoff, batch_size, directory)
+        if not moved:
+            break
+        archived += moved
+        logger.info("📦 Archived %d conversations (%d so far)", moved, archived)
+
+    # Partition maintenance is synchronous DDL; keep it off the event loop
+    created = await asyncio.to_thread(ensure_partitions, engine, utcnow())
+    dropped = await asyncio.to_thread(drop_empty_partitions, engine, month_start(cutoff))
+    return {"archived": archived, "cutoff": cutoff.isoformat(), "created_partitions": created, "dropped_partitions": dropped}
@@ -1,173 +1,481 @@
-import os
+import asyncio
+import time
 import uuid
 from typing import Optional
 
 from dotenv import load_dotenv
-from fastapi import APIRouter, Body, HTTPException
-from groq import Groq
+from fastapi import APIRouter, BackgroundTasks, Header, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
+from groq import RateLimitError
+from anyio import CancelScope
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+
+from app.completion_cache import CachedStream, completion_cache, completion_key
+from app.context import assemble_context, compact_summary, knowledge_context
+from app.hedging import hedged_call, prime
+from app.history_cache import history_cache, make_turn, notify_history_changed
+from app.idempotency import idempotency_keys
+from app.knowledge import get_or_create_knowledge_set, get_or_create_prompt_profile
+from app.llm import client
+from app.log import get_logger
+from app.message_writer import message_writer
+from app.metrics import CHAT_IN_FLIGHT, GROQ_ERRORS, chunk_usage, count_turn, observe_phase, record_usage
+from app.routing import variant_router
+from app.telemetry import ReplyStats, elapsed_ms, usage_tokens
+from app.turn_lock import TurnLockTimeout, conversation_locks
+from app.variant_stats import add_counts, variant_key
+from app.variants import DEFAULT_VARIANT, ModelVariantRegistry, registry
+from db.database import AsyncSessionLocal
+from db.models import Conversation, Message, utcnow
 
-from db.database import SessionLocal
-from db.models import Conversation, KnowledgeSource, Message, PromptProfile
-
-import random
 import json
 
 load_dotenv()
 
 router = APIRouter()
-
-
-GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-
-if not GROQ_API_KEY:
-    raise ValueError("Missing GROQ_API_KEY in environment variables")
-
-client = Groq(api_key=GROQ_API_KEY)
+logger = get_logger("chat")
 
 class ChatRequest(BaseModel):
     message: str
     conversation_id: Optional[str] = None
+    stream: bool = False
+    # Stable id of the user or browser; new conversations from it keep the same variant
+    client_id: Optional[str] = None
+
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
 
 
 @router.post("/chat")
-async def chat(req: ChatRequest):
-    db: Session = SessionLocal()
+async def chat(req: ChatRequest, background_tasks: BackgroundTasks, idempotency_key: Optional[str] = Header(None)):
+    # A retried request is answered from the turn it repeats, never by calling Groq again
+    keyed = None
+    if idempotency_key is not None:
+        try:
+            keyed, owner = await idempotency_keys.begin(idempotency_key, req.message, req.conversation_id)
+            if not owner:
+                response = await replay_turn(keyed, req.stream)
+                count_turn(None, "replayed")
+                return response
+        except HTTPException:
+            count_turn(None, "error")
+            raise
+
+    db: AsyncSession = AsyncSessionLocal()
+    # When streaming, the response generator takes over the session, the lock and the key
+    streaming = False
+    lock = None
+    variant_name = None
+    # Left unset by a turn that is cancelled
+    outcome = None
+    received = time.perf_counter()
+    CHAT_IN_FLIGHT.inc()
     try:
-        print("🔹 Incoming request:")
+        logger.debug("🔹 Incoming request", extra={"stream": req.stream})
 
         if req.conversation_id:
             try:
                 conversation_uuid = uuid.UUID(req.conversation_id)
             except ValueError:
                 raise HTTPException(status_code=400, detail="Invalid conversation_id format")
-            
-            conversation = db.query(Conversation).filter_by(id=conversation_uuid).first()
+
+            # Held until the reply is saved, so the next turn reads a history that includes it
+            try:
+                lock = await conversation_locks.acquire(conversation_uuid)
+            except TurnLockTimeout:
+                raise HTTPException(
+                    status_code=409,
+                    detail="The previous message in this conversation is still being answered",
+                    headers={"Retry-After": "1"},
+                )
+
+            # Turns still in the write-behind buffer must be stored before reading them back
+            await message_writer.sync(conversation_uuid)
+            result = await db.execute(conversation_query(conversation_uuid))
+            conversation = result.unique().scalar_one_or_none()
             if not conversation:
                 raise HTTPException(status_code=404, detail="Conversation not found")
-            print(f"🔄 Continuing conversation {conversation.id}")
+            logger.debug("🔄 Continuing conversation", extra={"conversation_id": str(conversation.id)})
+
+            config_history = create_config_history(conversation)
+            summary = conversation.summary
+
+            # Hot conversations are served from the cache; only a miss reads the history back
+            turns = history_cache.get(conversation.id)
+            if turns is None:
+                rows = await db.execute(history_query(conversation.id, conversation.started_at))
+                turns = history_cache.put(conversation.id, rows.all())
         else:
-            # Create a new conversation
-            conversation = Conversation()
-            db.add(conversation)
-            db.commit()
-            db.refresh(conversation)
-            print(f"🆕 Created new conversation {conversation.id}")
-        
-            # Choose model config variant 
-            conversation.config = os.getenv("DEFAULT_MODEL_GROUP", "A")
-
-            # Add default prompt and knowledge sources
-            addConfigurations(db, conversation, conversation.config)
-
-            print(f"🧩 Added configurations to conversation {conversation.id}")
-
-        user_msg = Message(
-            conversation_id=conversation.id,
-            role="user",
-            content=req.message
-        )
-        db.add(user_msg)
-        db.commit()
-        print(f"💾 Saved user message to conversation {conversation.id}")
-
-
-        config_history = create_config_history(conversation)
-
-        # Build full message history (including system context)
-        history = config_history + [
-            {"role": msg.role, "content": msg.content}
-            for msg in db.query(Message)
-                        .filter_by(conversation_id=conversation.id)
-                        .order_by(Message.timestamp)
-                        .all()
-        ]
-
-        # Send the request to the Groq API
-        completion = create_groq_model(history, conversation.config)
-        
-        bot_reply = completion.choices[0].message.content
-        print(f"🤖 Bot reply: {bot_reply}")
-
-        bot_msg = Message(
-            conversation_id=conversation.id,
-            role="assistant",
-            content=bot_reply
+            # Only written at the end of the turn, together with its messages
+            conversation_id = uuid.uuid4()
+            variant_name = variant_router.assign(req.client_id or conversation_id)
+            conversation = Conversation(id=conversation_id, config=variant_name, started_at=utcnow())
+            logger.debug("🆕 Created new conversation", extra={"conversation_id": str(conversation.id)})
+
+            # Add default prompt and knowledge sources; no queries once the variant has been seen
+            await db.run_sync(addConfigurations, conversation, conversation.config)
+            config = registry.get(conversation.config)
+            config_history = system_context(config.system_prompt, config.knowledge_sources)
+            summary = None
+            turns = []
+
+        # Don't hold a connection while waiting on Groq
+        await db.commit()
+
+        # Build message history (including system context) within the variant's token budget
+        variant_name = conversation.config or DEFAULT_VARIANT
+        variant = registry.get(variant_name)
+        turns = [*turns, make_turn("user", req.message)]
+        if variant.retrieval_top_k:
+            # Only indexed knowledge relevant to this message is sent; scored off the event loop
+            config_history = [*config_history, *await asyncio.to_thread(knowledge_context, req.message, variant)]
+        history, compact_until = assemble_context(config_history, summary, turns, variant)
+        observe_phase("context_load", variant_name, time.perf_counter() - received)
+
+        # Variants that opt in reuse the reply to an identical request
+        cache_key = completion_key(variant, history) if completion_cache.eligible(variant) else None
+        cached_reply = await completion_cache.get(cache_key, variant_name) if cache_key else None
+
+        # Older turns no longer fit: fold them into the rolling summary after responding
+        if compact_until:
+            background_tasks.add_task(compact_summary, conversation.id, conversation.config, compact_until)
+
+        new_conversation = not req.conversation_id
+        if req.stream:
+            # Open the stream here so a failed request still returns a proper 502
+            started = time.perf_counter()
+            if cached_reply is not None:
+                stream, model, cache_key = CachedStream(cached_reply), variant.model, None
+            else:
+                stream, model = await create_groq_model(history, conversation.config, stream=True)
+            streaming = True
+            return StreamingResponse(
+                stream_reply(
+                    db, conversation, new_conversation, req.message, stream, started,
+                    cache_key, variant_name, model, lock, keyed,
+                ),
+                media_type="text/event-stream",
+                headers=SSE_HEADERS,
+            )
+
+        if cached_reply is not None:
+            bot_reply, stats = cached_reply, ReplyStats(model=variant.model)
+        else:
+            # Send the request to the Groq API
+            started = time.perf_counter()
+            completion, model = await create_groq_model(history, conversation.config)
+            generation = time.perf_counter() - started
+            observe_phase("generation", variant_name, generation)
+            variant_router.record(variant_name, generation)
+            usage = getattr(completion, "usage", None)
+            record_usage(usage, variant_name, model)
+            bot_reply = completion.choices[0].message.content
+            stats = ReplyStats(model, *usage_tokens(usage), latency_ms=elapsed_ms(started))
+            # A fallback's reply isn't what the variant's model would have said
+            if cache_key and model == variant.model:
+                await completion_cache.put(cache_key, variant_name, bot_reply, generation)
+
+        saving = time.perf_counter()
+        bot_msg_id = await save_turn(
+            db, conversation, new_conversation, req.message, bot_reply, stats=stats, keyed=keyed,
         )
-        db.add(bot_msg)
-        db.commit()
-        print(f"💾 Saved bot reply to conversation {conversation.id}")
+        observe_phase("persistence", variant_name, time.perf_counter() - saving)
+        logger.info("💾 Saved turn", extra={
+            "conversation_id": str(conversation.id),
+            "variant": variant_name,
+            "cached": cached_reply is not None,
+            "total_ms": round((time.perf_counter() - received) * 1000),
+        })
 
+        outcome = "cached" if cached_reply is not None else "ok"
         return {
             "reply": bot_reply,
             "conversation_id": str(conversation.id),
-            "message_id": str(bot_msg.id) 
+            "message_id": str(bot_msg_id) 
         }
     except HTTPException as http_exc:
+        outcome = "error"
+        if keyed is not None:
+            await idempotency_keys.fail(keyed, http_exc.status_code, http_exc.detail, http_exc.headers)
         raise http_exc
     
     except Exception as e:
-        db.rollback()
-        print("❌ Exception:", e)
-        raise HTTPException(status_code=500, detail=f"Groq API error: {str(e)}")
+        await db.rollback()
+        outcome = "error"
+        logger.exception("❌ Chat turn failed")
+        detail = f"Groq API error: {str(e)}"
+        if keyed is not None:
+            await idempotency_keys.fail(keyed, 500, detail)
+        raise HTTPException(status_code=500, detail=detail)
 
     finally:
-        db.close()
-        print("🔚 DB session closed")
-
-
-def addConfigurations(db, conversation, variant, config_path="config/model_variants.json"):
-    system_context = []
-
-    # Load model config including prompt and knowledge sources
-    with open(config_path) as f:
-        MODEL_CONFIGS = json.load(f)
-
-    config = MODEL_CONFIGS.get(variant)
-    if not config:
-        raise ValueError(f"No configuration '{variant}'")
-
-    # Load and assign default prompt profile
-    prompt_text = config.get("system_prompt")
-    prompt = db.query(PromptProfile).filter_by(system_prompt=prompt_text).first()
-    if not prompt:
-        prompt = PromptProfile(system_prompt=prompt_text)
-        db.add(prompt)
-        db.commit()
-        db.refresh(prompt)
-
-    conversation.prompt_profile_id = prompt.id
-    db.commit()
-    print(f"🧠 Attached PromptProfile {prompt.id} to conversation {conversation.id}")
-
-
-    # Load knowledge sources directly from config JSON
-    sources = config.get("knowledge_sources", [])
-
-
-    for src in sources:
-        ks = KnowledgeSource(content=src, conversation_id=conversation.id)
-        db.add(ks)
+        if not streaming:
+            # Shielded so a turn cancelled by a client disconnect or shutdown still frees its key and lock
+            with CancelScope(shield=True):
+                if keyed is not None and not keyed.done:
+                    await idempotency_keys.fail(keyed, 503, "The request was interrupted. Please try again.")
+                count_turn(variant_name, outcome or "interrupted")
+                CHAT_IN_FLIGHT.dec()
+                await db.close()
+                if lock is not None:
+                    await lock.release()
+
+
+async def replay_turn(keyed, stream):
+    """Respond to a duplicate request with the turn it repeats, following it if still in flight."""
+    headers = {"Idempotent-Replayed": "true"}
+    await idempotency_keys.follow(keyed, started=stream)
+    if keyed.error is not None and (not stream or keyed.message_id is None):
+        status_code, detail, error_headers = keyed.error
+        raise HTTPException(status_code=status_code, detail=detail, headers={**(error_headers or {}), **headers})
+    if stream:
+        events = (sse_event(event, data) async for event, data in keyed.events())
+        return StreamingResponse(events, media_type="text/event-stream", headers={**SSE_HEADERS, **headers})
+    return JSONResponse(keyed.result(), headers=headers)
+
+
+def conversation_query(conversation_id):
+    # The conversation with its prompt, knowledge and summary in a single round trip
+    return (
+        select(Conversation)
+        .filter_by(id=conversation_id)
+        .options(
+            joinedload(Conversation.prompt_profile),
+            joinedload(Conversation.knowledge_sources),
+            joinedload(Conversation.summary),
+        )
+    )
+
+
+def history_query(conversation_id, started_at=None):
+    stmt = (
+        select(Message.role, Message.content)
+        .filter_by(conversation_id=conversation_id)
+        .order_by(Message.seq)
+    )
+    if started_at is not None:
+        # Reads only the conversation's partition
+        stmt = stmt.where(Message.conversation_started_at == started_at)
+    return stmt
+
+
+async def save_turn(
+    db, conversation, new_conversation, user_message, reply, bot_msg_id=None, stats=None, keyed=None, complete=True,
+):
+    """
+    Store a user message and its reply in one transaction, with the conversation itself
+    when it is new, then bring the history cache up to date. Returns the reply's id.
+    `stats` (ReplyStats) describe the call that wrote the reply. A `keyed` turn stores
+    the reply for its idempotency key too, `complete` saying whether it was cut short.
+
+    Nothing is written for a turn that gets no reply, so the history never ends on an
+    unanswered message. In write-behind mode the turn is only buffered here.
+    """
+    conversation_id = conversation.id
+    user_msg_id, bot_msg_id = uuid.uuid4(), bot_msg_id or uuid.uuid4()
+    stats = stats or ReplyStats()
+    if keyed is not None:
+        keyed.start(conversation_id, bot_msg_id)
+
+    if message_writer.enabled:
+        await message_writer.add_turn(
+            conversation_id,
+            [(user_msg_id, "user", user_message), (bot_msg_id, "assistant", reply)],
+            conversation if new_conversation else None,
+            stats,
+        )
+        if keyed is not None:
+            async with AsyncSessionLocal() as key_db:
+                await idempotency_keys.save(key_db, keyed, reply, complete)
+                await key_db.commit()
+    else:
+        # A new conversation can't have concurrent writers, so its positions are known
+        user_seq, bot_seq = (1, 2) if new_conversation else (None, None)
+        # Partition key; looked up in the INSERT for a conversation without a start time
+        started_at = conversation.started_at
+        if new_conversation:
+            db.add(conversation)
+        # Ids set up front so both rows go out in one executemany
+        db.add_all([
+            Message(
+                id=user_msg_id, conversation_id=conversation_id, conversation_started_at=started_at, seq=user_seq,
+                role="user", content=user_message,
+            ),
+            Message(
+                id=bot_msg_id, conversation_id=conversation_id, conversation_started_at=started_at, seq=bot_seq,
+                role="assistant", content=reply, **stats.columns(),
+            ),
+        ])
+        if not new_conversation:
+            await notify_history_changed(db, conversation_id)
+        await add_counts(db, {variant_key(conversation.config): {"conversations": int(new_conversation), "turns": 1}})
+        if keyed is not None:
+            await idempotency_keys.save(db, keyed, reply, complete)
+        await db.commit()
+
+    if new_conversation:
+        history_cache.put(conversation_id, [("user", user_message), ("assistant", reply)])
+    else:
+        history_cache.append(conversation_id, "user", user_message)
+        history_cache.append(conversation_id, "assistant", reply)
+    if keyed is not None:
+        idempotency_keys.finish(keyed, reply, complete)
+    return bot_msg_id
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def stream_reply(
+    db, conversation, new_conversation, user_message, stream, started, cache_key=None, variant_name=None,
+    model=None, lock=None, keyed=None,
+):
+    """
+    Forward Groq deltas as Server-Sent Events and persist the turn with the assembled reply.
+
+    The turn is saved when the stream ends, including when the client disconnects
+    (the response task is cancelled) or the provider fails mid-stream, so the history
+    stays consistent with what the user has seen. With a `cache_key`, a complete reply
+    is also stored in the completion cache. `model` is the model that is answering.
+    The conversation `lock` is released once the turn is saved, and duplicates of a
+    `keyed` turn follow its tokens as they arrive.
+    """
+    conversation_id = conversation.id
+    variant_model = registry.get(variant_name or DEFAULT_VARIANT).model
+    model = model or variant_model
+    # A replayed cache hit says nothing about Groq's latency
+    measured = not isinstance(stream, CachedStream)
+    bot_msg_id = uuid.uuid4()
+    parts = []
+    usage = None
+    ttft = None
+    completed = False
+    # Until the stream completes or fails, the client went away
+    outcome = "interrupted"
+    try:
+        if keyed is not None:
+            keyed.start(conversation_id, bot_msg_id)
+        yield sse_event("start", {"conversation_id": str(conversation_id), "message_id": str(bot_msg_id)})
+        try:
+            async for chunk in stream:
+                if measured:
+                    chunk_tokens = chunk_usage(chunk)
+                    record_usage(chunk_tokens, variant_name, model)
+                    usage = chunk_tokens or usage
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if not delta:
+                    continue
+                if ttft is None:
+                    ttft = time.perf_counter() - started
+                    if measured:
+                        observe_phase("ttft", variant_name, ttft)
+                parts.append(delta)
+                if keyed is not None:
+                    keyed.publish(delta)
+                yield sse_event("token", {"content": delta})
+        except Exception:
+            outcome = "error"
+            GROQ_ERRORS.labels("stream").inc()
+            variant_router.record(variant_name, error=True)
+            logger.exception("❌ Groq stream failed", extra={"conversation_id": str(conversation_id)})
+            yield sse_event("error", {"detail": "Groq API failed. Please try again."})
+            return
+        completed = True
+        outcome = "ok" if measured else "cached"
+        if measured:
+            generation = time.perf_counter() - started
+            observe_phase("generation", variant_name, generation)
+            # The same measure as a regular reply, so the mix of streamed turns doesn't skew the p95
+            variant_router.record(variant_name, generation)
+        if cache_key and parts and model == variant_model:
+            await completion_cache.put(cache_key, variant_name, "".join(parts), time.perf_counter() - started)
+    finally:
+        # Shielded so the reply is still saved when a client disconnect cancels the task
+        with CancelScope(shield=True):
+            try:
+                if parts:
+                    saving = time.perf_counter()
+                    stats = ReplyStats(model)
+                    if measured:
+                        stats = ReplyStats(
+                            model, *usage_tokens(usage),
+                            ttft_ms=round(ttft * 1000) if ttft is not None else None,
+                            latency_ms=elapsed_ms(started),
+                        )
+                    await save_turn(
+                        db, conversation, new_conversation, user_message, "".join(parts), bot_msg_id, stats,
+                        keyed, completed,
+                    )
+                    observe_phase("persistence", variant_name, time.perf_counter() - saving)
+                    logger.info("💾 Saved streamed turn", extra={
+                        "conversation_id": str(conversation_id),
+                        "variant": variant_name,
+                        "complete": completed,
+                        "ttft_ms": round(ttft * 1000) if ttft is not None else None,
+                        "total_ms": round((time.perf_counter() - started) * 1000),
+                    })
+                elif keyed is not None:
+                    await idempotency_keys.fail(keyed, 502, "Groq API failed. Please try again.")
+            except Exception:
+                outcome = "error"
+                await db.rollback()
+                logger.exception("❌ Saving streamed turn failed", extra={"conversation_id": str(conversation_id)})
+                if keyed is not None and not keyed.done:
+                    await idempotency_keys.fail(keyed, 500, "Saving the reply failed. Please try again.")
+            finally:
+                count_turn(variant_name, outcome)
+                CHAT_IN_FLIGHT.dec()
+                await stream.close()
+                await db.close()
+                if lock is not None:
+                    await lock.release()
+
+    yield sse_event("done", {
+        "conversation_id": str(conversation_id),
+        "message_id": str(bot_msg_id),
+        "ttft_ms": round(ttft * 1000) if ttft is not None else None,
+        "total_ms": round((time.perf_counter() - started) * 1000),
+    })
+
+
+def addConfigurations(db, conversation, variant, config_path=None):
+    # An explicit config file bypasses the shared in-memory registry
+    variants = ModelVariantRegistry.from_file(config_path) if config_path else registry
+    config = variants.get(variant)
+
+    # Prompts and sources are stored once by content hash, so this is a lookup for any
+    # variant that has been used before, however many sources it has
+    conversation.prompt_profile_id = get_or_create_prompt_profile(db, config.system_prompt)
+    conversation.knowledge_set_id = get_or_create_knowledge_set(db, config.knowledge_sources)
+    logger.debug("🧠 Attached prompt profile and knowledge sources", extra={
+        "conversation_id": str(conversation.id),
+        "prompt_profile_id": str(conversation.prompt_profile_id),
+        "knowledge_sources": len(config.knowledge_sources),
+    })
 
-    db.commit()
-    print(f"📚 Attached {len(sources)} knowledge sources to conversation {conversation.id}")
+def create_config_history(conversation):
+    # Relationships must already be loaded, see conversation_query
+    profile = conversation.prompt_profile
+    return system_context(
+        profile.system_prompt if profile else None,
+        [src.content for src in conversation.knowledge_sources],
+    )
 
-    return 
 
-def create_config_history(conversation):
+def system_context(system_prompt, sources):
     system_context = []
 
     # Add the system prompt from the associated profile
-    if conversation.prompt_profile:
+    if system_prompt:
         system_context.append({
             "role": "system",
-            "content": conversation.prompt_profile.system_prompt
+            "content": system_prompt
         })
 
-    # Fetch all knowledge sources linked to this conversation
-    sources = conversation.knowledge_sources 
-
     if sources:
         system_context.append({
             "role": "system",
@@ -177,31 +485,46 @@ def create_config_history(conversation):
         for src in sources:
             system_context.append({
                 "role": "system",
-                "content": src.content
+                "content": src
             })
 
     return system_context
 
 
 
-def create_groq_model(history, variant):
-
-    # Load model variants from JSON config
-    with open("config/model_variants.json") as f:
-        MODEL_CONFIGS = json.load(f)
+async def create_groq_model(history, variant, stream=False):
+    """
+    Call the variant's model, falling back to and hedging with its fallback models.
+    Returns the completion (or a stream that has produced its first token) and the
+    model that answered.
+    """
+    # Conversations created without a variant use the default one
+    config = registry.get(variant or DEFAULT_VARIANT)
 
-    config = MODEL_CONFIGS.get(variant)
+    async def call(model):
+        completion = await client.chat.completions.create(
+            messages=history,
+            max_tokens=config.max_tokens,
+            stream=stream,
+            model=model,
+            temperature=config.temperature,
+            presence_penalty=config.presence_penalty,
+            frequency_penalty=config.frequency_penalty,
+        )
+        return await prime(completion) if stream else completion
 
+    hedge_delay = config.hedge_delay_ms / 1000 if config.hedge_delay_ms else None
     try:
-        completion = client.chat.completions.create(
-            messages=history,
-            max_tokens=config["max_tokens"],
-            stream=False,
-            model=config["model"],
-            temperature=config["temperature"],
-            frequency_penalty=config["frequency_penalty"],
+        return await hedged_call(call, [config.model, *config.fallback_models], hedge_delay, variant)
+    except RateLimitError as e:
+        # Our own budget or Groq's is exhausted; tell the client when to come back
+        logger.warning("⏳ Groq rate limit", extra={"variant": variant, "error": str(e)})
+        raise HTTPException(
+            status_code=503,
+            detail="The model is busy. Please try again shortly.",
+            headers={"Retry-After": e.response.headers.get("retry-after", "5")},
         )
-        return completion
     except Exception as e:
-        print(f"❌ Error calling Groq API config {variant}: {e}")
+        variant_router.record(variant or DEFAULT_VARIANT, error=True)
+        logger.error("❌ Error calling Groq API", extra={"variant": variant, "error": str(e)})
         raise HTTPException(status_code=502, detail="Groq API failed. Please try again.")
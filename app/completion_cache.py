@@ -0,0 +1,206 @@
+import hashlib
+import json
+import os
+import re
+import time
+from collections import OrderedDict, defaultdict
+from datetime import timedelta
+from types import SimpleNamespace
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects import postgresql
+
+from app.log import get_logger
+from db.database import async_engine
+from db.models import CompletionCacheEntry, utcnow
+
+logger = get_logger("completion_cache")
+
+MAX_BYTES = int(os.getenv("COMPLETION_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+MAX_ENTRIES = int(os.getenv("COMPLETION_CACHE_MAX_ENTRIES", "10000"))
+TTL = float(os.getenv("COMPLETION_CACHE_TTL_SECONDS", "3600"))
+
+# Expired rows of the persistent tier are purged every this many writes
+PURGE_EVERY = 500
+
+ENTRY_OVERHEAD = 200
+
+_whitespace = re.compile(r"\s+")
+
+
+def normalize(content):
+    # Requests that only differ in spacing get the same reply
+    return _whitespace.sub(" ", content or "").strip()
+
+
+def completion_key(variant, messages):
+    """Hash of everything that shapes the reply: model, sampling parameters and messages."""
+    payload = {
+        "model": variant.model,
+        "temperature": variant.temperature,
+        "presence_penalty": variant.presence_penalty,
+        "frequency_penalty": variant.frequency_penalty,
+        "max_tokens": variant.max_tokens,
+        "messages": [[m["role"], normalize(m["content"])] for m in messages],
+    }
+    return hashlib.sha256(json.dumps(payload, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+
+class CachedCompletion:
+    __slots__ = ("reply", "latency_ms", "expires", "size")
+
+    def __init__(self, reply, latency_ms, expires):
+        self.reply = reply
+        self.latency_ms = latency_ms
+        self.expires = expires
+        self.size = ENTRY_OVERHEAD + len(reply)
+
+
+class CachedStream:
+    """Replays a cached reply where a Groq stream is expected."""
+
+    def __init__(self, reply):
+        self.reply = reply
+
+    async def __aiter__(self):
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=self.reply))])
+
+    async def close(self):
+        pass
+
+
+class CompletionCache:
+    """
+    LRU of replies for identical requests, bounded by size and expired after a TTL.
+
+    Only variants that opt in, and sample at a low enough temperature, are cached. With
+    `persistent` set, misses fall back to the completion_cache table, so workers share
+    replies and keep them across restarts.
+    """
+
+    def __init__(self, max_bytes=MAX_BYTES, max_entries=MAX_ENTRIES, ttl=TTL, persistent=False):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.persistent = persistent
+        self.bytes = 0
+        self.evictions = 0
+        self._writes = 0
+        self._entries = OrderedDict()
+        self._stats = defaultdict(lambda: {"hits": 0, "persistent_hits": 0, "misses": 0, "saved_ms": 0})
+
+    @staticmethod
+    def eligible(variant):
+        return variant.completion_cache and variant.temperature <= variant.completion_cache_max_temperature
+
+    def _get_local(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires <= time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _put_local(self, key, reply, latency_ms, ttl):
+        self._remove(key)
+        entry = CachedCompletion(reply, latency_ms, time.monotonic() + ttl)
+        self._entries[key] = entry
+        self.bytes += entry.size
+        while self._entries and (self.bytes > self.max_bytes or len(self._entries) > self.max_entries):
+            _, evicted = self._entries.popitem(last=False)
+            self.bytes -= evicted.size
+            self.evictions += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry.size
+
+    async def get(self, key, variant_name):
+        """The cached reply for `key`, or None. Counts a hit or miss for the variant."""
+        stats = self._stats[variant_name]
+        entry = self._get_local(key)
+        if entry is None and self.persistent:
+            entry = await self._get_persistent(key)
+            if entry is not None:
+                stats["persistent_hits"] += 1
+
+        if entry is None:
+            stats["misses"] += 1
+            return None
+        stats["hits"] += 1
+        stats["saved_ms"] += entry.latency_ms
+        return entry.reply
+
+    async def put(self, key, variant_name, reply, latency):
+        latency_ms = round(latency * 1000)
+        self._put_local(key, reply, latency_ms, self.ttl)
+        if self.persistent:
+            try:
+                await self._put_persistent(key, variant_name, reply, latency_ms)
+            except Exception as e:
+                # The reply was already sent; a missed write only costs a future hit
+                logger.warning("⚠️ Completion cache write failed: %s", e)
+
+    async def _get_persistent(self, key):
+        try:
+            async with async_engine.connect() as conn:
+                row = (await conn.execute(
+                    select(CompletionCacheEntry.reply, CompletionCacheEntry.latency_ms, CompletionCacheEntry.expires_at)
+                    .where(CompletionCacheEntry.key == key, CompletionCacheEntry.expires_at > utcnow())
+                )).first()
+        except Exception as e:
+            logger.warning("⚠️ Completion cache read failed: %s", e)
+            return None
+        if row is None:
+            return None
+
+        # Keep it in memory for the rest of its lifetime
+        ttl = (row.expires_at - utcnow()).total_seconds()
+        self._put_local(key, row.reply, row.latency_ms, ttl)
+        return self._entries[key]
+
+    async def _put_persistent(self, key, variant_name, reply, latency_ms):
+        now = utcnow()
+        stmt = postgresql.insert(CompletionCacheEntry.__table__).values(
+            key=key,
+            variant=variant_name,
+            reply=reply,
+            latency_ms=latency_ms,
+            created_at=now,
+            expires_at=now + timedelta(seconds=self.ttl),
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["key"],
+            set_={name: stmt.excluded[name] for name in ("reply", "latency_ms", "created_at", "expires_at")},
+        )
+        async with async_engine.begin() as conn:
+            await conn.execute(stmt)
+            self._writes += 1
+            if self._writes % PURGE_EVERY == 0:
+                await conn.execute(delete(CompletionCacheEntry).where(CompletionCacheEntry.expires_at <= now))
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+
+    def stats(self):
+        variants = {}
+        for name, stats in self._stats.items():
+            lookups = stats["hits"] + stats["misses"]
+            variants[name] = {**stats, "hit_rate": stats["hits"] / lookups if lookups else None}
+        return {
+            "persistent": self.persistent,
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+            "variants": variants,
+        }
+
+
+completion_cache = CompletionCache(
+    persistent=os.getenv("COMPLETION_CACHE_BACKEND") == "postgres" and async_engine.dialect.name == "postgresql"
+)
@@ -0,0 +1,201 @@
+import math
+import time
+
+from sqlalchemy import select
+
+from app.llm import client
+from app.log import get_logger
+from app.message_writer import message_writer
+from app.rate_limit import background
+from app.retrieval import knowledge_index, knowledge_message
+from app.telemetry import llm_call
+from app.variants import DEFAULT_VARIANT, registry
+from db.database import AsyncSessionLocal
+from db.models import ConversationSummary, Message
+
+logger = get_logger("context")
+
+# Approximate characters per token for each model family. Groq serves models whose
+# tokenizers aren't available locally, so counts err on the high side to stay in budget.
+CHARS_PER_TOKEN = {
+    "llama3": 3.5,
+    "llama-3": 3.5,
+    "gemma": 3.5,
+    "mixtral": 3.2,
+}
+DEFAULT_CHARS_PER_TOKEN = 3.0
+
+# Role markers and separators the chat template adds to every message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Headroom for tokenizer drift between the estimate and the real count
+SAFETY_MARGIN_TOKENS = 128
+
+# When compacting, fold enough old turns that the kept history uses at most this share
+# of the budget, so the summary is only rewritten every few turns
+COMPACT_TARGET = 0.5
+
+# Conversations currently being compacted by this process
+_compacting = set()
+
+
+def chars_per_token(model):
+    for prefix, ratio in CHARS_PER_TOKEN.items():
+        if model.startswith(prefix):
+            return ratio
+    return DEFAULT_CHARS_PER_TOKEN
+
+
+def count_tokens(text, model):
+    return math.ceil(len(text or "") / chars_per_token(model))
+
+
+def count_message_tokens(content, model):
+    return count_tokens(content, model) + MESSAGE_OVERHEAD_TOKENS
+
+
+def history_budget(variant, system_tokens):
+    """Tokens left for conversation turns once the system context and the reply are reserved."""
+    available = variant.context_window - variant.max_tokens - system_tokens - SAFETY_MARGIN_TOKENS
+    if variant.history_budget is not None:
+        available = min(available, variant.history_budget)
+    return max(available, 0)
+
+
+def knowledge_context(query, variant):
+    """
+    A system message with the indexed chunks most relevant to `query`, best first,
+    within the variant's retrieval budget. Empty when retrieval is off or nothing matches.
+    """
+    if not variant.retrieval_top_k:
+        return []
+    model = variant.model
+    selected = []
+    used = count_message_tokens(knowledge_message([])["content"], model)
+    for chunk, _ in knowledge_index.search(query, variant.retrieval_top_k):
+        cost = count_tokens(chunk, model)
+        if used + cost <= variant.retrieval_budget:
+            selected.append(chunk)
+            used += cost
+    return [knowledge_message(selected)] if selected else []
+
+
+def summary_message(summary):
+    return {
+        "role": "system",
+        "content": f"Summary of the earlier conversation: {summary.content}"
+    }
+
+
+def assemble_context(system_context, summary, turns, variant):
+    """
+    Build the messages for a turn within the variant's token budget.
+
+    `turns` are (role, content) pairs in conversation order. The system prompt, knowledge
+    sources and rolling summary are always sent. The rest of the budget is filled with the
+    most recent turns not yet covered by the summary. Returns the messages and, when older
+    turns no longer fit, the index up to which they should be folded into the summary
+    (None otherwise).
+    """
+    model = variant.model
+    summarized = summary.message_count if summary else 0
+
+    system_context = list(system_context)
+    if summary and summary.content:
+        system_context.append(summary_message(summary))
+
+    budget = history_budget(variant, sum(count_message_tokens(m["content"], model) for m in system_context))
+    costs = [count_message_tokens(content, model) for _, content in turns]
+
+    # Walk back from the newest turn; the latest user message is always kept
+    start = len(turns)
+    used = 0
+    while start > summarized:
+        cost = costs[start - 1]
+        if used + cost > budget and start < len(turns):
+            break
+        used += cost
+        start -= 1
+
+    compact_until = None
+    if start > summarized:
+        compact_until = start
+        while compact_until < len(turns) - 1 and used > budget * COMPACT_TARGET:
+            used -= costs[compact_until]
+            compact_until += 1
+
+    return system_context + [
+        {"role": role, "content": content} for role, content in turns[start:]
+    ], compact_until
+
+
+def compaction_prompt(summary_text, turns):
+    transcript = "\n".join(
+        f"{'User' if role == 'user' else 'Assistant'}: {content}" for role, content in turns
+    )
+    return f"""
+        Update the running summary of a conversation between a user and an assistant.
+        Keep the facts, names, preferences, decisions and open questions that later turns
+        may rely on. Be concise and write in the third person.
+
+        Current summary:
+        {summary_text or "(none)"}
+
+        New turns to fold in:
+        {transcript}
+
+        Return ONLY the updated summary.
+        """
+
+
+async def compact_summary(conversation_id, variant_name, compact_until):
+    """Fold the turns before `compact_until` into the conversation's persisted summary."""
+    if conversation_id in _compacting:
+        return
+    _compacting.add(conversation_id)
+
+    db = AsyncSessionLocal()
+    try:
+        await message_writer.sync(conversation_id)
+        variant = registry.get(variant_name or DEFAULT_VARIANT)
+        summary = await db.get(ConversationSummary, conversation_id)
+        if not summary:
+            summary = ConversationSummary(conversation_id=conversation_id, content="", message_count=0)
+            db.add(summary)
+
+        start = summary.message_count or 0
+        if compact_until <= start:
+            return
+
+        rows = await db.execute(
+            select(Message.role, Message.content)
+            .filter_by(conversation_id=conversation_id)
+            .where(Message.seq > start, Message.seq <= compact_until)
+            .order_by(Message.seq)
+        )
+        turns = rows.all()
+        if not turns:
+            return
+
+        # Runs after the reply was sent, so it yields to interactive calls
+        started = time.perf_counter()
+        with background():
+            res = await client.chat.completions.create(
+                model=variant.model,
+                messages=[{"role": "user", "content": compaction_prompt(summary.content, turns)}],
+                temperature=0.2,
+                max_tokens=variant.summary_max_tokens,
+            )
+
+        db.add(llm_call("summary", variant.model, res, started))
+        summary.content = res.choices[0].message.content.strip()
+        summary.message_count = start + len(turns)
+        await db.commit()
+        logger.info("🗜️ Compacted %d turns into summary for conversation %s", len(turns), conversation_id)
+
+    except Exception as e:
+        await db.rollback()
+        logger.error("❌ Summary compaction failed for conversation %s: %s", conversation_id, e)
+    finally:
+        _compacting.discard(conversation_id)
+        await db.close()
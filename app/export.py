@@ -0,0 +1,212 @@
+"""
+Streaming export of conversations for offline evaluation.
+
+Conversations, archived ones included, are read newest first through the server-side
+cursor of `/talks-data/stream` and written to numbered shards of SHARD_SIZE
+conversations each, as gzipped NDJSON or, with pyarrow installed, Parquet. Memory
+stays flat whatever the size of the export: NDJSON holds one conversation at a time,
+Parquet one shard.
+
+A shard appears under its final name once complete, and `checkpoint.json` then records
+the cursor after its last conversation. An interrupted export run again on the same
+directory resumes from there.
+"""
+import gzip
+import json
+import os
+import resource
+import time
+from pathlib import Path
+
+from app.log import get_logger
+from app.talks import encode_cursor, iter_conversations
+
+logger = get_logger("export")
+
+EXPORT_DIR = os.getenv("EXPORT_DIR", "data/export")
+
+# Conversations per shard
+SHARD_SIZE = int(os.getenv("EXPORT_SHARD_SIZE", "10000"))
+
+# zlib's own default; gzip's 9 is noticeably slower for slightly smaller shards
+COMPRESS_LEVEL = 6
+
+CHECKPOINT = "checkpoint.json"
+
+FORMATS = ("ndjson", "parquet")
+
+
+class NdjsonShard:
+    suffix = ".ndjson.gz"
+
+    def __init__(self, path):
+        self.path = path
+        self._tmp = path.with_name(f".{path.name}.tmp")
+        self._file = gzip.open(self._tmp, "wt", compresslevel=COMPRESS_LEVEL, encoding="utf-8")
+
+    def write(self, conversation):
+        self._file.write(json.dumps(conversation) + "\n")
+
+    def commit(self):
+        self._file.close()
+        os.replace(self._tmp, self.path)
+
+    def abort(self):
+        self._file.close()
+        self._tmp.unlink(missing_ok=True)
+
+
+def parquet_schema(pa):
+    message = pa.struct([
+        ("role", pa.string()),
+        ("content", pa.string()),
+        ("model", pa.string()),
+        ("timestamp", pa.string()),
+        ("thumbs_up", pa.bool_()),
+        ("thumbs_down", pa.bool_()),
+        ("feedback_text", pa.string()),
+    ])
+    return pa.schema([
+        ("conversation_id", pa.string()),
+        ("config", pa.string()),
+        ("started_at", pa.string()),
+        ("archived", pa.bool_()),
+        ("messages", pa.list_(message)),
+    ])
+
+
+class ParquetShard:
+    """One Parquet file per shard; its conversations are buffered until it is written."""
+    suffix = ".parquet"
+
+    def __init__(self, path):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)")
+        self._pa, self._pq = pa, pq
+        self.path = path
+        self._rows = []
+
+    def write(self, conversation):
+        self._rows.append(conversation)
+
+    def commit(self):
+        table = self._pa.Table.from_pylist(self._rows, schema=parquet_schema(self._pa))
+        tmp = self.path.with_name(f".{self.path.name}.tmp")
+        self._pq.write_table(table, tmp, compression="zstd")
+        os.replace(tmp, self.path)
+        self._rows = []
+
+    def abort(self):
+        self._rows = []
+
+
+SHARDS = {"ndjson": NdjsonShard, "parquet": ParquetShard}
+
+
+def shard_path(directory, fmt, index):
+    return Path(directory) / f"conversations-{index:05d}{SHARDS[fmt].suffix}"
+
+
+def filters_key(filters):
+    return {
+        "config": filters.config,
+        "since": filters.since.isoformat() if filters.since else None,
+        "until": filters.until.isoformat() if filters.until else None,
+        "has_feedback": filters.has_feedback,
+    }
+
+
+def load_checkpoint(directory, fmt, filters):
+    """The checkpoint of an export into `directory`, or a fresh one. An export can only resume as itself."""
+    path = Path(directory) / CHECKPOINT
+    fresh = {
+        "format": fmt, "filters": filters_key(filters), "cursor": None,
+        "shards": 0, "conversations": 0, "messages": 0, "done": False,
+    }
+    if not path.exists():
+        return fresh
+    checkpoint = json.loads(path.read_text())
+    if (checkpoint["format"], checkpoint["filters"]) != (fresh["format"], fresh["filters"]):
+        raise ValueError(f"{directory} holds an export with other settings: {checkpoint['format']}, {checkpoint['filters']}")
+    return checkpoint
+
+
+def save_checkpoint(directory, checkpoint):
+    path = Path(directory) / CHECKPOINT
+    tmp = path.with_name(f".{CHECKPOINT}.tmp")
+    tmp.write_text(json.dumps(checkpoint))
+    os.replace(tmp, path)
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def run_export(filters, directory=EXPORT_DIR, fmt="ndjson", shard_size=SHARD_SIZE):
+    """
+    Export the conversations matching `filters` (a `TalksFilters`) into `directory`,
+    resuming a previous run there. Returns the checkpoint, with this run's throughput.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format {fmt!r}")
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    checkpoint = load_checkpoint(directory, fmt, filters)
+    if checkpoint["cursor"]:
+        logger.info("⏩ Resuming export after %d conversations", checkpoint["conversations"])
+
+    started = time.perf_counter()
+    conversations = messages = 0
+    # The shard being written, and what it holds so far
+    shard = None
+    in_shard = {"conversations": 0, "messages": 0}
+
+    def commit(last):
+        nonlocal shard
+        shard.commit()
+        checkpoint["shards"] += 1
+        for name in in_shard:
+            checkpoint[name] += in_shard[name]
+            in_shard[name] = 0
+        checkpoint["cursor"] = encode_cursor(last)
+        save_checkpoint(directory, checkpoint)
+        elapsed = time.perf_counter() - started
+        logger.info("📤 Wrote %s (%.0f messages/s)", shard.path.name, messages / elapsed if elapsed else 0)
+        shard = None
+
+    if not checkpoint["done"]:
+        last = None
+        try:
+            async for last, conversation in iter_conversations(filters, checkpoint["cursor"]):
+                if shard is None:
+                    shard = SHARDS[fmt](shard_path(directory, fmt, checkpoint["shards"]))
+                conversation.setdefault("archived", False)
+                shard.write(conversation)
+                conversations += 1
+                messages += len(conversation["messages"])
+                in_shard["conversations"] += 1
+                in_shard["messages"] += len(conversation["messages"])
+                if in_shard["conversations"] >= shard_size:
+                    commit(last)
+            if shard is not None:
+                commit(last)
+        except BaseException:
+            # The checkpoint on disk still ends at the last complete shard
+            if shard is not None:
+                shard.abort()
+            raise
+        checkpoint["done"] = True
+        save_checkpoint(directory, checkpoint)
+
+    elapsed = time.perf_counter() - started
+    return {
+        **checkpoint,
+        "exported": conversations,
+        "seconds": round(elapsed, 3),
+        "conversations_per_second": round(conversations / elapsed, 1) if elapsed else None,
+        "messages_per_second": round(messages / elapsed, 1) if elapsed else None,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
@@ -0,0 +1,127 @@
+import asyncio
+
+from groq import APIConnectionError, APIStatusError
+
+from app.log import get_logger
+from app.metrics import GROQ_ERRORS, GROQ_HEDGE_WINS, GROQ_HEDGES
+
+logger = get_logger("hedging")
+
+
+class PrimedStream:
+    """
+    A Groq stream that has already produced its first token.
+
+    The chunks read while waiting for it are replayed first, so the consumer sees the
+    whole stream.
+    """
+
+    def __init__(self, stream, iterator, chunks):
+        self.stream = stream
+        self.iterator = iterator
+        self.chunks = chunks
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield chunk
+        async for chunk in self.iterator:
+            yield chunk
+
+    async def close(self):
+        await self.stream.close()
+
+
+async def prime(stream):
+    """Read `stream` up to its first token, so a stalled stream counts as a slow call."""
+    iterator = stream.__aiter__()
+    chunks = []
+    try:
+        async for chunk in iterator:
+            chunks.append(chunk)
+            if chunk.choices and chunk.choices[0].delta.content:
+                break
+    except BaseException:
+        await stream.close()
+        raise
+    return PrimedStream(stream, iterator, chunks)
+
+
+def error_label(e):
+    if isinstance(e, APIStatusError):
+        return str(e.status_code)
+    return "connection" if isinstance(e, APIConnectionError) else "error"
+
+
+async def discard(task):
+    """Cancel a losing attempt, closing its stream if it already has one."""
+    task.cancel()
+    try:
+        result = await task
+    except BaseException:
+        return
+    if isinstance(result, PrimedStream):
+        await result.close()
+
+
+async def hedged_call(call, models, hedge_delay=None, variant=None):
+    """
+    Call `call(model)` on the first model, and return (result, model) for the first
+    attempt that succeeds.
+
+    When an attempt fails, the next model in `models` is tried at once. With a
+    `hedge_delay` (seconds), the next model is also started when the running attempts
+    haven't answered by then, and the first to answer wins. Losers are cancelled. If
+    every model fails, the first model's error is raised.
+    """
+    attempts = {}
+    errors = []
+    next_model = 0
+
+    def launch(reason):
+        nonlocal next_model
+        model = models[next_model]
+        if next_model:
+            GROQ_HEDGES.labels(variant or "none", reason).inc()
+            logger.info("🔁 Backup request", extra={"variant": variant, "model": model, "reason": reason})
+        attempts[asyncio.ensure_future(call(model))] = next_model
+        next_model += 1
+
+    launch(None)
+    try:
+        while True:
+            can_hedge = hedge_delay is not None and next_model < len(models)
+            done, _ = await asyncio.wait(
+                attempts, timeout=hedge_delay if can_hedge else None, return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                launch("slow")
+                continue
+
+            # Of attempts finishing together, the earlier model in the chain wins
+            for task in sorted(done, key=attempts.get):
+                index = attempts.pop(task)
+                if task.exception() is None:
+                    if index:
+                        GROQ_HEDGE_WINS.labels(variant or "none", models[index]).inc()
+                    for loser in [*done, *attempts]:
+                        if loser is not task:
+                            await discard(loser)
+                    attempts.clear()
+                    return task.result(), models[index]
+
+                e = task.exception()
+                errors.append((index, e))
+                GROQ_ERRORS.labels(error_label(e)).inc()
+                if len(models) > 1:
+                    logger.warning("⚠️ Groq call failed", extra={
+                        "variant": variant, "model": models[index], "error": str(e),
+                    })
+
+            if not attempts:
+                if next_model >= len(models):
+                    raise min(errors, key=lambda error: error[0])[1]
+                launch("error")
+    finally:
+        # Cancelled by the caller (client gone) or failed: nothing may keep running
+        for task in attempts:
+            await discard(task)
@@ -0,0 +1,188 @@
+import asyncio
+import os
+import sys
+import uuid
+from collections import OrderedDict
+
+from sqlalchemy import text
+
+from app.log import get_logger
+from db.database import async_engine
+
+logger = get_logger("history_cache")
+
+# Postgres channel used to tell the other workers a conversation's history changed
+CHANNEL = "conversation_history"
+
+# Identifies this process in notifications so it ignores its own writes
+WORKER_ID = uuid.uuid4().hex[:12]
+
+MAX_BYTES = int(os.getenv("HISTORY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+MAX_CONVERSATIONS = int(os.getenv("HISTORY_CACHE_MAX_CONVERSATIONS", "10000"))
+
+# Rough per-object costs used to keep the cache under its memory cap
+ENTRY_OVERHEAD = 200
+TURN_OVERHEAD = 120
+
+ROLES = {role: sys.intern(role) for role in ("system", "user", "assistant")}
+
+
+class CachedHistory:
+    __slots__ = ("turns", "size")
+
+    def __init__(self, turns):
+        self.turns = turns
+        self.size = ENTRY_OVERHEAD + sum(TURN_OVERHEAD + len(content) for _, content in turns)
+
+
+def make_turn(role, content):
+    return (ROLES.get(role, role), content)
+
+
+class HistoryCache:
+    """
+    Bounded LRU of conversation histories as (role, content) tuples.
+
+    Writes go to the database first and are then appended here, so a conversation that
+    stays hot is never read back. Other workers drop their copy when they are notified
+    of the write. While that notification channel is down the cache is inactive, since
+    stale entries could not be detected.
+    """
+
+    def __init__(self, max_bytes=MAX_BYTES, max_conversations=MAX_CONVERSATIONS):
+        self.max_bytes = max_bytes
+        self.max_conversations = max_conversations
+        self.active = True
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def get(self, conversation_id):
+        entry = self._entries.get(conversation_id) if self.active else None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(conversation_id)
+        self.hits += 1
+        return entry.turns
+
+    def put(self, conversation_id, turns):
+        turns = [make_turn(role, content) for role, content in turns]
+        if not self.active:
+            return turns
+
+        self.invalidate(conversation_id)
+        entry = CachedHistory(turns)
+        self._entries[conversation_id] = entry
+        self.bytes += entry.size
+        self._evict()
+        return turns
+
+    def append(self, conversation_id, role, content):
+        """Write-through for a message that was just committed. No-op if not cached."""
+        entry = self._entries.get(conversation_id)
+        if entry is None:
+            return
+        entry.turns.append(make_turn(role, content))
+        added = TURN_OVERHEAD + len(content)
+        entry.size += added
+        self.bytes += added
+        self._entries.move_to_end(conversation_id)
+        self._evict()
+
+    def invalidate(self, conversation_id):
+        entry = self._entries.pop(conversation_id, None)
+        if entry is not None:
+            self.bytes -= entry.size
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+
+    def _evict(self):
+        while self._entries and (
+            self.bytes > self.max_bytes or len(self._entries) > self.max_conversations
+        ):
+            _, entry = self._entries.popitem(last=False)
+            self.bytes -= entry.size
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "active": self.active,
+            "conversations": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else None,
+            "evictions": self.evictions,
+        }
+
+
+history_cache = HistoryCache()
+
+
+async def notify_history_changed(db, conversation_id):
+    """Queue an invalidation for the other workers. Delivered by Postgres on commit."""
+    if db.bind.dialect.name != "postgresql":
+        return
+    await db.execute(
+        text("SELECT pg_notify(:channel, :payload)"),
+        {"channel": CHANNEL, "payload": f"{WORKER_ID} {conversation_id}"},
+    )
+
+
+async def notify_histories_changed(conn, conversation_ids):
+    """Same as notify_history_changed for a batch of conversations, in one statement."""
+    if conn.dialect.name != "postgresql" or not conversation_ids:
+        return
+    await conn.execute(
+        text("SELECT pg_notify(:channel, payload) FROM unnest(CAST(:payloads AS text[])) AS payload"),
+        {"channel": CHANNEL, "payloads": [f"{WORKER_ID} {conversation_id}" for conversation_id in conversation_ids]},
+    )
+
+
+def _on_notify(connection, pid, channel, payload):
+    worker_id, _, conversation_id = payload.partition(" ")
+    if worker_id != WORKER_ID:
+        history_cache.invalidate(uuid.UUID(conversation_id))
+
+
+async def listen_for_invalidations(retry_delay=1.0):
+    """Keep a LISTEN connection open; the cache is only trusted while it is."""
+    while True:
+        lost = asyncio.Event()
+        try:
+            async with async_engine.connect() as conn:
+                raw = await conn.get_raw_connection()
+                listener = raw.driver_connection
+                listener.add_termination_listener(lambda _: lost.set())
+                await listener.add_listener(CHANNEL, _on_notify)
+
+                history_cache.active = True
+                logger.info("👂 Listening for conversation history invalidations")
+                try:
+                    await lost.wait()
+                finally:
+                    history_cache.active = False
+                    history_cache.clear()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("⚠️ History cache invalidation listener failed: %s", e)
+
+        history_cache.active = False
+        history_cache.clear()
+        await asyncio.sleep(retry_delay)
+
+
+def start_invalidation_listener():
+    """Start cross-worker invalidation. Without Postgres there is a single process to keep coherent."""
+    if async_engine.dialect.name != "postgresql":
+        return None
+    history_cache.active = False
+    return asyncio.create_task(listen_for_invalidations())
@@ -0,0 +1,258 @@
+"""
+Idempotency keys for /chat.
+
+A client sends an `Idempotency-Key` header with a turn, and the same key again when it
+retries it. The first request with a key claims it and runs the turn; a duplicate never
+calls the model or stores a message. While the turn is in flight on this worker, a
+duplicate follows it token by token. In flight on another worker, it waits for the turn
+to finish. Once finished, the stored reply is replayed. A turn that fails releases its
+key, so a retry runs it again.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+from datetime import timedelta
+
+from fastapi import HTTPException
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app.log import get_logger
+from db.database import async_engine
+from db.models import IdempotencyKey, utcnow
+
+logger = get_logger("idempotency")
+
+MAX_KEY_LENGTH = 255
+
+# How long a finished turn can be replayed
+TTL = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+# A key pending for longer belongs to a worker that died mid-turn and can be claimed again
+PENDING_TIMEOUT = float(os.getenv("IDEMPOTENCY_PENDING_TIMEOUT_SECONDS", "300"))
+# How long a duplicate waits for a turn in flight on another worker
+WAIT = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "30"))
+POLL_INTERVAL = 0.2
+
+# Expired keys are purged every this many claims
+PURGE_EVERY = 500
+
+INTERRUPTED = "The reply was interrupted."
+
+
+def fingerprint(message, conversation_id):
+    payload = json.dumps([conversation_id, message], separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def check_fingerprint(turn, digest):
+    if turn.fingerprint != digest:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+
+
+def still_in_progress():
+    return HTTPException(
+        status_code=409,
+        detail="A request with this Idempotency-Key is still in progress",
+        headers={"Retry-After": "1"},
+    )
+
+
+class KeyedTurn:
+    """A turn sent with an idempotency key, as its owner runs it and its duplicates see it."""
+
+    def __init__(self, key, digest):
+        self.key = key
+        self.fingerprint = digest
+        self.conversation_id = None
+        self.message_id = None
+        self.parts = []
+        self.complete = None
+        # (status_code, detail, headers) of a turn that failed
+        self.error = None
+        self.done = False
+        self._changed = asyncio.Event()
+
+    @classmethod
+    def stored(cls, row):
+        turn = cls(row.key, row.fingerprint)
+        turn.conversation_id, turn.message_id = row.conversation_id, row.message_id
+        turn.parts, turn.complete, turn.done = [row.reply], row.complete, True
+        return turn
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def start(self, conversation_id, message_id):
+        self.conversation_id, self.message_id = conversation_id, message_id
+        self._notify()
+
+    def publish(self, delta):
+        self.parts.append(delta)
+        self._notify()
+
+    def finish(self, reply, complete=True):
+        # A turn that wasn't streamed publishes its reply in one piece
+        if not self.parts:
+            self.parts.append(reply)
+        self.complete = complete
+        self.done = True
+        self._notify()
+
+    def fail(self, status_code, detail, headers=None):
+        self.error = (status_code, detail, headers)
+        self.done = True
+        self._notify()
+
+    async def wait(self, started=False):
+        """Until the turn is done, or with `started` until it has a reply id."""
+        while not (self.done or (started and self.message_id is not None)):
+            await self._changed.wait()
+
+    def result(self):
+        return {
+            "reply": "".join(self.parts),
+            "conversation_id": str(self.conversation_id),
+            "message_id": str(self.message_id),
+        }
+
+    async def events(self):
+        """The turn from its beginning as (event, data), the Server-Sent Events of /chat."""
+        sent = 0
+        started = False
+        while True:
+            # Taken before reading the state, so no change in between goes unnoticed
+            changed = self._changed
+            if not started and self.message_id is not None:
+                started = True
+                yield "start", {"conversation_id": str(self.conversation_id), "message_id": str(self.message_id)}
+            while started and sent < len(self.parts):
+                yield "token", {"content": self.parts[sent]}
+                sent += 1
+            if self.done:
+                if self.error is not None:
+                    yield "error", {"detail": self.error[1]}
+                elif not self.complete:
+                    yield "error", {"detail": INTERRUPTED}
+                else:
+                    yield "done", {
+                        "conversation_id": str(self.conversation_id),
+                        "message_id": str(self.message_id),
+                        "ttft_ms": None,
+                        "total_ms": None,
+                    }
+                return
+            await changed.wait()
+
+
+class IdempotencyKeys:
+    def __init__(self, ttl=TTL, pending_timeout=PENDING_TIMEOUT, wait=WAIT):
+        self.ttl = ttl
+        self.pending_timeout = pending_timeout
+        self.wait = wait
+        self.replays = 0
+        self._claims = 0
+        # Turns this worker is running, by key
+        self._turns = {}
+
+    async def begin(self, key, message, conversation_id=None):
+        """
+        Claim `key` for a turn. Returns (turn, owner): the caller runs the turn when it is
+        the owner, and otherwise responds with the turn it duplicates.
+        """
+        if not key or len(key) > MAX_KEY_LENGTH:
+            raise HTTPException(status_code=400, detail="Invalid Idempotency-Key")
+        digest = fingerprint(message, conversation_id)
+        deadline = time.monotonic() + self.wait
+        while True:
+            turn = self._turns.get(key)
+            if turn is not None:
+                return self._replay(turn, digest), False
+            if await self._claim(key, digest):
+                turn = self._turns[key] = KeyedTurn(key, digest)
+                return turn, True
+
+            async with async_engine.connect() as conn:
+                row = (await conn.execute(select(IdempotencyKey).where(IdempotencyKey.key == key))).first()
+            if row is None:
+                # Released by a failed turn since, so this request runs it
+                continue
+            if row.status == "done":
+                return self._replay(KeyedTurn.stored(row), digest), False
+            check_fingerprint(row, digest)
+            # In flight on another worker
+            if time.monotonic() >= deadline:
+                raise still_in_progress()
+            await asyncio.sleep(POLL_INTERVAL)
+
+    async def follow(self, turn, started=False):
+        """Wait on a turn in flight on this worker, as long as on one in flight elsewhere."""
+        try:
+            await asyncio.wait_for(turn.wait(started), self.wait)
+        except asyncio.TimeoutError:
+            raise still_in_progress()
+
+    def _replay(self, turn, digest):
+        check_fingerprint(turn, digest)
+        self.replays += 1
+        return turn
+
+    async def _claim(self, key, digest):
+        now = utcnow()
+        insert = postgresql.insert if async_engine.dialect.name == "postgresql" else sqlite.insert
+        values = {
+            "fingerprint": digest, "status": "pending", "conversation_id": None, "message_id": None,
+            "reply": None, "complete": None, "created_at": now,
+            "expires_at": now + timedelta(seconds=self.pending_timeout),
+        }
+        stmt = insert(IdempotencyKey.__table__).values(key=key, **values)
+        # An expired key is free again, whatever it was
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["key"],
+            set_={name: stmt.excluded[name] for name in values},
+            where=IdempotencyKey.__table__.c.expires_at <= now,
+        ).returning(IdempotencyKey.__table__.c.key)
+        async with async_engine.begin() as conn:
+            claimed = (await conn.execute(stmt)).first() is not None
+            self._claims += 1
+            if self._claims % PURGE_EVERY == 0:
+                await conn.execute(delete(IdempotencyKey).where(IdempotencyKey.expires_at <= now))
+        return claimed
+
+    async def save(self, db, turn, reply, complete=True):
+        """Store the reply of `turn` in the caller's transaction, for duplicates to replay."""
+        now = utcnow()
+        await db.execute(
+            update(IdempotencyKey)
+            .where(IdempotencyKey.key == turn.key, IdempotencyKey.fingerprint == turn.fingerprint)
+            .values(
+                status="done", conversation_id=turn.conversation_id, message_id=turn.message_id,
+                reply=reply, complete=complete, expires_at=now + timedelta(seconds=self.ttl),
+            )
+        )
+
+    def finish(self, turn, reply, complete=True):
+        """Hand the committed reply to the duplicates following `turn`."""
+        self._turns.pop(turn.key, None)
+        turn.finish(reply, complete)
+
+    async def fail(self, turn, status_code, detail, headers=None):
+        """Release the key of a turn that got no reply; its duplicates get the same error."""
+        self._turns.pop(turn.key, None)
+        turn.fail(status_code, detail, headers)
+        try:
+            async with async_engine.begin() as conn:
+                await conn.execute(delete(IdempotencyKey).where(
+                    IdempotencyKey.key == turn.key, IdempotencyKey.status == "pending",
+                ))
+        except Exception as e:
+            # The key stays claimed until it expires
+            logger.warning("⚠️ Could not release idempotency key: %s", e)
+
+    def stats(self):
+        return {"in_flight": len(self._turns), "replays": self.replays}
+
+
+idempotency_keys = IdempotencyKeys()
@@ -0,0 +1,122 @@
+import uuid
+import weakref
+
+from sqlalchemy import event, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from db.models import (
+    Conversation,
+    KnowledgeSet,
+    KnowledgeSource,
+    PromptProfile,
+    content_hash,
+    knowledge_set_hash,
+    knowledge_set_items,
+)
+
+# Content hash -> row id for each engine. Content-addressed rows are never edited or
+# deleted, so a cached id stays valid and a hit needs no query at all.
+_resolved_ids = weakref.WeakKeyDictionary()
+
+
+def _cached_id(db, key):
+    pending = db.info.get("resolved_ids", {})
+    if key in pending:
+        return pending[key]
+    return _resolved_ids.get(db.get_bind(), {}).get(key)
+
+
+def _remember(db, key, row_id):
+    # Only shared once the transaction that may have inserted the row commits
+    db.info.setdefault("resolved_ids", {})[key] = row_id
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_resolved_ids(db):
+    pending = db.info.pop("resolved_ids", None)
+    if pending:
+        _resolved_ids.setdefault(db.get_bind(), {}).update(pending)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_resolved_ids(db):
+    db.info.pop("resolved_ids", None)
+
+
+def insert_missing(db, table, rows):
+    """Insert rows whose content_hash isn't stored yet. Safe against concurrent writers."""
+    dialect = db.get_bind().dialect.name
+    insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+    stmt = insert(table).values(rows).on_conflict_do_nothing(index_elements=["content_hash"])
+    return db.execute(stmt)
+
+
+def get_or_create_prompt_profile(db, system_prompt):
+    """Id of the PromptProfile holding this exact prompt, creating it if needed."""
+    key = ("prompt", content_hash(system_prompt))
+    cached = _cached_id(db, key)
+    if cached:
+        return cached
+
+    insert_missing(db, PromptProfile.__table__, [{
+        "id": uuid.uuid4(),
+        "content_hash": key[1],
+        "system_prompt": system_prompt,
+    }])
+    profile_id = db.scalar(select(PromptProfile.id).filter_by(content_hash=key[1]))
+    _remember(db, key, profile_id)
+    return profile_id
+
+
+def get_or_create_knowledge_set(db, sources):
+    """Id of the KnowledgeSet holding these sources in this order, or None if there are none."""
+    if not sources:
+        return None
+
+    hashes = [content_hash(src) for src in sources]
+    key = ("knowledge_set", knowledge_set_hash(hashes))
+    cached = _cached_id(db, key)
+    if cached:
+        return cached
+
+    unique_sources = {h: src for h, src in zip(hashes, sources)}
+    insert_missing(db, KnowledgeSource.__table__, [
+        {"id": uuid.uuid4(), "content_hash": h, "content": src}
+        for h, src in unique_sources.items()
+    ])
+    source_ids = dict(db.execute(
+        select(KnowledgeSource.content_hash, KnowledgeSource.id)
+        .where(KnowledgeSource.content_hash.in_(unique_sources))
+    ).all())
+
+    # The set and its items are written in the same transaction, so a concurrent writer
+    # that loses the insert race only sees the set once its items are committed too
+    set_id = uuid.uuid4()
+    created = insert_missing(db, KnowledgeSet.__table__, [{"id": set_id, "content_hash": key[1]}])
+    if created.rowcount == 1:
+        db.execute(knowledge_set_items.insert(), [
+            {"knowledge_set_id": set_id, "position": position, "knowledge_source_id": source_ids[h]}
+            for position, h in enumerate(hashes)
+        ])
+    else:
+        set_id = db.scalar(select(KnowledgeSet.id).filter_by(content_hash=key[1]))
+
+    _remember(db, key, set_id)
+    return set_id
+
+
+def replace_prompt_profile(db, old_profile_id, system_prompt):
+    """
+    Point every conversation using `old_profile_id` at the profile for `system_prompt`.
+
+    Profiles are immutable, so a refined prompt becomes its own row instead of an edit.
+    """
+    new_profile_id = get_or_create_prompt_profile(db, system_prompt)
+    if new_profile_id != old_profile_id:
+        db.execute(
+            update(Conversation)
+            .where(Conversation.prompt_profile_id == old_profile_id)
+            .values(prompt_profile_id=new_profile_id)
+        )
+    return new_profile_id
@@ -0,0 +1,86 @@
+import os
+import threading
+
+import httpx
+from dotenv import load_dotenv
+from groq import AsyncGroq, Groq
+
+from app.rate_limit import RateLimitedSyncTransport, RateLimitedTransport, create_limiter
+
+load_dotenv()
+
+
+GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+
+# Connection settings shared by every Groq client in the process.
+# Keep-alive connections are reused across requests instead of paying a TLS handshake per call.
+GROQ_TIMEOUT = httpx.Timeout(float(os.getenv("GROQ_TIMEOUT", "60")), connect=5.0)
+GROQ_LIMITS = httpx.Limits(
+    max_connections=int(os.getenv("GROQ_MAX_CONNECTIONS", "100")),
+    max_keepalive_connections=int(os.getenv("GROQ_MAX_KEEPALIVE", "20")),
+    keepalive_expiry=30,
+)
+
+# One request and token budget per model for every Groq call in the process
+limiter = create_limiter()
+
+
+def require_api_key():
+    if not GROQ_API_KEY:
+        raise ValueError("Missing GROQ_API_KEY in environment variables")
+    return GROQ_API_KEY
+
+
+def build_async_client():
+    return AsyncGroq(
+        api_key=require_api_key(),
+        http_client=httpx.AsyncClient(
+            timeout=GROQ_TIMEOUT,
+            transport=RateLimitedTransport(limiter, httpx.AsyncHTTPTransport(limits=GROQ_LIMITS)),
+        ),
+    )
+
+
+def build_sync_client():
+    return Groq(
+        api_key=require_api_key(),
+        http_client=httpx.Client(
+            timeout=GROQ_TIMEOUT,
+            transport=RateLimitedSyncTransport(limiter, httpx.HTTPTransport(limits=GROQ_LIMITS)),
+        ),
+    )
+
+
+class LazyClient:
+    """
+    Builds its Groq client on first use instead of at import.
+
+    Importing the app stays cheap (no TLS context, no connection pool) and doesn't
+    require GROQ_API_KEY; a missing key fails the first call instead.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._client = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._factory()
+        return self._client
+
+    @property
+    def built(self):
+        return self._client is not None
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+
+# Used by the request path (chat, feedback); never blocks the event loop
+client = LazyClient(build_async_client)
+
+# Used by the offline scripts, which run outside of an event loop
+sync_client = LazyClient(build_sync_client)
@@ -0,0 +1,77 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+from datetime import datetime, timezone
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "text" for people, "json" for log shippers
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+
+# Attributes every LogRecord has; anything else was passed in `extra`
+_RECORD_FIELDS = set(logging.makeLogRecord({}).__dict__) | {"message", "asctime", "taskName"}
+
+_listener = None
+
+
+def get_logger(name):
+    return logging.getLogger(f"noxus.{name}")
+
+
+def fields(record):
+    return {key: value for key, value in record.__dict__.items() if key not in _RECORD_FIELDS}
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **fields(record),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        line = super().format(record)
+        extra = fields(record)
+        if extra:
+            line += " " + " ".join(f"{key}={value}" for key, value in extra.items())
+        return line
+
+
+def configure_logging(level=LOG_LEVEL, fmt=LOG_FORMAT):
+    """
+    Send the app's log records to stdout from a background thread.
+
+    Callers only pay for a level check and, when enabled, a queue put; formatting and the
+    write happen off the event loop. Idempotent.
+    """
+    global _listener
+    logger = logging.getLogger("noxus")
+    logger.setLevel(level)
+    if _listener is not None:
+        return logger
+
+    handler = logging.StreamHandler(sys.stdout)
+    if fmt == "json":
+        handler.setFormatter(JSONFormatter())
+    else:
+        handler.setFormatter(TextFormatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    records = queue.SimpleQueue()
+    logger.addHandler(logging.handlers.QueueHandler(records))
+    logger.propagate = False
+    _listener = logging.handlers.QueueListener(records, handler)
+    _listener.start()
+    # Drain what is still queued when the process exits
+    atexit.register(_listener.stop)
+    return logger
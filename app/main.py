@@ -1,4 +1,6 @@
+import asyncio
 import os
+from contextlib import asynccontextmanager
 
 import uvicorn
 from fastapi import FastAPI
@@ -8,16 +10,73 @@ from fastapi.staticfiles import StaticFiles
 from app import chat
 from app import talks
 from app import feedback
+from app import ab_stats
+from app import admin
+from app import metrics
+from app.history_cache import start_invalidation_listener
+from app.llm import GROQ_API_KEY
+from app.log import configure_logging, get_logger
+from app.message_writer import message_writer
+from app.refinement import start_refinement_worker
+from app.retrieval import knowledge_index
+from app.routing import variant_router
+from app.turn_lock import conversation_locks
+from app.variants import registry
 
+from db.database import async_engine
 from db.init_db import init_db
 
-init_db()
+configure_logging()
+logger = get_logger("main")
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    # Schema setup happens here rather than at import, so importing the app stays cheap.
+    # Concurrent workers serialize on a Postgres advisory lock inside the migrations.
+    await asyncio.to_thread(init_db)
+    if not GROQ_API_KEY:
+        logger.warning("⚠️ GROQ_API_KEY is not set; chat requests will fail")
+
+    # Validate the model variants up front, then pick up edits in the background
+    registry.load()
+    variant_router.load()
+    # Built offline by app.scripts.ingest_knowledge; retrieval is off without it
+    await asyncio.to_thread(knowledge_index.load_if_present)
+    tasks = [asyncio.create_task(registry.watch())]
+
+    # Cached conversation histories are invalidated when another worker writes to them
+    listener = start_invalidation_listener()
+    if listener:
+        tasks.append(listener)
+
+    # Feedback-driven prompt refinement runs off the request path
+    worker = start_refinement_worker()
+    if worker:
+        tasks.append(worker)
+
+    # Write-behind message persistence, after replaying what a crash left in the journal
+    writer = await message_writer.start()
+    if writer:
+        tasks.append(writer)
+
+    yield
+    for task in tasks:
+        task.cancel()
+    # Buffered turns are written before the pool goes away
+    await message_writer.close()
+    await conversation_locks.close()
+    # Pooled connections belong to this event loop
+    await async_engine.dispose()
+
+
+app = FastAPI(lifespan=lifespan)
 app.include_router(chat.router)
 app.include_router(talks.router)
 app.include_router(feedback.router)
+app.include_router(ab_stats.router)
+app.include_router(admin.router)
+app.include_router(metrics.router)
 
 
 FRONTEND_PATH = os.getenv("FRONTEND_PATH", "frontend")
@@ -34,4 +93,9 @@ def serve_chat_page():
     return FileResponse(os.path.join(FRONTEND_PATH, "chat.html"))
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # WEB_CONCURRENCY > 1 starts that many worker processes, each with its own lifespan
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    if workers > 1:
+        uvicorn.run("app.main:app", host="0.0.0.0", port=8000, workers=workers)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,403 @@
+import asyncio
+import fcntl
+import json
+import os
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+from sqlalchemy import DateTime, Integer, String, Text, cast, column, func, select, true, values
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.dialects.postgresql import UUID
+
+from app.history_cache import notify_histories_changed
+from app.log import get_logger
+from app.variant_stats import count_written
+from db.database import async_engine
+from db.models import Conversation, Message, conversation_started_at, utcnow
+
+logger = get_logger("message_writer")
+
+WRITE_BEHIND = os.getenv("MESSAGE_WRITE_BEHIND") == "1"
+FLUSH_INTERVAL = float(os.getenv("MESSAGE_FLUSH_INTERVAL_MS", "50")) / 1000
+FLUSH_SIZE = int(os.getenv("MESSAGE_FLUSH_SIZE", "200"))
+# Past this many buffered messages, e.g. while the database is down, turns wait for a flush
+MAX_BUFFERED = int(os.getenv("MESSAGE_MAX_BUFFERED", "10000"))
+JOURNAL_DIR = os.getenv("MESSAGE_JOURNAL_DIR")
+JOURNAL_FSYNC = os.getenv("MESSAGE_JOURNAL_FSYNC") == "1"
+
+# Rows per INSERT, well under the bind parameter limits of Postgres and SQLite
+INSERT_CHUNK = 1000
+
+RETRY_DELAY = 1.0
+
+UUID_FIELDS = ("id", "conversation_id", "prompt_profile_id", "knowledge_set_id")
+DATETIME_FIELDS = ("started_at", "timestamp")
+
+# Fields of ReplyStats, stored on assistant messages
+REPLY_COLUMNS = (
+    ("model", String),
+    ("prompt_tokens", Integer),
+    ("completion_tokens", Integer),
+    ("ttft_ms", Integer),
+    ("latency_ms", Integer),
+)
+
+
+def insert_messages(insert, rows):
+    """
+    One multi-row INSERT of buffered messages.
+
+    Positions are assigned in the statement itself, after the latest stored message of
+    each conversation, in the order the messages were buffered.
+    """
+    batch = values(
+        column("id", UUID(as_uuid=True)),
+        column("conversation_id", UUID(as_uuid=True)),
+        column("position", Integer),
+        column("role", String),
+        column("content", Text),
+        *(column(name, type_) for name, type_ in REPLY_COLUMNS),
+        column("timestamp", DateTime),
+    ).data([
+        # Journals written by older versions lack the newer reply fields
+        (
+            row["id"], row["conversation_id"], row["position"], row["role"], row["content"],
+            *(row.get(name) for name, _ in REPLY_COLUMNS), row["timestamp"],
+        )
+        for row in rows
+    ]).cte("batch")
+    stored = (
+        select(func.coalesce(func.max(Message.seq), 0))
+        .where(Message.conversation_id == batch.c.conversation_id)
+        .scalar_subquery()
+    )
+    seq = stored + func.row_number().over(partition_by=batch.c.conversation_id, order_by=batch.c.position)
+    stmt = insert(Message.__table__).from_select(
+        [
+            "id", "conversation_id", "conversation_started_at", "seq", "role", "content",
+            *(name for name, _ in REPLY_COLUMNS), "timestamp",
+        ],
+        select(
+            batch.c.id, batch.c.conversation_id, conversation_started_at(batch.c.conversation_id), seq,
+            batch.c.role, batch.c.content,
+            # Postgres types a VALUES column of only NULLs as text
+            *(cast(batch.c[name], type_) for name, type_ in REPLY_COLUMNS), batch.c.timestamp,
+        )
+        # SQLite needs a WHERE to tell ON CONFLICT apart from a join constraint
+        .where(true()),
+    )
+    # Ids are assigned up front, so replaying a journal never duplicates a message
+    return stmt.on_conflict_do_nothing(index_elements=["id", "conversation_started_at"])
+
+
+async def write_rows(conn, conversations, messages):
+    insert = postgresql.insert if conn.dialect.name == "postgresql" else sqlite.insert
+    created, replied = [], []
+    for start in range(0, len(conversations), INSERT_CHUNK):
+        created += (await conn.execute(
+            insert(Conversation.__table__)
+            .values(conversations[start:start + INSERT_CHUNK])
+            .on_conflict_do_nothing(index_elements=["id"])
+            .returning(Conversation.id)
+        )).scalars()
+    for start in range(0, len(messages), INSERT_CHUNK):
+        inserted = await conn.execute(
+            insert_messages(insert, messages[start:start + INSERT_CHUNK]).returning(Message.conversation_id, Message.role)
+        )
+        replied += [conversation_id for conversation_id, role in inserted if role == "assistant"]
+    # Only rows actually inserted, so replaying a journal doesn't count a turn twice
+    await count_written(conn, created, replied)
+
+
+def decode_row(row):
+    for field in UUID_FIELDS:
+        if row.get(field):
+            row[field] = uuid.UUID(row[field])
+    for field in DATETIME_FIELDS:
+        if row.get(field):
+            row[field] = datetime.fromisoformat(row[field])
+    return row
+
+
+class Journal:
+    """
+    Append-only log of buffered turns, one JSON line each, split into segments.
+
+    A segment is deleted once the flush that covers it commits, so whatever is left in
+    the directory after a crash is what may not have reached the database. The segment
+    being written is locked, so recovery in another worker never replays a live one.
+    """
+
+    def __init__(self, directory, fsync=JOURNAL_FSYNC):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.fsync = fsync
+        self.closed = []
+        self._file = None
+
+    def append(self, record):
+        if self._file is None:
+            path = self.directory / f"messages-{os.getpid()}-{time.time_ns()}.ndjson"
+            self._file = open(path, "a", encoding="utf-8")
+            fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self._file.write(json.dumps(record, default=str) + "\n")
+        # Out of the process on every turn, so it survives a crash of the app
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def rotate(self):
+        """Close the live segment. Returns every segment not yet covered by a commit."""
+        if self._file is not None:
+            self._file.close()
+            self.closed.append(Path(self._file.name))
+            self._file = None
+        return list(self.closed)
+
+    def discard(self, segments):
+        for path in segments:
+            path.unlink(missing_ok=True)
+            self.closed.remove(path)
+
+    def orphans(self):
+        """Segments of processes that are gone, oldest first, each opened and locked."""
+        own = set(self.closed)
+        if self._file is not None:
+            own.add(Path(self._file.name))
+        paths = sorted(self.directory.glob("messages-*.ndjson"), key=lambda p: p.stat().st_mtime_ns)
+        for path in paths:
+            if path in own:
+                continue
+            try:
+                handle = open(path, "r", encoding="utf-8")
+            except FileNotFoundError:
+                continue
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                handle.close()
+                continue
+            yield path, handle
+
+
+def read_segment(handle):
+    conversations, messages = [], []
+    for line in handle:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            # A torn last line: that turn was never acknowledged
+            continue
+        if record.get("conversation"):
+            conversations.append(decode_row(record["conversation"]))
+        messages.extend(decode_row(row) for row in record["messages"])
+    return conversations, messages
+
+
+class MessageWriter:
+    """
+    Write-behind buffer for chat turns, enabled with MESSAGE_WRITE_BEHIND=1.
+
+    A turn is acknowledged once buffered (and journaled, with MESSAGE_JOURNAL_DIR). A
+    background task writes the buffer every `flush_interval` seconds, or as soon as
+    `flush_size` messages are waiting, with one multi-row INSERT per table in a single
+    transaction. Reads that must see this process's writes call `sync` first.
+    """
+
+    def __init__(
+        self,
+        enabled=WRITE_BEHIND,
+        flush_size=FLUSH_SIZE,
+        flush_interval=FLUSH_INTERVAL,
+        max_buffered=MAX_BUFFERED,
+        journal_dir=JOURNAL_DIR,
+    ):
+        self.enabled = enabled
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_buffered = max_buffered
+        self.journal = Journal(journal_dir) if enabled and journal_dir else None
+        self._conversations = []
+        self._messages = []
+        # Conversations with rows in the buffer, and in the flush under way
+        self._buffered = set()
+        self._in_flight = set()
+        # Message rows of the flush under way
+        self._flushing = []
+        self._position = 0
+        self._lock = None
+        self._wakeup = None
+        self._task = None
+        self.stats = {"flushes": 0, "messages_written": 0, "failures": 0, "recovered": 0, "last_flush_ms": None}
+
+    @property
+    def lock(self):
+        # Created on first use, inside the running event loop
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    async def add_turn(self, conversation_id, messages, conversation=None, stats=None):
+        """
+        Buffer the messages of a turn as (id, role, content), plus the conversation row
+        if `conversation` is new. `stats` (ReplyStats) are recorded on the assistant messages.
+        """
+        if len(self._messages) >= self.max_buffered:
+            # The database is falling behind; hold this turn until it catches up
+            await self.flush()
+
+        now = utcnow()
+        conversation_row = None
+        if conversation is not None:
+            conversation_row = {
+                "id": conversation.id,
+                "started_at": conversation.started_at or now,
+                "config": conversation.config,
+                "prompt_profile_id": conversation.prompt_profile_id,
+                "knowledge_set_id": conversation.knowledge_set_id,
+            }
+        reply_fields = stats.columns() if stats else {}
+        rows = []
+        for message_id, role, content in messages:
+            self._position += 1
+            rows.append({
+                "id": message_id,
+                "conversation_id": conversation_id,
+                "position": self._position,
+                "role": role,
+                "content": content,
+                "timestamp": now,
+                **(reply_fields if role == "assistant" else {}),
+            })
+
+        if self.journal:
+            self.journal.append({"conversation": conversation_row, "messages": rows})
+        if conversation_row:
+            self._conversations.append(conversation_row)
+        self._messages.extend(rows)
+        self._buffered.add(conversation_id)
+
+        if len(self._messages) >= self.flush_size and self._wakeup:
+            self._wakeup.set()
+
+    def pending(self, conversation_id=None):
+        if conversation_id is None:
+            return bool(self._buffered or self._in_flight)
+        return conversation_id in self._buffered or conversation_id in self._in_flight
+
+    def conversation_of(self, message_id):
+        """The conversation of `message_id` while the message is buffered or being flushed, else None."""
+        for rows in (self._messages, self._flushing):
+            for row in rows:
+                if row["id"] == message_id:
+                    return row["conversation_id"]
+        return None
+
+    async def sync(self, conversation_id=None):
+        """Flush if a read of `conversation_id`, or of any conversation, would miss buffered writes."""
+        if self.pending(conversation_id):
+            await self.flush()
+
+    async def flush(self):
+        async with self.lock:
+            if not self._messages and not self._conversations:
+                return
+            conversations, self._conversations = self._conversations, []
+            messages, self._messages = self._messages, []
+            self._in_flight, self._buffered = self._buffered, set()
+            self._flushing = messages
+            segments = self.journal.rotate() if self.journal else []
+            created = {row["id"] for row in conversations}
+
+            started = time.perf_counter()
+            try:
+                async with async_engine.begin() as conn:
+                    await write_rows(conn, conversations, messages)
+                    await notify_histories_changed(conn, self._in_flight - created)
+            except BaseException:
+                # Back at the front of the buffer, in order; the journal still covers them
+                self._conversations[:0] = conversations
+                self._messages[:0] = messages
+                self._buffered |= self._in_flight
+                self.stats["failures"] += 1
+                raise
+            finally:
+                self._in_flight = set()
+                self._flushing = []
+
+            if self.journal:
+                self.journal.discard(segments)
+            self.stats["flushes"] += 1
+            self.stats["messages_written"] += len(messages)
+            self.stats["last_flush_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+    async def run(self):
+        self._wakeup = asyncio.Event()
+        logger.info("✍️ Write-behind message persistence on, flushing every %.0f ms", self.flush_interval * 1000)
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("⚠️ Message flush failed, %d messages still buffered: %s", len(self._messages), e)
+                await asyncio.sleep(RETRY_DELAY)
+
+    async def recover(self):
+        """Write turns journaled by processes that died before flushing them."""
+        if not self.journal:
+            return 0
+        recovered = 0
+        for path, handle in self.journal.orphans():
+            with handle:
+                conversations, messages = read_segment(handle)
+                if messages or conversations:
+                    async with async_engine.begin() as conn:
+                        await write_rows(conn, conversations, messages)
+                path.unlink(missing_ok=True)
+            recovered += len(messages)
+        if recovered:
+            logger.info("♻️ Recovered %d journaled messages", recovered)
+        self.stats["recovered"] += recovered
+        return recovered
+
+    async def start(self):
+        """Recover the journal, then flush in the background until `close`."""
+        if not self.enabled:
+            return None
+        await self.recover()
+        self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def close(self):
+        """Stop the background task and write out everything still buffered."""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            kept = "kept in the journal" if self.journal else "lost"
+            logger.error("❌ Final message flush failed, %d messages %s: %s", len(self._messages), kept, e)
+        if self.journal:
+            self.journal.rotate()
+
+    def metrics(self):
+        return {
+            "enabled": self.enabled,
+            "buffered_messages": len(self._messages),
+            "buffered_conversations": len(self._buffered),
+            "journal": str(self.journal.directory) if self.journal else None,
+            **self.stats,
+        }
+
+
+message_writer = MessageWriter()
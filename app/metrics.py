@@ -0,0 +1,143 @@
+from fastapi import APIRouter, Response
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from app.completion_cache import completion_cache
+from app.history_cache import history_cache
+from app.idempotency import idempotency_keys
+from app.llm import limiter
+from app.message_writer import message_writer
+from app.refinement import worker_stats
+from app.routing import variant_router
+from app.turn_lock import conversation_locks
+
+router = APIRouter()
+
+# From a cached lookup to a long generation
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+CHAT_PHASE_SECONDS = Histogram(
+    "chat_phase_seconds",
+    "Duration of each phase of a chat turn: context_load, ttft, generation, persistence",
+    ["phase", "variant"],
+    buckets=LATENCY_BUCKETS,
+)
+CHAT_IN_FLIGHT = Gauge("chat_requests_in_flight", "Chat turns being handled, streams included")
+CHAT_REQUESTS = Counter("chat_requests", "Chat turns by variant and outcome", ["variant", "outcome"])
+GROQ_ERRORS = Counter("groq_errors", "Failed Groq calls by HTTP status, or the kind of failure", ["status"])
+LLM_TOKENS = Counter("llm_tokens", "Tokens reported by Groq", ["variant", "model", "kind"])
+GROQ_HEDGES = Counter("groq_hedges", "Backup requests to a variant's next model, by reason: slow or error",
+                      ["variant", "reason"])
+GROQ_HEDGE_WINS = Counter("groq_hedge_wins", "Replies that came from a backup request", ["variant", "model"])
+
+
+def observe_phase(phase, variant, seconds):
+    CHAT_PHASE_SECONDS.labels(phase, variant or "none").observe(seconds)
+
+
+def count_turn(variant, outcome):
+    CHAT_REQUESTS.labels(variant or "none", outcome).inc()
+
+
+def record_usage(usage, variant, model):
+    """Count the prompt and completion tokens of a Groq usage object, if there is one."""
+    if usage is None:
+        return
+    for kind in ("prompt", "completion"):
+        count = getattr(usage, f"{kind}_tokens", None)
+        if count:
+            LLM_TOKENS.labels(variant or "none", model, kind).inc(count)
+
+
+def chunk_usage(chunk):
+    # Groq reports usage on the last chunk of a stream, under x_groq
+    extra = getattr(chunk, "x_groq", None)
+    return getattr(extra, "usage", None) or getattr(chunk, "usage", None)
+
+
+class StatsCollector:
+    """Exposes the in-process stats of the caches, the rate limiter and the queues at scrape time."""
+
+    def collect(self):
+        history = history_cache.stats()
+        yield GaugeMetricFamily("history_cache_conversations", "Conversations in the history cache",
+                                value=history["conversations"])
+        yield GaugeMetricFamily("history_cache_bytes", "Estimated size of the history cache", value=history["bytes"])
+        yield CounterMetricFamily("history_cache_hits", "History cache hits", value=history["hits"])
+        yield CounterMetricFamily("history_cache_misses", "History cache misses", value=history["misses"])
+
+        completions = completion_cache.stats()
+        yield GaugeMetricFamily("completion_cache_bytes", "Estimated size of the completion cache",
+                                value=completions["bytes"])
+        lookups = CounterMetricFamily("completion_cache_lookups", "Completion cache lookups by result",
+                                      labels=["variant", "result"])
+        saved = CounterMetricFamily("completion_cache_saved_seconds", "Groq latency saved by cache hits",
+                                    labels=["variant"])
+        for variant, stats in completions["variants"].items():
+            lookups.add_metric([variant, "hit"], stats["hits"])
+            lookups.add_metric([variant, "miss"], stats["misses"])
+            saved.add_metric([variant], stats["saved_ms"] / 1000)
+        yield lookups
+        yield saved
+
+        limits = limiter.metrics()
+        available = GaugeMetricFamily("groq_budget_available", "Requests and tokens left in each model's budget",
+                                      labels=["model", "kind"])
+        for model, levels in limits["buckets"].items():
+            available.add_metric([model, "requests"], levels["requests_available"])
+            available.add_metric([model, "tokens"], levels["tokens_available"])
+        yield available
+        calls = CounterMetricFamily("groq_limiter_calls", "Groq calls through the rate limiter",
+                                    labels=["priority", "result"])
+        waited = CounterMetricFamily("groq_limiter_wait_seconds", "Time spent waiting for budget",
+                                     labels=["priority"])
+        for priority, stats in limits["priorities"].items():
+            for result in ("calls", "waited", "throttled", "timeouts"):
+                calls.add_metric([priority, result], stats[result])
+            waited.add_metric([priority], stats["wait_seconds"])
+        yield calls
+        yield waited
+
+        writer = message_writer.metrics()
+        yield GaugeMetricFamily("message_writer_buffered", "Messages waiting in the write-behind buffer",
+                                value=writer["buffered_messages"])
+        yield CounterMetricFamily("message_writer_written", "Messages written by the write-behind buffer",
+                                  value=writer["messages_written"])
+        yield CounterMetricFamily("message_writer_failures", "Failed write-behind flushes", value=writer["failures"])
+
+        keys = idempotency_keys.stats()
+        yield CounterMetricFamily("chat_idempotent_replays", "Duplicate /chat requests answered by the turn repeated",
+                                  value=keys["replays"])
+        locks = conversation_locks.stats()
+        yield CounterMetricFamily("conversation_lock_waits", "Chat turns that waited for the previous one",
+                                  value=locks["waited"])
+        yield CounterMetricFamily("conversation_lock_timeouts", "Chat turns refused after waiting for the previous one",
+                                  value=locks["timeouts"])
+
+        routing = variant_router.stats()
+        shares = GaugeMetricFamily("variant_route_share", "Share of new conversations routed to each variant",
+                                   labels=["variant"])
+        for variant, share in routing["shares"].items():
+            shares.add_metric([variant], share)
+        yield shares
+        assignments = CounterMetricFamily("variant_assignments", "New conversations assigned to each variant",
+                                          labels=["variant"])
+        for variant, count in routing["assignments"].items():
+            assignments.add_metric([variant], count)
+        yield assignments
+
+        jobs = CounterMetricFamily("refinement_jobs", "Refinement jobs handled by this worker", labels=["result"])
+        for result in ("processed", "refined", "failed"):
+            jobs.add_metric([result], worker_stats[result])
+        yield jobs
+        if worker_stats["last_lag_seconds"] is not None:
+            yield GaugeMetricFamily("refinement_last_lag_seconds", "Delay from enqueue to completion of the last job",
+                                    value=worker_stats["last_lag_seconds"])
+
+
+REGISTRY.register(StatsCollector())
+
+
+@router.get("/metrics")
+def get_metrics():
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
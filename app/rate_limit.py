@@ -0,0 +1,506 @@
+import asyncio
+import email.utils
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import httpx
+from sqlalchemy import Float, bindparam, text
+
+from db.database import async_engine, engine
+
+# Priority classes. Interactive calls (a user is waiting) always go first.
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+
+_priority = ContextVar("groq_priority", default=INTERACTIVE)
+
+DEFAULT_LIMITS_PATH = os.getenv("GROQ_LIMITS_PATH", "config/groq_limits.json")
+
+# Share of each bucket background work leaves untouched, so interactive calls from any
+# worker find headroom even while a batch job is saturating the account
+BACKGROUND_RESERVE = float(os.getenv("GROQ_BACKGROUND_RESERVE", "0.2"))
+
+# Interactive calls give up (and the user gets a 503) rather than wait longer than this
+MAX_INTERACTIVE_WAIT = float(os.getenv("GROQ_MAX_INTERACTIVE_WAIT", "20"))
+
+MAX_429_RETRIES = int(os.getenv("GROQ_MAX_429_RETRIES", "4"))
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 30.0
+
+# Longest single sleep while waiting for a bucket, so priority changes are noticed
+WAIT_SLICE = 0.25
+
+# Conservative characters per token for request cost estimates; the response headers
+# correct the token bucket after each call
+CHARS_PER_TOKEN = 3.0
+
+
+@contextmanager
+def background():
+    """Run the enclosed Groq calls (and tasks started inside) at background priority."""
+    token = _priority.set(BACKGROUND)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority():
+    return _priority.get()
+
+
+def load_limits(path=DEFAULT_LIMITS_PATH):
+    """Requests and tokens per minute for each model, with a "default" entry."""
+    with open(path, "r") as f:
+        raw = json.load(f)
+    return {
+        model: (float(entry["requests_per_minute"]), float(entry["tokens_per_minute"]))
+        for model, entry in raw.items()
+    }
+
+
+def reserve_floor(capacity, cost, reserve):
+    # A call bigger than the unreserved part of the bucket may still use a full bucket
+    return min(capacity * reserve, capacity - cost)
+
+
+class TokenBucket:
+    __slots__ = ("capacity", "rate", "tokens", "updated")
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_for(self, amount, floor):
+        """Seconds until `amount` can be taken while leaving `floor` behind (0 if now)."""
+        missing = amount + floor - self.tokens
+        return max(missing, 0.0) / self.rate
+
+    def block(self, seconds):
+        # Going negative makes every caller wait until the bucket has refilled past zero
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+class LocalBuckets:
+    """Buckets in this process's memory. Thread-safe, so the sync client can share them."""
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _pair(self, model, limits):
+        pair = self._buckets.get(model)
+        if pair is None:
+            pair = self._buckets[model] = (TokenBucket(limits[0]), TokenBucket(limits[1]))
+        return pair
+
+    def take_sync(self, model, limits, tokens, reserve):
+        with self._lock:
+            now = time.monotonic()
+            buckets = self._pair(model, limits)
+            for bucket in buckets:
+                bucket.refill(now)
+            costs = (1, min(tokens, buckets[1].capacity))
+            wait = max(
+                bucket.wait_for(cost, reserve_floor(bucket.capacity, cost, reserve))
+                for bucket, cost in zip(buckets, costs)
+            )
+            if wait == 0:
+                for bucket, cost in zip(buckets, costs):
+                    bucket.tokens -= cost
+            return wait
+
+    async def take(self, model, limits, tokens, reserve):
+        return self.take_sync(model, limits, tokens, reserve)
+
+    def block_sync(self, model, limits, seconds):
+        with self._lock:
+            for bucket in self._pair(model, limits):
+                bucket.refill(time.monotonic())
+                bucket.block(seconds)
+
+    async def block(self, model, limits, seconds):
+        self.block_sync(model, limits, seconds)
+
+    def refund_sync(self, model, limits, tokens):
+        with self._lock:
+            for bucket, cost in zip(self._pair(model, limits), (1, tokens)):
+                bucket.tokens = min(bucket.capacity, bucket.tokens + min(cost, bucket.capacity))
+
+    async def refund(self, model, limits, tokens):
+        self.refund_sync(model, limits, tokens)
+
+    def observe_remaining_tokens(self, model, limits, remaining):
+        # The server's count includes usage we could only estimate, and other clients
+        with self._lock:
+            bucket = self._pair(model, limits)[1]
+            bucket.refill(time.monotonic())
+            bucket.tokens = min(bucket.tokens, remaining)
+
+    def levels(self):
+        with self._lock:
+            now = time.monotonic()
+            for pair in self._buckets.values():
+                for bucket in pair:
+                    bucket.refill(now)
+            return {
+                model: {"requests_available": requests.tokens, "tokens_available": tokens.tokens}
+                for model, (requests, tokens) in self._buckets.items()
+            }
+
+
+# asyncpg can't infer the types of untyped arithmetic parameters
+BUCKET_PARAMS = [bindparam(name, type_=Float) for name in ("capacity", "rate", "cost", "floor")]
+
+# Refill and take in one statement, so concurrent workers can't both spend the same budget.
+# The row is only updated (and returned) when the bucket holds enough.
+TAKE_SQL = text("""
+    INSERT INTO rate_limit_buckets (key, tokens, updated_at)
+    VALUES (:key, :capacity - :cost, clock_timestamp())
+    ON CONFLICT (key) DO UPDATE SET
+        tokens = least(:capacity, rate_limit_buckets.tokens + :rate * extract(epoch FROM clock_timestamp() - rate_limit_buckets.updated_at)) - :cost,
+        updated_at = clock_timestamp()
+    WHERE least(:capacity, rate_limit_buckets.tokens + :rate * extract(epoch FROM clock_timestamp() - rate_limit_buckets.updated_at)) >= :cost + :floor
+    RETURNING tokens
+""").bindparams(*BUCKET_PARAMS)
+
+LEVEL_SQL = text("""
+    SELECT least(:capacity, tokens + :rate * extract(epoch FROM clock_timestamp() - updated_at))
+    FROM rate_limit_buckets WHERE key = :key
+""").bindparams(bindparam("capacity", type_=Float), bindparam("rate", type_=Float))
+
+BLOCK_SQL = text("""
+    UPDATE rate_limit_buckets
+    SET tokens = least(tokens, -:seconds * :rate), updated_at = clock_timestamp()
+    WHERE key = :key
+""").bindparams(bindparam("seconds", type_=Float), bindparam("rate", type_=Float))
+
+
+REFUND_SQL = text("""
+    UPDATE rate_limit_buckets SET tokens = least(:capacity, tokens + :cost) WHERE key = :key
+""").bindparams(bindparam("capacity", type_=Float), bindparam("cost", type_=Float))
+
+
+class PostgresBuckets:
+    """Buckets shared by every worker through the rate_limit_buckets table."""
+
+    def __init__(self, async_engine, engine):
+        self.async_engine = async_engine
+        self.engine = engine
+
+    @staticmethod
+    def _params(model, limits, tokens, reserve):
+        params = []
+        for kind, capacity, cost in zip(("requests", "tokens"), limits, (1, tokens)):
+            cost = min(cost, capacity)
+            params.append({
+                "key": f"{model}:{kind}",
+                "capacity": capacity,
+                "rate": capacity / 60.0,
+                "cost": cost,
+                "floor": reserve_floor(capacity, cost, reserve),
+            })
+        return params
+
+    @staticmethod
+    def _shortfall(params, level):
+        return max(params["cost"] + params["floor"] - float(level or 0), 0.0) / params["rate"]
+
+    async def take(self, model, limits, tokens, reserve):
+        async with self.async_engine.connect() as conn:
+            async with conn.begin() as tx:
+                for params in self._params(model, limits, tokens, reserve):
+                    if (await conn.execute(TAKE_SQL, params)).first() is None:
+                        level = await conn.scalar(LEVEL_SQL, params)
+                        await tx.rollback()
+                        return self._shortfall(params, level)
+        return 0.0
+
+    def take_sync(self, model, limits, tokens, reserve):
+        with self.engine.connect() as conn:
+            with conn.begin() as tx:
+                for params in self._params(model, limits, tokens, reserve):
+                    if conn.execute(TAKE_SQL, params).first() is None:
+                        level = conn.scalar(LEVEL_SQL, params)
+                        tx.rollback()
+                        return self._shortfall(params, level)
+        return 0.0
+
+    async def block(self, model, limits, seconds):
+        async with self.async_engine.begin() as conn:
+            for params in self._params(model, limits, 0, 0):
+                await conn.execute(BLOCK_SQL, {**params, "seconds": seconds})
+
+    def block_sync(self, model, limits, seconds):
+        with self.engine.begin() as conn:
+            for params in self._params(model, limits, 0, 0):
+                conn.execute(BLOCK_SQL, {**params, "seconds": seconds})
+
+    async def refund(self, model, limits, tokens):
+        async with self.async_engine.begin() as conn:
+            for params in self._params(model, limits, tokens, 0):
+                await conn.execute(REFUND_SQL, params)
+
+    def refund_sync(self, model, limits, tokens):
+        with self.engine.begin() as conn:
+            for params in self._params(model, limits, tokens, 0):
+                conn.execute(REFUND_SQL, params)
+
+    def observe_remaining_tokens(self, model, limits, remaining):
+        # Shared buckets already see every worker's spending
+        pass
+
+    def levels(self):
+        return {}
+
+
+class RateLimitTimeout(Exception):
+    def __init__(self, model, wait):
+        super().__init__(f"Groq rate limit for {model}: no capacity for {wait:.1f}s")
+        self.model = model
+        self.wait = wait
+
+
+class RateLimiter:
+    """
+    Request and token budgets per model, shared by every Groq call in the process.
+
+    Background calls wait while any interactive call is waiting for the same model, and
+    never dip into the last BACKGROUND_RESERVE of a bucket.
+    """
+
+    def __init__(self, limits, store=None, reserve=BACKGROUND_RESERVE):
+        self.limits = limits
+        self.store = store or LocalBuckets()
+        self.reserve = reserve
+        self._waiting_interactive = {}
+        self._lock = threading.Lock()
+        self.stats = {
+            priority: {"calls": 0, "waited": 0, "wait_seconds": 0.0, "throttled": 0, "timeouts": 0}
+            for priority in (INTERACTIVE, BACKGROUND)
+        }
+
+    def limits_for(self, model):
+        return self.limits.get(model) or self.limits["default"]
+
+    def _waiting(self, model, delta):
+        with self._lock:
+            self._waiting_interactive[model] = self._waiting_interactive.get(model, 0) + delta
+
+    def _gate(self, model, priority):
+        """Seconds a caller has to yield before even trying the buckets."""
+        if priority == BACKGROUND and self._waiting_interactive.get(model):
+            return WAIT_SLICE
+        return 0.0
+
+    def _record(self, priority, waited):
+        stats = self.stats[priority]
+        stats["calls"] += 1
+        if waited:
+            stats["waited"] += 1
+            stats["wait_seconds"] += waited
+
+    async def acquire(self, model, tokens, priority=None):
+        priority = priority or current_priority()
+        limits = self.limits_for(model)
+        reserve = self.reserve if priority == BACKGROUND else 0.0
+        started = time.monotonic()
+        if priority == INTERACTIVE:
+            self._waiting(model, 1)
+        try:
+            while True:
+                wait = self._gate(model, priority) or await self.store.take(model, limits, tokens, reserve)
+                if wait == 0:
+                    self._record(priority, time.monotonic() - started)
+                    return
+                waited = time.monotonic() - started
+                if priority == INTERACTIVE and waited + wait > MAX_INTERACTIVE_WAIT:
+                    self.stats[priority]["timeouts"] += 1
+                    raise RateLimitTimeout(model, wait)
+                await asyncio.sleep(min(wait, WAIT_SLICE))
+        finally:
+            if priority == INTERACTIVE:
+                self._waiting(model, -1)
+
+    def acquire_sync(self, model, tokens, priority=None):
+        # Only the offline scripts use the sync client, so there is no one to yield to
+        priority = priority or current_priority()
+        limits = self.limits_for(model)
+        reserve = self.reserve if priority == BACKGROUND else 0.0
+        started = time.monotonic()
+        while (wait := self.store.take_sync(model, limits, tokens, reserve)) > 0:
+            time.sleep(min(wait, 1.0))
+        self._record(priority, time.monotonic() - started)
+
+    def observe(self, model, headers):
+        remaining = headers.get("x-ratelimit-remaining-tokens")
+        if remaining is not None:
+            try:
+                self.store.observe_remaining_tokens(model, self.limits_for(model), float(remaining))
+            except ValueError:
+                pass
+
+    async def throttled(self, model, priority, retry_after):
+        """A 429 came back: hold every caller of the model off for `retry_after` seconds."""
+        self.stats[priority]["throttled"] += 1
+        await self.store.block(model, self.limits_for(model), retry_after)
+
+    def throttled_sync(self, model, priority, retry_after):
+        self.stats[priority]["throttled"] += 1
+        self.store.block_sync(model, self.limits_for(model), retry_after)
+
+    def metrics(self):
+        return {
+            "backend": "postgres" if isinstance(self.store, PostgresBuckets) else "local",
+            "limits": {
+                model: {"requests_per_minute": rpm, "tokens_per_minute": tpm}
+                for model, (rpm, tpm) in self.limits.items()
+            },
+            "buckets": self.store.levels(),
+            "waiting_interactive": dict(self._waiting_interactive),
+            "priorities": {priority: dict(stats) for priority, stats in self.stats.items()},
+        }
+
+
+def retry_delay(headers, attempt):
+    """Seconds to wait before retrying a 429: the server's Retry-After if given, plus jitter."""
+    retry_after = None
+    for name, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        value = headers.get(name)
+        if value is None:
+            continue
+        try:
+            retry_after = float(value) * scale
+        except ValueError:
+            parsed = email.utils.parsedate_tz(value)
+            if parsed is not None:
+                retry_after = email.utils.mktime_tz(parsed) - time.time()
+        break
+
+    if retry_after is not None and retry_after >= 0:
+        # Spread the retries of callers that were throttled together
+        return retry_after + random.uniform(0, min(retry_after, BACKOFF_BASE))
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def request_cost(request):
+    """(model, estimated tokens) of a chat completion request, or None for other requests."""
+    if request.method != "POST" or not request.url.path.endswith("/chat/completions"):
+        return None
+    try:
+        body = json.loads(request.content)
+    except ValueError:
+        return None
+    prompt_chars = sum(len(str(m.get("content") or "")) for m in body.get("messages", []))
+    return body.get("model", "default"), int(prompt_chars / CHARS_PER_TOKEN) + (body.get("max_tokens") or 0)
+
+
+def rate_limited_response(request, wait):
+    """A 429 for calls we won't send, marked so the SDK raises instead of retrying."""
+    return httpx.Response(
+        429,
+        headers={"retry-after": str(max(1, round(wait))), "x-should-retry": "false"},
+        json={"error": {"message": "Rate limit budget exhausted", "type": "rate_limit_exceeded"}},
+        request=request,
+    )
+
+
+class RateLimitedTransport(httpx.AsyncBaseTransport):
+    """Spends the limiter's budget for each chat completion and retries 429s itself."""
+
+    def __init__(self, limiter, transport):
+        self.limiter = limiter
+        self.transport = transport
+
+    async def handle_async_request(self, request):
+        cost = request_cost(request)
+        if cost is None:
+            return await self.transport.handle_async_request(request)
+
+        model, tokens = cost
+        priority = current_priority()
+        for attempt in range(MAX_429_RETRIES + 1):
+            try:
+                await self.limiter.acquire(model, tokens, priority)
+            except RateLimitTimeout as e:
+                return rate_limited_response(request, e.wait)
+
+            try:
+                response = await self.transport.handle_async_request(request)
+            except httpx.ConnectError:
+                # Never reached Groq, so it didn't count against the account
+                await self.limiter.store.refund(model, self.limiter.limits_for(model), tokens)
+                raise
+            self.limiter.observe(model, response.headers)
+            if response.status_code != 429:
+                return response
+
+            delay = retry_delay(response.headers, attempt)
+            await self.limiter.throttled(model, priority, delay)
+            if attempt == MAX_429_RETRIES:
+                break
+            await response.aclose()
+            await asyncio.sleep(delay)
+
+        # Retries are ours; don't let the SDK multiply them
+        response.headers["x-should-retry"] = "false"
+        return response
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+class RateLimitedSyncTransport(httpx.BaseTransport):
+    def __init__(self, limiter, transport):
+        self.limiter = limiter
+        self.transport = transport
+
+    def handle_request(self, request):
+        cost = request_cost(request)
+        if cost is None:
+            return self.transport.handle_request(request)
+
+        model, tokens = cost
+        priority = current_priority()
+        for attempt in range(MAX_429_RETRIES + 1):
+            self.limiter.acquire_sync(model, tokens, priority)
+            try:
+                response = self.transport.handle_request(request)
+            except httpx.ConnectError:
+                self.limiter.store.refund_sync(model, self.limiter.limits_for(model), tokens)
+                raise
+            self.limiter.observe(model, response.headers)
+            if response.status_code != 429:
+                return response
+
+            delay = retry_delay(response.headers, attempt)
+            self.limiter.throttled_sync(model, priority, delay)
+            if attempt == MAX_429_RETRIES:
+                break
+            response.close()
+            time.sleep(delay)
+
+        response.headers["x-should-retry"] = "false"
+        return response
+
+    def close(self):
+        self.transport.close()
+
+
+def create_limiter():
+    """The process-wide limiter. GROQ_RATE_LIMIT_BACKEND=postgres shares budgets across workers."""
+    limits = load_limits()
+    if os.getenv("GROQ_RATE_LIMIT_BACKEND", "local") == "postgres":
+        return RateLimiter(limits, PostgresBuckets(async_engine, engine))
+    return RateLimiter(limits)
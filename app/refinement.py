@@ -0,0 +1,287 @@
+import asyncio
+import os
+import time
+from datetime import timedelta
+
+from sqlalchemy import delete, func, or_, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app.knowledge import get_or_create_prompt_profile, replace_prompt_profile
+from app.llm import client
+from app.log import configure_logging, get_logger
+from app.rate_limit import background
+from app.telemetry import llm_call
+from db.database import AsyncSessionLocal
+from db.models import Conversation, Message, PromptProfile, RefinementFeedback, RefinementJob, utcnow
+
+logger = get_logger("refinement")
+
+# A profile is refined once its feedback has been quiet this long...
+DEBOUNCE = timedelta(seconds=float(os.getenv("REFINEMENT_DEBOUNCE_SECONDS", "30")))
+# ...or at the latest this long after the first feedback, however busy it is
+MAX_DELAY = timedelta(seconds=float(os.getenv("REFINEMENT_MAX_DELAY_SECONDS", "300")))
+
+POLL_INTERVAL = float(os.getenv("REFINEMENT_POLL_SECONDS", "5"))
+BATCH_SIZE = int(os.getenv("REFINEMENT_BATCH_SIZE", "4"))
+# A job whose worker doesn't finish within the lease is picked up again
+LEASE = timedelta(seconds=120)
+MAX_ATTEMPTS = 5
+
+# Most recent turns of the sampled conversation sent along with the feedback
+TRANSCRIPT_MESSAGES = 20
+
+DEFAULT_PROMPT = "You are a helpful assistant."
+
+# LLM used for system refinement
+REFINEMENT_MODEL = "llama3-70b-8192"
+
+# Counters for this worker process
+worker_stats = {"processed": 0, "refined": 0, "failed": 0, "last_lag_seconds": None}
+
+
+def upsert_job(db, prompt_profile_id, now, count=1):
+    """Statement that queues a refinement, or pushes back the one already queued."""
+    insert = postgresql.insert if db.bind.dialect.name == "postgresql" else sqlite.insert
+    stmt = insert(RefinementJob.__table__).values(
+        prompt_profile_id=prompt_profile_id,
+        enqueued_at=now,
+        run_after=now + DEBOUNCE,
+        run_before=now + MAX_DELAY,
+        feedback_count=count,
+        attempts=0,
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=["prompt_profile_id"],
+        set_={
+            "run_after": stmt.excluded.run_after,
+            "feedback_count": RefinementJob.__table__.c.feedback_count + count,
+        },
+    )
+
+
+async def enqueue_refinement(db, message, thumbs_up, thumbs_down, feedback_text):
+    """
+    Record feedback for the next refinement of the conversation's prompt profile.
+
+    Runs in the caller's transaction, so the feedback and its job are committed together.
+    """
+    convo = await db.get(Conversation, message.conversation_id)
+    if convo.prompt_profile_id is None:
+        # Start from a basic profile so there is something to refine
+        convo.prompt_profile_id = await db.run_sync(get_or_create_prompt_profile, DEFAULT_PROMPT)
+
+    db.add(RefinementFeedback(
+        message_id=message.id,
+        conversation_id=convo.id,
+        thumbs_up=thumbs_up,
+        thumbs_down=thumbs_down,
+        feedback_text=feedback_text,
+    ))
+    await db.flush()
+    await db.execute(upsert_job(db, convo.prompt_profile_id, utcnow()))
+
+
+async def claim_jobs(db, limit=BATCH_SIZE):
+    """Lease up to `limit` due jobs. Jobs held by other workers are skipped, not waited on."""
+    now = utcnow()
+    due = (
+        select(RefinementJob.prompt_profile_id)
+        .where(or_(RefinementJob.run_after <= now, RefinementJob.run_before <= now))
+        .where(or_(RefinementJob.locked_until.is_(None), RefinementJob.locked_until < now))
+        .order_by(RefinementJob.enqueued_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    claimed = await db.execute(
+        update(RefinementJob)
+        .where(RefinementJob.prompt_profile_id.in_(due))
+        .values(locked_until=now + LEASE, attempts=RefinementJob.attempts + 1)
+        .returning(RefinementJob.prompt_profile_id, RefinementJob.enqueued_at, RefinementJob.attempts)
+        .execution_options(synchronize_session=False)
+    )
+    jobs = claimed.all()
+    await db.commit()
+    return jobs
+
+
+def pending_feedback(prompt_profile_id):
+    return (
+        select(RefinementFeedback)
+        .join(Conversation, Conversation.id == RefinementFeedback.conversation_id)
+        .where(Conversation.prompt_profile_id == prompt_profile_id)
+    )
+
+
+def summarize_feedback(feedback, replies):
+    lines = []
+    for item in feedback:
+        reply = replies.get(item.message_id, "")
+        verdict = "thumbs up" if item.thumbs_up else "thumbs down" if item.thumbs_down else "no rating"
+        line = f"- On the reply \"{reply[:300]}\": {verdict}"
+        if item.feedback_text:
+            line += f", user wrote \"{item.feedback_text}\""
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def refinement_prompt(system_prompt, feedback_summary, convo_text):
+    return f"""
+        You are a prompt engineering assistant.
+        Your goal is to refine chatbot system prompts.
+
+        Given the original system prompt and user feedback on the assistant's performance,
+        adjust the prompt slightly to better align the assistant's behavior with the feedback —
+        either reinforcing what worked well, or fixing what went wrong.
+
+        Keep the assistant's core role intact.
+
+        Original system prompt:
+        {system_prompt}
+
+        User feedback:
+        {feedback_summary}
+
+        Conversation sample:
+        {convo_text}
+
+        Return ONLY the updated prompt.
+            """
+
+
+async def process_job(prompt_profile_id, enqueued_at, attempts):
+    """Fold all feedback for a profile into one refinement and finish the job."""
+    db = AsyncSessionLocal()
+    try:
+        profile = await db.get(PromptProfile, prompt_profile_id)
+        feedback = (await db.scalars(pending_feedback(prompt_profile_id).order_by(RefinementFeedback.id))).all()
+
+        new_prompt = None
+        if profile and feedback:
+            replies = dict((await db.execute(
+                select(Message.id, Message.content)
+                .where(Message.id.in_({item.message_id for item in feedback}))
+            )).all())
+            sample = await db.execute(
+                select(Message.role, Message.content)
+                .filter_by(conversation_id=feedback[-1].conversation_id)
+                .order_by(Message.seq.desc())
+                .limit(TRANSCRIPT_MESSAGES)
+            )
+            convo_text = "\n".join(
+                f"{'User' if role == 'user' else 'Assistant'}: {content}"
+                for role, content in reversed(sample.all())
+            )
+            # Don't hold a transaction open across the LLM call
+            await db.commit()
+
+            started = time.perf_counter()
+            res = await client.chat.completions.create(
+                model=REFINEMENT_MODEL,
+                messages=[{"role": "user", "content": refinement_prompt(
+                    profile.system_prompt, summarize_feedback(feedback, replies), convo_text
+                )}],
+                temperature=0.3,
+                max_tokens=500,
+            )
+            db.add(llm_call("refinement", REFINEMENT_MODEL, res, started))
+            new_prompt = res.choices[0].message.content.strip()
+
+        current_id = prompt_profile_id
+        if new_prompt and new_prompt != profile.system_prompt:
+            current_id = await db.run_sync(replace_prompt_profile, prompt_profile_id, new_prompt)
+            logger.info("🧠 Refined prompt profile %s -> %s from %d feedback events", prompt_profile_id, current_id, len(feedback))
+
+        await db.execute(delete(RefinementFeedback).where(RefinementFeedback.id.in_([item.id for item in feedback])))
+        await db.execute(delete(RefinementJob).filter_by(prompt_profile_id=prompt_profile_id))
+
+        # Feedback that arrived while refining is queued against the profile now in use
+        remaining = await db.scalar(select(func.count()).select_from(pending_feedback(current_id).subquery()))
+        if remaining:
+            await db.execute(upsert_job(db, current_id, utcnow(), remaining))
+        await db.commit()
+
+        lag = (utcnow() - enqueued_at).total_seconds()
+        worker_stats["processed"] += 1
+        worker_stats["refined"] += int(current_id != prompt_profile_id)
+        worker_stats["last_lag_seconds"] = lag
+
+    except Exception as e:
+        await db.rollback()
+        await fail_job(db, prompt_profile_id, attempts, e)
+    finally:
+        await db.close()
+
+
+async def fail_job(db, prompt_profile_id, attempts, error):
+    worker_stats["failed"] += 1
+    job = update(RefinementJob).filter_by(prompt_profile_id=prompt_profile_id)
+    if attempts >= MAX_ATTEMPTS:
+        # The feedback stays recorded and is picked up by the profile's next job
+        logger.error("❌ Prompt refinement for profile %s gave up after %d attempts: %s", prompt_profile_id, attempts, error)
+        await db.execute(delete(RefinementJob).filter_by(prompt_profile_id=prompt_profile_id))
+    else:
+        logger.warning("⚠️ Prompt refinement for profile %s failed, will retry: %s", prompt_profile_id, error)
+        await db.execute(job.values(
+            locked_until=None,
+            run_after=utcnow() + DEBOUNCE * 2 ** attempts,
+            last_error=str(error),
+        ).execution_options(synchronize_session=False))
+    await db.commit()
+
+
+async def queue_stats(db):
+    now = utcnow()
+    is_due = or_(RefinementJob.run_after <= now, RefinementJob.run_before <= now)
+    jobs, due, running, oldest, due_after, due_before = (await db.execute(select(
+        func.count(),
+        func.count().filter(is_due),
+        func.count().filter(RefinementJob.locked_until > now),
+        func.min(RefinementJob.enqueued_at),
+        func.min(RefinementJob.run_after).filter(is_due),
+        func.min(RefinementJob.run_before).filter(is_due),
+    ))).one()
+    feedback = await db.scalar(select(func.count()).select_from(RefinementFeedback))
+    # A due job became due at the earlier of its two deadlines
+    oldest_due = min((t for t in (due_after, due_before) if t), default=None)
+    return {
+        "jobs": jobs,
+        "due": due,
+        "running": running,
+        "pending_feedback": feedback,
+        # Age of the oldest queued feedback, and how long due jobs have waited for a worker
+        "oldest_job_age_seconds": (now - oldest).total_seconds() if oldest else None,
+        "processing_lag_seconds": (now - oldest_due).total_seconds() if oldest_due else None,
+        "worker": dict(worker_stats),
+    }
+
+
+async def run_worker(poll_interval=POLL_INTERVAL):
+    """Process due refinement jobs until cancelled. Any number of workers can run at once."""
+    logger.info("🧠 Prompt refinement worker started")
+    # Refinements yield the Groq budget to interactive chat calls
+    with background():
+        while True:
+            jobs = []
+            try:
+                async with AsyncSessionLocal() as db:
+                    jobs = await claim_jobs(db)
+                for job in jobs:
+                    await process_job(*job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("⚠️ Prompt refinement worker error: %s", e)
+            if not jobs:
+                await asyncio.sleep(poll_interval)
+
+
+def start_refinement_worker():
+    """Run the worker inside the app unless REFINEMENT_WORKER=0 (e.g. when it runs on its own)."""
+    if os.getenv("REFINEMENT_WORKER", "1") == "0":
+        return None
+    return asyncio.create_task(run_worker())
+
+
+if __name__ == "__main__":
+    configure_logging()
+    asyncio.run(run_worker())
@@ -0,0 +1,314 @@
+import os
+import re
+import threading
+import time
+from collections import Counter
+from html.parser import HTMLParser
+from pathlib import Path
+
+import numpy as np
+
+from app.log import get_logger
+
+logger = get_logger("retrieval")
+
+INDEX_PATH = os.getenv("KNOWLEDGE_INDEX_PATH", "data/knowledge_index.npz")
+
+# BM25 parameters: term frequency saturation and length normalization
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Target chunk size; paragraphs are packed up to it and longer ones are split
+CHUNK_CHARS = 1200
+
+DOCUMENT_SUFFIXES = {".txt", ".md", ".markdown", ".html", ".htm"}
+
+_token = re.compile(r"\w+")
+
+STOPWORDS = frozenset("""
+    a an and are as at be but by for from has have he her his i if in into is it its me my
+    no not of on or our she so than that the their them then there these they this to was
+    we were what when where which who why will with you your
+""".split())
+
+
+def tokenize(text):
+    return [token for token in _token.findall(text.lower()) if len(token) > 1 and token not in STOPWORDS]
+
+
+class _TextExtractor(HTMLParser):
+    SKIP = {"script", "style", "noscript", "template", "nav", "footer"}
+    BLOCKS = {"p", "div", "section", "article", "li", "tr", "br", "h1", "h2", "h3", "h4", "h5", "h6", "pre"}
+
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self._skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP:
+            self._skipping += 1
+        elif tag in self.BLOCKS:
+            self.parts.append("\n\n")
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP and self._skipping:
+            self._skipping -= 1
+        elif tag in self.BLOCKS:
+            self.parts.append("\n\n")
+
+    def handle_data(self, data):
+        if not self._skipping:
+            self.parts.append(data)
+
+
+def html_to_text(html):
+    extractor = _TextExtractor()
+    extractor.feed(html)
+    extractor.close()
+    return "".join(extractor.parts)
+
+
+def read_document(path):
+    text = Path(path).read_text(encoding="utf-8", errors="replace")
+    if Path(path).suffix.lower() in (".html", ".htm"):
+        return html_to_text(text)
+    return text
+
+
+def chunk_text(text, max_chars=CHUNK_CHARS):
+    """Pack paragraphs into chunks of up to `max_chars`, splitting longer ones on words."""
+    chunks = []
+    current = ""
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = " ".join(paragraph.split())
+        if not paragraph:
+            continue
+        while len(paragraph) > max_chars:
+            cut = paragraph.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(paragraph[:cut])
+            paragraph = paragraph[cut:].lstrip()
+        if current and len(current) + len(paragraph) + 1 > max_chars:
+            chunks.append(current)
+            current = ""
+        current = f"{current} {paragraph}" if current else paragraph
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def document_paths(paths):
+    for path in map(Path, paths):
+        if path.is_dir():
+            yield from sorted(p for p in path.rglob("*") if p.suffix.lower() in DOCUMENT_SUFFIXES)
+        else:
+            yield path
+
+
+def pack_strings(strings):
+    """Strings as one UTF-8 blob plus offsets, which np.savez stores without pickling."""
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+class PackedStrings:
+    __slots__ = ("blob", "offsets")
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes().decode("utf-8")
+
+
+class KnowledgeIndex:
+    """
+    BM25 index of knowledge chunks, held as NumPy arrays.
+
+    Postings are stored per term in CSR form (term -> chunk ids and term frequencies),
+    so a query touches only the postings of its own terms and scores them with a few
+    vectorized operations.
+    """
+
+    def __init__(self, vocabulary, indptr, doc_ids, tfs, doc_lengths, chunks, sources, chunk_sources):
+        self.vocabulary = vocabulary
+        self.terms = {term: i for i, term in enumerate(vocabulary)}
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.doc_lengths = doc_lengths
+        self.chunks = chunks
+        self.sources = sources
+        self.chunk_sources = chunk_sources
+
+        n_docs = len(doc_lengths)
+        document_frequency = np.diff(indptr).astype(np.float32)
+        self.idf = np.log1p((n_docs - document_frequency + 0.5) / (document_frequency + 0.5)).astype(np.float32)
+        average = float(doc_lengths.mean()) if n_docs else 1.0
+        # Length part of the BM25 denominator, per chunk
+        self.norms = (BM25_K1 * (1 - BM25_B + BM25_B * doc_lengths / max(average, 1.0))).astype(np.float32)
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    @classmethod
+    def build(cls, documents):
+        """Index `documents`, an iterable of (source, chunks) pairs."""
+        terms = {}
+        term_ids, doc_ids, tfs, doc_lengths = [], [], [], []
+        chunks, sources, chunk_sources = [], [], []
+        for source, source_chunks in documents:
+            source_id = len(sources)
+            sources.append(str(source))
+            for chunk in source_chunks:
+                doc = len(chunks)
+                tokens = tokenize(chunk)
+                counts = Counter(tokens)
+                term_ids.extend(terms.setdefault(term, len(terms)) for term in counts)
+                tfs.extend(counts.values())
+                doc_ids.extend([doc] * len(counts))
+                doc_lengths.append(len(tokens))
+                chunks.append(chunk)
+                chunk_sources.append(source_id)
+
+        term_ids = np.asarray(term_ids, dtype=np.int32)
+        # Stable, so each term's postings stay in chunk order
+        order = np.argsort(term_ids, kind="stable")
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(terms)), out=indptr[1:])
+        return cls(
+            vocabulary=list(terms),
+            indptr=indptr,
+            doc_ids=np.asarray(doc_ids, dtype=np.int32)[order],
+            tfs=np.minimum(np.asarray(tfs), np.iinfo(np.uint16).max).astype(np.uint16)[order],
+            doc_lengths=np.asarray(doc_lengths, dtype=np.float32),
+            chunks=PackedStrings(*pack_strings(chunks)),
+            sources=sources,
+            chunk_sources=np.asarray(chunk_sources, dtype=np.int32),
+        )
+
+    def save(self, path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        vocabulary_blob, vocabulary_offsets = pack_strings(self.vocabulary)
+        source_blob, source_offsets = pack_strings(self.sources)
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "wb") as f:
+            np.savez(
+                f,
+                vocabulary_blob=vocabulary_blob, vocabulary_offsets=vocabulary_offsets,
+                indptr=self.indptr, doc_ids=self.doc_ids, tfs=self.tfs, doc_lengths=self.doc_lengths,
+                chunk_blob=self.chunks.blob, chunk_offsets=self.chunks.offsets,
+                source_blob=source_blob, source_offsets=source_offsets, chunk_sources=self.chunk_sources,
+            )
+        # The app may be reading the old index; swap it in whole
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            vocabulary = PackedStrings(data["vocabulary_blob"], data["vocabulary_offsets"])
+            sources = PackedStrings(data["source_blob"], data["source_offsets"])
+            return cls(
+                vocabulary=[vocabulary[i] for i in range(len(vocabulary))],
+                indptr=data["indptr"],
+                doc_ids=data["doc_ids"],
+                tfs=data["tfs"],
+                doc_lengths=data["doc_lengths"],
+                chunks=PackedStrings(data["chunk_blob"], data["chunk_offsets"]),
+                sources=[sources[i] for i in range(len(sources))],
+                chunk_sources=data["chunk_sources"],
+            )
+
+    def search(self, query, k):
+        """The `k` best chunks for `query`, as (chunk id, score) pairs, best first."""
+        term_ids = {self.terms[t] for t in tokenize(query) if t in self.terms}
+        if not term_ids or not k:
+            return []
+
+        scores = np.zeros(len(self), dtype=np.float32)
+        for term in term_ids:
+            start, end = self.indptr[term], self.indptr[term + 1]
+            docs = self.doc_ids[start:end]
+            tf = self.tfs[start:end].astype(np.float32)
+            # A term appears once per chunk in its postings, so plain fancy += is safe
+            scores[docs] += self.idf[term] * tf * (BM25_K1 + 1) / (tf + self.norms[docs])
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(doc), float(scores[doc])) for doc in top if scores[doc] > 0]
+
+    def source(self, doc):
+        return self.sources[self.chunk_sources[doc]]
+
+
+def knowledge_message(chunks):
+    return {
+        "role": "system",
+        "content": "Relevant excerpts from the knowledge base:\n\n" + "\n\n".join(chunks),
+    }
+
+
+class KnowledgeStore:
+    """The index used by the chat path, loaded once and swapped whole on reload."""
+
+    def __init__(self, path=INDEX_PATH):
+        self.path = path
+        self.index = None
+        self.loaded_at = None
+        self.queries = 0
+        self.query_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def load(self):
+        started = time.perf_counter()
+        index = KnowledgeIndex.load(self.path)
+        with self._lock:
+            self.index = index
+            self.loaded_at = time.time()
+        logger.info("📚 Loaded knowledge index", extra={
+            "path": self.path, "chunks": len(index), "ms": round((time.perf_counter() - started) * 1000),
+        })
+        return index
+
+    def load_if_present(self):
+        if os.path.exists(self.path):
+            return self.load()
+        return None
+
+    def search(self, query, k):
+        """Best chunks for `query` as (text, score) pairs; empty without an index."""
+        index = self.index
+        if index is None:
+            return []
+        started = time.perf_counter()
+        results = [(index.chunks[doc], score) for doc, score in index.search(query, k)]
+        self.queries += 1
+        self.query_seconds += time.perf_counter() - started
+        return results
+
+    def stats(self):
+        index = self.index
+        return {
+            "path": self.path,
+            "loaded": index is not None,
+            "chunks": len(index) if index is not None else 0,
+            "terms": len(index.vocabulary) if index is not None else 0,
+            "sources": len(index.sources) if index is not None else 0,
+            "queries": self.queries,
+            "avg_query_ms": self.query_seconds / self.queries * 1000 if self.queries else None,
+        }
+
+
+knowledge_index = KnowledgeStore()
@@ -0,0 +1,277 @@
+import bisect
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+from pydantic import BaseModel, ConfigDict, Field
+
+from app.log import get_logger
+from app.variants import DEFAULT_VARIANT, registry
+
+logger = get_logger("routing")
+
+DEFAULT_ROUTING_PATH = os.getenv("ROUTING_CONFIG_PATH", "config/routing.json")
+
+# Assignment is a lookup in a table of this many slots, rebuilt when the shares change
+SLOTS = 1024
+
+# Shares are recomputed from the rolling stats at most this often
+REBALANCE_INTERVAL = float(os.getenv("ROUTING_REBALANCE_INTERVAL", "5"))
+
+# Each rolling window is kept as this many time slices
+WINDOW_SLICES = 10
+
+# Latency histogram bounds, 50 ms to ~60 s, ~25% apart
+LATENCY_BOUNDS_MS = tuple(round(50 * 1.25 ** i) for i in range(33))
+
+
+class RoutingPolicy(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    # Share of new conversations for each variant; normalized, so any scale works
+    weights: Dict[str, float] = Field(default_factory=dict)
+    # Where the share taken from an unhealthy variant goes. Without an entry, it is
+    # spread over the other variants in proportion to their weights.
+    shift_to: Dict[str, str] = Field(default_factory=dict)
+
+    window_seconds: float = Field(300, gt=0)
+    # Fewer samples than this in the window and a variant counts as healthy
+    min_samples: int = Field(20, ge=1)
+    max_p95_ms: Optional[float] = Field(None, gt=0)
+    max_error_rate: Optional[float] = Field(None, gt=0, le=1)
+    # Share of its weight an unhealthy variant always keeps, so the A/B comparison
+    # keeps collecting conversations for it
+    min_share: float = Field(0.2, ge=0, le=1)
+
+    @classmethod
+    def default(cls):
+        return cls(weights={DEFAULT_VARIANT: 1.0})
+
+
+def load_policy(path=DEFAULT_ROUTING_PATH):
+    """The routing policy in `path`, or everything to DEFAULT_MODEL_GROUP without one."""
+    if not os.path.exists(path):
+        return RoutingPolicy.default()
+    with open(path, "r") as f:
+        return RoutingPolicy.model_validate(json.load(f))
+
+
+def stable_hash(key):
+    # Same slot for the same key in every worker and across restarts
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class RollingStats:
+    """
+    Latency histogram and error count of one variant over a sliding window.
+
+    The window is a ring of time slices, so recording is a few increments and old
+    samples age out without a sweep.
+    """
+
+    __slots__ = ("slice_seconds", "epochs", "latencies", "requests", "errors")
+
+    def __init__(self, window_seconds):
+        self.slice_seconds = window_seconds / WINDOW_SLICES
+        self.epochs = [-1] * WINDOW_SLICES
+        self.latencies = [[0] * (len(LATENCY_BOUNDS_MS) + 1) for _ in range(WINDOW_SLICES)]
+        self.requests = [0] * WINDOW_SLICES
+        self.errors = [0] * WINDOW_SLICES
+
+    def _slice(self, now):
+        epoch = int(now / self.slice_seconds)
+        index = epoch % WINDOW_SLICES
+        if self.epochs[index] != epoch:
+            self.epochs[index] = epoch
+            self.latencies[index] = [0] * (len(LATENCY_BOUNDS_MS) + 1)
+            self.requests[index] = 0
+            self.errors[index] = 0
+        return index
+
+    def record(self, now, latency_seconds=None, error=False):
+        index = self._slice(now)
+        self.requests[index] += 1
+        if error:
+            self.errors[index] += 1
+        elif latency_seconds is not None:
+            self.latencies[index][bisect.bisect_left(LATENCY_BOUNDS_MS, latency_seconds * 1000)] += 1
+
+    def summary(self, now):
+        oldest = int(now / self.slice_seconds) - WINDOW_SLICES + 1
+        live = [i for i, epoch in enumerate(self.epochs) if epoch >= oldest]
+        requests = sum(self.requests[i] for i in live)
+        errors = sum(self.errors[i] for i in live)
+        histogram = [sum(self.latencies[i][b] for i in live) for b in range(len(LATENCY_BOUNDS_MS) + 1)]
+        return {
+            "requests": requests,
+            "errors": errors,
+            "error_rate": errors / requests if requests else None,
+            "p95_ms": histogram_percentile(histogram, 0.95),
+        }
+
+
+def histogram_percentile(histogram, quantile):
+    """Upper bound of the bucket holding the quantile; past the last bound, that bound."""
+    total = sum(histogram)
+    if not total:
+        return None
+    rank = quantile * total
+    seen = 0
+    for bucket, count in enumerate(histogram):
+        seen += count
+        if seen >= rank:
+            return LATENCY_BOUNDS_MS[min(bucket, len(LATENCY_BOUNDS_MS) - 1)]
+    return LATENCY_BOUNDS_MS[-1]
+
+
+def health_factor(summary, policy):
+    """Share of its weight a variant keeps: 1 when healthy, down to min_share."""
+    if summary["requests"] < policy.min_samples:
+        return 1.0
+    factor = 1.0
+    if policy.max_p95_ms and summary["p95_ms"] and summary["p95_ms"] > policy.max_p95_ms:
+        factor = min(factor, policy.max_p95_ms / summary["p95_ms"])
+    if policy.max_error_rate and summary["error_rate"] and summary["error_rate"] > policy.max_error_rate:
+        factor = min(factor, policy.max_error_rate / summary["error_rate"])
+    return max(policy.min_share, factor)
+
+
+def shift_shares(weights, factors, shift_to):
+    """Move the share each variant loses to its shift_to target, or to the others by weight."""
+    shares = dict(weights)
+    for name, weight in weights.items():
+        moved = weight * (1 - factors.get(name, 1.0))
+        if not moved:
+            continue
+        target = shift_to.get(name)
+        if target in shares and target != name:
+            receivers = {target: 1.0}
+        else:
+            receivers = {other: w for other, w in weights.items() if other != name and w > 0}
+        total = sum(receivers.values())
+        if not total:
+            continue
+        shares[name] -= moved
+        for other, w in receivers.items():
+            shares[other] += moved * w / total
+    return shares
+
+
+def build_table(shares):
+    """
+    Slot table for the given shares, each variant holding one contiguous range.
+
+    Contiguous ranges mean a small change in shares only moves the slots at the
+    boundaries, so most keys keep their variant.
+    """
+    total = sum(shares.values())
+    names = sorted(name for name, share in shares.items() if share > 0)
+    table = []
+    cumulative = 0.0
+    for name in names:
+        cumulative += shares[name] / total
+        table.extend([name] * (round(cumulative * SLOTS) - len(table)))
+    return table
+
+
+class VariantRouter:
+    """
+    Weighted, sticky assignment of new conversations to model variants.
+
+    A key (the client id, or the new conversation's id) is hashed to a slot, and the
+    slot table maps it to a variant in O(1). Variants that are slow or failing in the
+    rolling window give part of their share to a lighter variant. The table is rebuilt
+    from the stats at most every REBALANCE_INTERVAL seconds.
+    """
+
+    def __init__(self, policy=None, path=DEFAULT_ROUTING_PATH, clock=time.monotonic):
+        self.path = path
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._table = None
+        self._shares = {}
+        self._rebalanced_at = None
+        self.policy = policy
+        self.assignments = {}
+
+    def load(self):
+        self.set_policy(load_policy(self.path))
+        logger.info("🔀 Routing new conversations", extra={"weights": self.policy.weights})
+        return self.policy
+
+    def set_policy(self, policy):
+        with self._lock:
+            self.policy = policy
+            self._stats = {}
+            self._table = None
+
+    def record(self, variant, latency_seconds=None, error=False):
+        """Latency until the reply is complete, streamed or not, or a failure."""
+        stats = self._stats.get(variant)
+        if stats is None:
+            stats = self._stats.setdefault(variant, RollingStats(self._policy().window_seconds))
+        stats.record(self.clock(), latency_seconds, error)
+
+    def assign(self, key):
+        now = self.clock()
+        table = self._table
+        if table is None or now - self._rebalanced_at >= REBALANCE_INTERVAL:
+            table = self.rebalance(now)
+        variant = table[stable_hash(str(key)) % len(table)]
+        self.assignments[variant] = self.assignments.get(variant, 0) + 1
+        return variant
+
+    def rebalance(self, now=None):
+        now = self.clock() if now is None else now
+        with self._lock:
+            policy = self._policy()
+            known = set(registry.names())
+            weights = {name: w for name, w in policy.weights.items() if name in known and w >= 0}
+            # A shift target may have no share of its own until another variant is unhealthy
+            for target in policy.shift_to.values():
+                if target in known:
+                    weights.setdefault(target, 0.0)
+            if not any(weights.values()):
+                logger.warning("⚠️ No routable variants in the routing policy, using the default")
+                weights = {DEFAULT_VARIANT: 1.0}
+
+            factors = {}
+            for name in weights:
+                stats = self._stats.get(name)
+                if stats is not None:
+                    factors[name] = health_factor(stats.summary(now), policy)
+            shares = shift_shares(weights, factors, policy.shift_to)
+
+            total = sum(shares.values())
+            shares = {name: share / total for name, share in shares.items()}
+            if self._table is not None and shares != self._shares:
+                changed = {name: round(share, 3) for name, share in shares.items()}
+                logger.info("🔀 Routing shares changed", extra={"shares": changed})
+            self._shares = shares
+            self._table = build_table(shares)
+            self._rebalanced_at = now
+            return self._table
+
+    def _policy(self):
+        if self.policy is None:
+            self.policy = load_policy(self.path)
+        return self.policy
+
+    def stats(self):
+        now = self.clock()
+        policy = self._policy()
+        if self._table is None:
+            self.rebalance(now)
+        return {
+            "policy": policy.model_dump(),
+            "shares": self._shares,
+            "assignments": dict(self.assignments),
+            "variants": {name: stats.summary(now) for name, stats in self._stats.items()},
+        }
+
+
+variant_router = VariantRouter()
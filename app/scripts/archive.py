@@ -0,0 +1,28 @@
+import argparse
+import asyncio
+
+from dotenv import load_dotenv
+
+from app.archive import ARCHIVE_AFTER_DAYS, ARCHIVE_DIR, BATCH_SIZE, run_archival
+from db.database import AsyncSessionLocal, async_engine
+
+load_dotenv()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move old conversations out of the hot tables into archive files.")
+    parser.add_argument("--older-than-days", type=float, default=ARCHIVE_AFTER_DAYS)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Conversations per transaction")
+    parser.add_argument("--dir", default=ARCHIVE_DIR, help="Where archive segments are written")
+    args = parser.parse_args()
+
+    async def main():
+        try:
+            return await run_archival(AsyncSessionLocal, args.older_than_days, args.batch_size, args.dir)
+        finally:
+            await async_engine.dispose()
+
+    result = asyncio.run(main())
+    print(f"✅ Archived {result['archived']} conversations started before {result['cutoff']}")
+    for name in result["dropped_partitions"]:
+        print(f"🗑️ Dropped empty partition {name}")
@@ -1,35 +1,38 @@
-import os
+import argparse
+import asyncio
 import json
-from dotenv import load_dotenv
-from sqlalchemy.orm import Session
+import os
+import time
 from collections import defaultdict
-from db.database import SessionLocal
-from db.models import Conversation, Message
-from groq import Groq
+
+from dotenv import load_dotenv
+from sqlalchemy import func, select
+from sqlalchemy.dialects import postgresql, sqlite
+from db.database import AsyncSessionLocal, async_engine
+from db.models import ArchivedConversation, Conversation, Evaluation, Message, VariantStats
+from app.archive import read_archived
+from app.llm import client
+from app.rate_limit import background
+from app.telemetry import llm_call
+from app.variant_stats import count_evaluations
 
 load_dotenv()
 
-groq = Groq(api_key=os.getenv("GROQ_API_KEY"))
+# Model chosen for evaluation
+EVALUATION_MODEL = "llama3-70b-8192"
 
-def evaluate_conversations():
-    db: Session = SessionLocal()
-    conversations = db.query(Conversation).all()
-    results = []
+# LLM calls in flight at once
+DEFAULT_CONCURRENCY = int(os.getenv("EVALUATION_CONCURRENCY", "16"))
 
-    for convo in conversations:
-        messages = (
-            db.query(Message)
-            .filter_by(conversation_id=convo.id)
-            .order_by(Message.timestamp)
-            .all()
-        )
+# Conversations read per query, and evaluations written per insert
+PAGE_SIZE = 500
+WRITE_BATCH = 100
+
+PROGRESS_INTERVAL = 10.0
 
-        dialogue = ""
-        for m in messages:
-            role = "User" if m.role == "user" else "Assistant"
-            dialogue += f"{role}: {m.content}\n"
 
-        evaluation_prompt = f"""
+def evaluation_prompt(dialogue):
+    return f"""
             Evaluate the quality of the assistant's responses in the following conversation.
             Score the conversation from 1 to 10 based on relevance, clarity, and helpfulness.
             Then explain your reasoning in 1-2 sentences.
@@ -41,32 +44,289 @@ def evaluate_conversations():
             {{"score": <1-10>, "comment": "..."}}
             """
 
+
+def parse_evaluation(raw):
+    # Models sometimes wrap the JSON in prose or code fences
+    result = json.loads(raw[raw.index("{"):raw.rindex("}") + 1])
+    score = result.get("score")
+    return (int(score) if score is not None else None), result.get("comment")
+
+
+def last_seq():
+    return (
+        select(func.max(Message.seq))
+        .where(Message.conversation_id == Conversation.id)
+        .scalar_subquery()
+    )
+
+
+def pending_query(config=None):
+    """Conversations with messages newer than their latest evaluation, with that watermark."""
+    scored = (
+        select(func.max(Evaluation.message_seq))
+        .where(Evaluation.conversation_id == Conversation.id)
+        .scalar_subquery()
+    )
+    watermark = last_seq()
+    stmt = select(Conversation.id, Conversation.config, watermark.label("watermark")).where(
+        watermark > func.coalesce(scored, 0)
+    )
+    if config:
+        stmt = stmt.where(Conversation.config == config)
+    return stmt
+
+
+def pending_archived_query(config=None):
+    """Archived conversations not scored as of their last message; positions run 1..message_count."""
+    scored = (
+        select(func.max(Evaluation.message_seq))
+        .where(Evaluation.conversation_id == ArchivedConversation.id)
+        .scalar_subquery()
+    )
+    stmt = select(ArchivedConversation).where(ArchivedConversation.message_count > func.coalesce(scored, 0))
+    if config:
+        stmt = stmt.where(ArchivedConversation.config == config)
+    return stmt
+
+
+def transcript(messages):
+    return "".join(f"{'User' if role == 'user' else 'Assistant'}: {content}\n" for role, content in messages)
+
+
+class Progress:
+    def __init__(self, total):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.started = time.monotonic()
+        self.last_report = self.started
+
+    @property
+    def rate(self):
+        elapsed = time.monotonic() - self.started
+        return (self.done + self.failed) / elapsed if elapsed else 0.0
+
+    def record(self, ok):
+        if ok:
+            self.done += 1
+        else:
+            self.failed += 1
+        if time.monotonic() - self.last_report >= PROGRESS_INTERVAL:
+            self.report()
+
+    def report(self):
+        self.last_report = time.monotonic()
+        finished = self.done + self.failed
+        eta = (self.total - finished) / self.rate if self.rate else None
+        print(
+            f"📊 Evaluated {finished}/{self.total} conversations ({self.failed} failed), "
+            f"{self.rate:.1f}/s" + (f", ETA {eta:.0f}s" if eta is not None else "")
+        )
+
+    def summary(self):
+        return {
+            "total": self.total,
+            "evaluated": self.done,
+            "failed": self.failed,
+            "elapsed_seconds": time.monotonic() - self.started,
+            "per_second": self.rate,
+        }
+
+
+class EvaluationWriter:
+    """
+    Buffers evaluations, with the llm_calls rows of the calls that scored them, and
+    inserts them in batches, so a crash loses at most one batch.
+    """
+
+    def __init__(self, batch_size=WRITE_BATCH):
+        self.batch_size = batch_size
+        self.rows = []
+        self.calls = []
+        self._lock = asyncio.Lock()
+
+    async def add(self, row, call=None):
+        self.rows.append(row)
+        if call is not None:
+            self.calls.append(call)
+        if len(self.rows) >= self.batch_size:
+            await self.flush()
+
+    async def flush(self):
+        async with self._lock:
+            rows, self.rows = self.rows, []
+            calls, self.calls = self.calls, []
+            if not rows and not calls:
+                return
+            async with AsyncSessionLocal() as db:
+                if rows:
+                    insert = postgresql.insert if db.bind.dialect.name == "postgresql" else sqlite.insert
+                    # Another run may have scored the same watermark meanwhile
+                    inserted = await db.execute(
+                        insert(Evaluation.__table__).values(rows).on_conflict_do_nothing()
+                        .returning(Evaluation.conversation_id, Evaluation.message_seq)
+                    )
+                    await count_evaluations(db, inserted.all())
+                db.add_all(calls)
+                await db.commit()
+
+
+async def produce(queue, config, limit, workers):
+    """Page through pending conversations by id and queue each with its transcript."""
+    after = None
+    queued = 0
+    async with AsyncSessionLocal() as db:
+        while limit is None or queued < limit:
+            stmt = pending_query(config).order_by(Conversation.id).limit(PAGE_SIZE)
+            if after is not None:
+                stmt = stmt.where(Conversation.id > after)
+            page = (await db.execute(stmt)).all()
+            if limit is not None:
+                page = page[:limit - queued]
+            if not page:
+                break
+            after = page[-1].id
+
+            # One query for the transcripts of the whole page
+            watermarks = {row.id: row.watermark for row in page}
+            dialogues = defaultdict(str)
+            messages = await db.execute(
+                select(Message.conversation_id, Message.seq, Message.role, Message.content)
+                .where(Message.conversation_id.in_(watermarks))
+                .order_by(Message.conversation_id, Message.seq)
+            )
+            for convo_id, seq, role, content in messages:
+                if seq <= watermarks[convo_id]:
+                    dialogues[convo_id] += f"{'User' if role == 'user' else 'Assistant'}: {content}\n"
+            await db.commit()
+
+            for row in page:
+                await queue.put((row.id, row.config, row.watermark, dialogues[row.id]))
+            queued += len(page)
+
+    for _ in range(workers):
+        await queue.put(None)
+
+
+async def produce_archived(queue, config, limit, workers):
+    """Like `produce`, for archived conversations, with transcripts read from their segments."""
+    after = None
+    queued = 0
+    async with AsyncSessionLocal() as db:
+        while limit is None or queued < limit:
+            stmt = pending_archived_query(config).order_by(ArchivedConversation.id).limit(PAGE_SIZE)
+            if after is not None:
+                stmt = stmt.where(ArchivedConversation.id > after)
+            page = (await db.scalars(stmt)).all()
+            if limit is not None:
+                page = page[:limit - queued]
+            if not page:
+                break
+            after = page[-1].id
+            await db.commit()
+
+            for entry, record in zip(page, await read_archived(page)):
+                dialogue = transcript((msg["role"], msg["content"]) for msg in record["messages"])
+                await queue.put((entry.id, entry.config, entry.message_count, dialogue))
+            queued += len(page)
+
+    for _ in range(workers):
+        await queue.put(None)
+
+
+async def evaluate_worker(queue, writer, progress, results):
+    while (item := await queue.get()) is not None:
+        convo_id, config, watermark, dialogue = item
         try:
-            # Model chosen for evaluation
-            response = groq.chat.completions.create(
-                model="llama3-70b-8192",
+            started = time.perf_counter()
+            response = await client.chat.completions.create(
+                model=EVALUATION_MODEL,
                 messages=[
-                    {"role": "user", "content": evaluation_prompt}
+                    {"role": "user", "content": evaluation_prompt(dialogue)}
                 ],
                 temperature=0.3,
                 max_tokens=300,
                 stream=False,
             )
+            score, comment = parse_evaluation(response.choices[0].message.content.strip())
+        except Exception as e:
+            # Nothing is stored, so the next run retries this conversation
+            print(f"⚠️ Evaluation failed for conversation {convo_id}: {e}")
+            progress.record(False)
+            continue
 
-            raw = response.choices[0].message.content.strip()
-            result = json.loads(raw)
-            results.append({
-                "conversation_id": str(convo.id),
-                "config": convo.config,
-                "score": result.get("score"),
-                "comment": result.get("comment")
-            })
+        await writer.add({
+            "conversation_id": convo_id,
+            "message_seq": watermark,
+            "config": config,
+            "score": score,
+            "comment": comment,
+            "model": EVALUATION_MODEL,
+        }, llm_call("evaluation", EVALUATION_MODEL, response, started))
+        results.append({
+            "conversation_id": str(convo_id),
+            "config": config,
+            "score": score,
+            "comment": comment
+        })
+        progress.record(True)
 
-        except Exception as e:
-            print(f"⚠️ Evaluation failed for conversation {convo.id}: {e}")
 
+async def run_evaluations(concurrency=DEFAULT_CONCURRENCY, config=None, limit=None, archived=False):
+    """
+    Score every conversation that has new messages since its last evaluation, or with
+    `archived`, every archived conversation not scored as of its last message.
+
+    At most `concurrency` LLM calls are in flight. Results are committed in batches as
+    they come in, so an interrupted run picks up where it stopped. Returns this run's
+    evaluations and a progress summary.
+    """
+    pending = pending_archived_query(config) if archived else pending_query(config)
+    producer = produce_archived if archived else produce
+    async with AsyncSessionLocal() as db:
+        total = await db.scalar(select(func.count()).select_from(pending.subquery()))
+    if limit is not None:
+        total = min(total, limit)
+
+    progress = Progress(total)
+    writer = EvaluationWriter()
+    results = []
+    # Bounded so transcripts are only loaded a little ahead of the workers
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+
+    # Batch work only uses the Groq budget interactive calls leave over
+    with background():
+        await asyncio.gather(
+            producer(queue, config, limit, concurrency),
+            *(evaluate_worker(queue, writer, progress, results) for _ in range(concurrency)),
+        )
+    await writer.flush()
+    progress.report()
+    return results, progress.summary()
+
+
+def evaluate_conversations(concurrency=DEFAULT_CONCURRENCY, config=None, limit=None):
+    """Blocking entry point for scripts. Returns the evaluations made by this run."""
+    async def run():
+        try:
+            return await run_evaluations(concurrency, config, limit)
+        finally:
+            await async_engine.dispose()
+
+    results, _ = asyncio.run(run())
     return results
 
+
+async def configuration_averages():
+    """Average of each configuration's latest evaluation per conversation, from the A/B counters."""
+    async with AsyncSessionLocal() as db:
+        rows = await db.execute(
+            select(VariantStats.variant, func.sum(VariantStats.score_sum), func.sum(VariantStats.evaluations))
+            .group_by(VariantStats.variant)
+        )
+        return {variant or None: total / count for variant, total, count in rows if count}
+
+
 def evaluate_configurations(evaluations):
     config_scores = defaultdict(list)
 
@@ -82,13 +342,25 @@ def evaluate_configurations(evaluations):
     return averages
 
 if __name__ == "__main__":
-    evaluations = evaluate_conversations()
-    print("\n=== Evaluation Results ===")
-    for e in evaluations:
-        print(f"\nConversation: {e['conversation_id']} | Config: {e['config']}")
-        print(f"Score: {e['score']} | Comment: {e['comment']}")
+    parser = argparse.ArgumentParser(description="Evaluate conversations with new messages.")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--config", help="Only evaluate conversations of this variant")
+    parser.add_argument("--limit", type=int, help="Evaluate at most this many conversations")
+    parser.add_argument("--archived", action="store_true", help="Evaluate archived conversations instead")
+    args = parser.parse_args()
+
+    async def main():
+        try:
+            _, summary = await run_evaluations(args.concurrency, args.config, args.limit, args.archived)
+            return summary, await configuration_averages()
+        finally:
+            await async_engine.dispose()
+
+    summary, averages = asyncio.run(main())
+    print("\n=== Evaluation Run ===")
+    print(f"Evaluated {summary['evaluated']} conversations ({summary['failed']} failed) "
+          f"in {summary['elapsed_seconds']:.1f}s, {summary['per_second']:.1f}/s")
 
     print("\n=== Configuration Averages ===")
-    config_summary = evaluate_configurations(evaluations)
-    for config, avg_score in config_summary.items():
-        print(f"Config {config}: Average Score = {avg_score:.2f}")
\ No newline at end of file
+    for config, avg_score in averages.items():
+        print(f"Config {config}: Average Score = {avg_score:.2f}")
@@ -0,0 +1,41 @@
+import argparse
+import asyncio
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+from app.export import EXPORT_DIR, FORMATS, SHARD_SIZE, run_export
+from app.talks import TalksFilters
+from db.database import async_engine
+
+load_dotenv()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export conversations to compressed shards for offline evaluation.")
+    parser.add_argument("--dir", default=EXPORT_DIR, help="Where shards and the checkpoint are written; rerun to resume")
+    parser.add_argument("--format", choices=FORMATS, default="ndjson")
+    parser.add_argument("--shard-size", type=int, default=SHARD_SIZE, help="Conversations per shard")
+    parser.add_argument("--config", help="Only conversations of this variant")
+    parser.add_argument("--since", type=datetime.fromisoformat, help="Only conversations started at or after this time")
+    parser.add_argument("--until", type=datetime.fromisoformat, help="Only conversations started before this time")
+    feedback = parser.add_mutually_exclusive_group()
+    feedback.add_argument("--with-feedback", dest="has_feedback", action="store_true", default=None)
+    feedback.add_argument("--without-feedback", dest="has_feedback", action="store_false")
+    args = parser.parse_args()
+
+    filters = TalksFilters(config=args.config, since=args.since, until=args.until, has_feedback=args.has_feedback)
+
+    async def main():
+        try:
+            return await run_export(filters, args.dir, args.format, args.shard_size)
+        finally:
+            await async_engine.dispose()
+
+    result = asyncio.run(main())
+    print(
+        f"✅ Exported {result['exported']} conversations in {result['seconds']}s "
+        f"({result['conversations_per_second']} conversations/s, {result['messages_per_second']} messages/s, "
+        f"peak RSS {result['peak_rss_mb']} MB)"
+    )
+    print(f"📁 {args.dir}: {result['shards']} shards, {result['conversations']} conversations, {result['messages']} messages")
@@ -1,14 +1,20 @@
 import os
 import json
+import time
 from dotenv import load_dotenv
 from sqlalchemy.orm import Session
 from db.database import SessionLocal
-from db.models import Conversation, Message, PromptProfile
-from groq import Groq
+from db.models import Conversation, Message
+from app.knowledge import replace_prompt_profile
+from app.llm import sync_client as groq
+from app.rate_limit import background
+from app.telemetry import llm_call
 from .evaluate import evaluate_conversations
 
 load_dotenv()
-groq = Groq(api_key=os.getenv("GROQ_API_KEY"))
+
+#LLM chosen for the system prompt update
+REFINEMENT_MODEL = "llama3-70b-8192"
 
 
 def get_feedback_prompt(convo_text, current_prompt):
@@ -48,7 +54,7 @@ def refine_prompts(evaluations):
         messages = (
             db.query(Message)
             .filter_by(conversation_id=convo.id)
-            .order_by(Message.timestamp)
+            .order_by(Message.seq)
             .all()
         )
 
@@ -59,19 +65,23 @@ def refine_prompts(evaluations):
         prompt = get_feedback_prompt(convo_text, convo.prompt_profile.system_prompt)
 
         try:
-            #LLM chosen for the system prompt update
-            res = groq.chat.completions.create(
-                model="llama3-70b-8192",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.3,
-                max_tokens=500,
-            )
-
+            started = time.perf_counter()
+            with background():
+                res = groq.chat.completions.create(
+                    model=REFINEMENT_MODEL,
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=0.3,
+                    max_tokens=500,
+                )
+
+            db.add(llm_call("prompt_refinement", REFINEMENT_MODEL, res, started))
             new_prompt = res.choices[0].message.content.strip()
 
             if new_prompt and new_prompt != convo.prompt_profile.system_prompt:
                 print(f"🔄 Updating prompt for convo {convo.id}")
-                convo.prompt_profile.system_prompt = new_prompt
+                replace_prompt_profile(db, convo.prompt_profile_id, new_prompt)
+                # Conversations already loaded may have moved to the new profile
+                db.expire_all()
                 updated_prompts += 1
         except Exception as e:
             print(f"⚠️ Failed to refine prompt for convo {convo.id}: {e}")
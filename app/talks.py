@@ -1,45 +1,262 @@
-from fastapi import APIRouter, Depends
-from fastapi.responses import HTMLResponse, FileResponse
-from sqlalchemy.orm import Session
-from db.database import SessionLocal
-from db.models import Conversation, Message
+import base64
+import json
+import uuid
+from datetime import datetime, timezone
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import HTMLResponse, FileResponse, StreamingResponse
+from sqlalchemy import exists, or_, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased, selectinload
+from app.archive import read_archived
+from app.message_writer import message_writer
+from db.database import AsyncSessionLocal
+from db.models import ArchivedConversation, Conversation, Message
 import os
 
 router = APIRouter()
 
-def get_db():
-    db = SessionLocal()
-    try:
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Rows fetched per round trip by the server-side cursor of the streaming export
+STREAM_BATCH_SIZE = 1000
+
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 @router.get("/talks", response_class=HTMLResponse)
 def serve_conversations_page():
     return FileResponse(os.path.join(os.getenv("FRONTEND_PATH"), "talks.html"))
 
 
+def as_naive_utc(value):
+    # Timestamps are stored as naive UTC
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+class TalksFilters:
+    def __init__(
+        self,
+        config: Optional[str] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        has_feedback: Optional[bool] = None,
+    ):
+        self.config = config
+        self.since = as_naive_utc(since)
+        self.until = as_naive_utc(until)
+        self.has_feedback = has_feedback
+
+    def apply(self, stmt):
+        if self.config:
+            stmt = stmt.where(Conversation.config == self.config)
+        if self.since:
+            stmt = stmt.where(Conversation.started_at >= self.since)
+        if self.until:
+            stmt = stmt.where(Conversation.started_at < self.until)
+        if self.has_feedback is not None:
+            # Aliased, so the subquery stays its own when the outer query joins messages too
+            rated = aliased(Message)
+            feedback = exists().where(
+                rated.conversation_id == Conversation.id,
+                or_(
+                    rated.thumbs_up.is_(True),
+                    rated.thumbs_down.is_(True),
+                    rated.feedback_text.is_not(None),
+                ),
+            ).correlate(Conversation)
+            stmt = stmt.where(feedback if self.has_feedback else ~feedback)
+        return stmt
+
+    def apply_archived(self, stmt):
+        if self.config:
+            stmt = stmt.where(ArchivedConversation.config == self.config)
+        if self.since:
+            stmt = stmt.where(ArchivedConversation.started_at >= self.since)
+        if self.until:
+            stmt = stmt.where(ArchivedConversation.started_at < self.until)
+        if self.has_feedback is not None:
+            stmt = stmt.where(ArchivedConversation.has_feedback.is_(self.has_feedback))
+        return stmt
+
+
+def encode_cursor(convo):
+    raw = json.dumps([convo.started_at.isoformat(), str(convo.id)])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        started_at, convo_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(started_at), uuid.UUID(convo_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+MESSAGE_FIELDS = ("role", "content", "model", "timestamp", "thumbs_up", "thumbs_down", "feedback_text")
+
+
+def serialize_message(msg):
+    return {
+        "role": msg.role,
+        "content": msg.content,
+        "model": msg.model,
+        "timestamp": msg.timestamp.isoformat(),
+        "thumbs_up": msg.thumbs_up,
+        "thumbs_down": msg.thumbs_down,
+        "feedback_text": msg.feedback_text
+    }
+
+
+def serialize_conversation(convo, messages):
+    return {
+        "conversation_id": str(convo.id),
+        "config": convo.config,
+        "started_at": convo.started_at.isoformat(),
+        "messages": messages
+    }
+
+
+def serialize_archived(record):
+    return {
+        "conversation_id": record["conversation_id"],
+        "config": record["config"],
+        "started_at": record["started_at"],
+        "archived": True,
+        "messages": [
+            {field: msg[field] for field in MESSAGE_FIELDS}
+            for msg in record["messages"]
+        ],
+    }
+
+
+# Newest conversations first; id breaks ties so the keyset is unique
+NEWEST_FIRST = (Conversation.started_at.desc(), Conversation.id.desc())
+
+
+def page_query(filters, limit, cursor=None):
+    stmt = filters.apply(
+        select(Conversation)
+        .options(selectinload(Conversation.messages))
+        .order_by(*NEWEST_FIRST)
+        .limit(limit)
+    )
+    if cursor:
+        stmt = stmt.where(tuple_(Conversation.started_at, Conversation.id) < decode_cursor(cursor))
+    return stmt
+
+
+ARCHIVED_NEWEST_FIRST = (ArchivedConversation.started_at.desc(), ArchivedConversation.id.desc())
+
+
+def archived_page_query(filters, limit, cursor=None):
+    stmt = filters.apply_archived(select(ArchivedConversation).order_by(*ARCHIVED_NEWEST_FIRST).limit(limit))
+    if cursor:
+        stmt = stmt.where(tuple_(ArchivedConversation.started_at, ArchivedConversation.id) < decode_cursor(cursor))
+    return stmt
+
+
 @router.get("/talks-data")
-def get_conversations_data(db: Session = Depends(get_db)):
-    conversations = db.query(Conversation).all()
-    data = []
-
-    for convo in conversations:
-        messages = db.query(Message).filter_by(conversation_id=convo.id).order_by(Message.timestamp).all()
-        data.append({
-            "conversation_id": str(convo.id),
-            "config": convo.config,
-            "started_at": convo.started_at.isoformat(),
-            "messages": [
-                {
-                    "role": msg.role,
-                    "content": msg.content,
-                    "timestamp": msg.timestamp.isoformat(),
-                    "thumbs_up": msg.thumbs_up,
-                    "thumbs_down": msg.thumbs_down,
-                    "feedback_text": msg.feedback_text
-                } for msg in messages
-            ]
-        })
-
-    return data
+async def get_conversations_data(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    filters: TalksFilters = Depends(),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    One page of conversations, newest first, with their messages.
+
+    Pages are keyset-paginated on (started_at, id): pass `next_cursor` back as `cursor`
+    for the following page. Messages for the whole page are loaded in a single query.
+    Archived conversations, all older than the hot ones, follow once those run out and
+    are read from their archive segments.
+    """
+    # A full flush, but only while turns are buffered: a page lists turns this worker just acknowledged
+    await message_writer.sync()
+    conversations = (await db.scalars(page_query(filters, limit + 1, cursor))).all()
+    archived = []
+    if len(conversations) <= limit:
+        archived = (await db.scalars(
+            archived_page_query(filters, limit + 1 - len(conversations), cursor)
+        )).all()
+    page = [*conversations, *archived][:limit]
+    records = await read_archived(page[len(conversations):])
+
+    return {
+        "conversations": [
+            serialize_conversation(convo, [serialize_message(msg) for msg in convo.messages])
+            for convo in page[:len(conversations)]
+        ] + [serialize_archived(record) for record in records],
+        "next_cursor": encode_cursor(page[-1]) if len(conversations) + len(archived) > limit else None,
+    }
+
+
+@router.get("/talks-data/stream")
+async def stream_conversations_data(filters: TalksFilters = Depends()):
+    """
+    Every matching conversation as newline-delimited JSON, one conversation per line.
+
+    Rows come from a server-side cursor over a single conversations-messages join, so
+    memory stays flat no matter how much history there is.
+    """
+    return StreamingResponse(stream_conversations(filters), media_type="application/x-ndjson")
+
+
+async def iter_conversations(filters, cursor=None):
+    """
+    Every matching conversation, newest first, as (row, serialized conversation): hot
+    ones, then archived ones. `row` has the (started_at, id) that `encode_cursor` turns
+    into a cursor resuming after it.
+    """
+    # Plain columns rather than entities: no ORM objects or identity map to fill per row
+    stmt = filters.apply(
+        select(
+            Conversation.id, Conversation.config, Conversation.started_at,
+            Message.id.label("message_id"), *(Message.__table__.c[field] for field in MESSAGE_FIELDS),
+        )
+        .select_from(Conversation)
+        .outerjoin(Message, Message.conversation_id == Conversation.id)
+        .order_by(*NEWEST_FIRST, Message.seq)
+        .execution_options(yield_per=STREAM_BATCH_SIZE)
+    )
+    archived = filters.apply_archived(select(ArchivedConversation).order_by(*ARCHIVED_NEWEST_FIRST))
+    if cursor:
+        after = decode_cursor(cursor)
+        stmt = stmt.where(tuple_(Conversation.started_at, Conversation.id) < after)
+        archived = archived.where(tuple_(ArchivedConversation.started_at, ArchivedConversation.id) < after)
+
+    # Read-your-writes, like a page: the export includes turns still in this worker's buffer
+    await message_writer.sync()
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(stmt)
+
+        current = None
+        messages = []
+        # Batch by batch: iterating an async result row by row costs a greenlet switch each
+        async for rows in result.partitions():
+            for row in rows:
+                if current is not None and row.id != current.id:
+                    yield current, serialize_conversation(current, messages)
+                    messages = []
+                current = row
+                if row.message_id is not None:
+                    messages.append(serialize_message(row))
+
+        if current is not None:
+            yield current, serialize_conversation(current, messages)
+
+        # Then the archived ones, each read from its segment as it is reached
+        entries = await db.stream_scalars(archived.execution_options(yield_per=STREAM_BATCH_SIZE))
+        async for batch in entries.partitions():
+            for entry, record in zip(batch, await read_archived(batch)):
+                yield entry, serialize_archived(record)
+
+
+async def stream_conversations(filters):
+    async for _, conversation in iter_conversations(filters):
+        yield json.dumps(conversation) + "\n"
@@ -0,0 +1,70 @@
+import time
+from dataclasses import asdict, dataclass
+from datetime import timedelta
+from typing import Optional
+
+from sqlalchemy import func, select
+
+from db.models import Conversation, LLMCall, Message, utcnow
+
+
+@dataclass
+class ReplyStats:
+    """What an assistant message records about the call that wrote it."""
+
+    model: Optional[str] = None
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    ttft_ms: Optional[int] = None
+    latency_ms: Optional[int] = None
+
+    def columns(self):
+        return asdict(self)
+
+
+def elapsed_ms(started):
+    return round((time.perf_counter() - started) * 1000)
+
+
+def usage_tokens(usage):
+    """(prompt, completion) tokens of a Groq usage object; None for what it doesn't report."""
+    return getattr(usage, "prompt_tokens", None), getattr(usage, "completion_tokens", None)
+
+
+def llm_call(purpose, model, response, started):
+    """An llm_calls row for a finished non-chat call."""
+    prompt_tokens, completion_tokens = usage_tokens(getattr(response, "usage", None))
+    return LLMCall(
+        purpose=purpose,
+        model=model,
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        latency_ms=elapsed_ms(started),
+        created_at=utcnow(),
+    )
+
+
+def turn_stats_query(hours=24):
+    """
+    p50/p95 latency and average tokens per reply by variant, over the last `hours`.
+
+    Reads only the partial ix_messages_assistant_timestamp index, plus the conversation
+    of each reply by primary key. Postgres only (percentile_cont).
+    """
+    return (
+        select(
+            Conversation.config.label("variant"),
+            func.count().label("replies"),
+            func.percentile_cont(0.5).within_group(Message.latency_ms).label("p50_latency_ms"),
+            func.percentile_cont(0.95).within_group(Message.latency_ms).label("p95_latency_ms"),
+            func.percentile_cont(0.95).within_group(Message.ttft_ms).label("p95_ttft_ms"),
+            func.avg(Message.prompt_tokens).label("avg_prompt_tokens"),
+            func.avg(Message.completion_tokens).label("avg_completion_tokens"),
+            func.sum(Message.prompt_tokens + Message.completion_tokens).label("total_tokens"),
+        )
+        .select_from(Message)
+        .join(Conversation, Conversation.id == Message.conversation_id)
+        .where(Message.role == "assistant", Message.timestamp >= utcnow() - timedelta(hours=hours))
+        .group_by(Conversation.config)
+        .order_by(Conversation.config)
+    )
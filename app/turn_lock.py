@@ -0,0 +1,153 @@
+"""
+Per-conversation turn locks.
+
+The turns of a conversation run one at a time, from reading its history to saving the
+reply, so two messages sent at once can't both be answered from the same history and
+interleave. Within a worker, turns queue on an asyncio lock. On Postgres they also take
+a session advisory lock, which serializes them across workers and goes away with the
+connection if a worker dies. The advisory lock is held on an autocommit connection from
+a small pool of its own, so waiting on Groq never ties up the main pool or leaves a
+transaction open.
+"""
+import asyncio
+import os
+
+from anyio import CancelScope
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.log import get_logger
+from db.database import async_engine
+
+logger = get_logger("turn_lock")
+
+# How long a turn waits for the one before it, on this worker and then on Postgres
+LOCK_TIMEOUT = float(os.getenv("CONVERSATION_LOCK_TIMEOUT_SECONDS", "30"))
+POOL_SIZE = int(os.getenv("CONVERSATION_LOCK_POOL_SIZE", "5"))
+MAX_OVERFLOW = int(os.getenv("CONVERSATION_LOCK_MAX_OVERFLOW", "45"))
+
+# Postgres lock_not_available, raised when lock_timeout runs out
+LOCK_NOT_AVAILABLE = "55P03"
+
+
+def lock_key(conversation_id):
+    # The bigint key of the single-key form, 64 bits of the id so conversations practically
+    # never share one; two that did would only ever wait on each other
+    return int.from_bytes(conversation_id.bytes[:8], "big", signed=True)
+
+
+class TurnLockTimeout(Exception):
+    pass
+
+
+class TurnLock:
+    """A held conversation lock. Release it once the turn is saved."""
+
+    def __init__(self, locks, conversation_id, conn):
+        self._locks = locks
+        self.conversation_id = conversation_id
+        self._conn = conn
+        self._held = True
+
+    async def release(self):
+        if not self._held:
+            return
+        self._held = False
+        # Shielded: a cancelled request must not leave the conversation locked
+        with CancelScope(shield=True):
+            await self._locks._release(self.conversation_id, self._conn)
+
+
+class ConversationLocks:
+    def __init__(self, timeout=LOCK_TIMEOUT):
+        self.timeout = timeout
+        self.waited = 0
+        self.timeouts = 0
+        # conversation_id -> [asyncio.Lock, turns holding or waiting for it]
+        self._local = {}
+        self._engine = None
+
+    def _shared(self):
+        """Engine of the advisory lock connections, on Postgres only."""
+        if self._engine is None and async_engine.dialect.name == "postgresql":
+            self._engine = create_async_engine(
+                async_engine.url,
+                pool_size=POOL_SIZE,
+                max_overflow=MAX_OVERFLOW,
+                pool_pre_ping=True,
+                isolation_level="AUTOCOMMIT",
+                connect_args={"server_settings": {"lock_timeout": str(round(self.timeout * 1000))}},
+            )
+        return self._engine
+
+    async def acquire(self, conversation_id):
+        """Wait for the conversation's previous turn. Raises TurnLockTimeout after `timeout`."""
+        entry = self._local.setdefault(conversation_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        local = entry[0]
+        if local.locked():
+            self.waited += 1
+        try:
+            await asyncio.wait_for(local.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            self._unref(conversation_id)
+            self.timeouts += 1
+            raise TurnLockTimeout()
+        except BaseException:
+            self._unref(conversation_id)
+            raise
+
+        conn = None
+        try:
+            engine = self._shared()
+            if engine is not None:
+                conn = await engine.connect()
+                await conn.execute(
+                    text("SELECT pg_advisory_lock(:key)"), {"key": lock_key(conversation_id)},
+                )
+        except BaseException as e:
+            if conn is not None:
+                await conn.close()
+            local.release()
+            self._unref(conversation_id)
+            if isinstance(e, DBAPIError) and getattr(e.orig, "sqlstate", None) == LOCK_NOT_AVAILABLE:
+                self.timeouts += 1
+                raise TurnLockTimeout() from e
+            raise
+        return TurnLock(self, conversation_id, conn)
+
+    async def _release(self, conversation_id, conn):
+        try:
+            if conn is not None:
+                try:
+                    await conn.execute(
+                        text("SELECT pg_advisory_unlock(:key)"), {"key": lock_key(conversation_id)},
+                    )
+                except Exception as e:
+                    # Dropping the connection is what releases the lock then
+                    logger.warning("⚠️ Could not release conversation lock: %s", e)
+                    await conn.invalidate()
+                finally:
+                    await conn.close()
+        finally:
+            self._local[conversation_id][0].release()
+            self._unref(conversation_id)
+
+    def _unref(self, conversation_id):
+        entry = self._local[conversation_id]
+        entry[1] -= 1
+        if not entry[1]:
+            del self._local[conversation_id]
+
+    def stats(self):
+        return {"locked": len(self._local), "waited": self.waited, "timeouts": self.timeouts}
+
+    async def close(self):
+        # Pooled connections belong to the event loop that opened them
+        if self._engine is not None:
+            await self._engine.dispose()
+            self._engine = None
+
+
+conversation_locks = ConversationLocks()
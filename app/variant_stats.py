@@ -0,0 +1,177 @@
+import os
+import random
+
+from sqlalchemy import case, delete, func, literal, select, text, union_all
+from sqlalchemy.dialects import postgresql, sqlite
+
+from db.models import ArchivedConversation, Conversation, Evaluation, Message, VariantStats
+
+# Rows per variant that increments are spread over
+SHARDS = int(os.getenv("AB_STATS_SHARDS", "8"))
+
+COUNTERS = (
+    "conversations", "turns", "thumbs_up", "thumbs_down", "commented", "evaluations", "score_sum", "score_sq_sum",
+)
+
+
+def variant_key(config):
+    return config or ""
+
+
+def counts_statement(dialect_name, deltas):
+    """One upsert adding `deltas`, {variant: {counter: change}}, to a random shard of each variant."""
+    insert = postgresql.insert if dialect_name == "postgresql" else sqlite.insert
+    # Same row order in every writer, so two batches can't deadlock on each other's rows
+    rows = [
+        {"variant": variant, "shard": random.randrange(SHARDS), **{c: counts.get(c, 0) for c in COUNTERS}}
+        for variant, counts in sorted(deltas.items())
+    ]
+    stmt = insert(VariantStats.__table__).values(rows)
+    return stmt.on_conflict_do_update(
+        index_elements=["variant", "shard"],
+        set_={c: VariantStats.__table__.c[c] + stmt.excluded[c] for c in COUNTERS},
+    )
+
+
+async def add_counts(db, deltas):
+    """Apply `deltas` in the caller's transaction, on an AsyncSession or AsyncConnection."""
+    deltas = {variant: counts for variant, counts in deltas.items() if any(counts.values())}
+    if deltas:
+        dialect = db.dialect if hasattr(db, "dialect") else db.bind.dialect
+        await db.execute(counts_statement(dialect.name, deltas))
+
+
+def feedback_flags(message):
+    return {
+        "thumbs_up": int(bool(message.thumbs_up)),
+        "thumbs_down": int(bool(message.thumbs_down)),
+        "commented": int(bool(message.feedback_text)),
+    }
+
+
+def feedback_delta(before, after):
+    return {name: after[name] - before[name] for name in before}
+
+
+async def count_written(conn, created, replied):
+    """
+    Count the conversations in `created` and one turn per entry of `replied`, both
+    lists of conversation ids actually inserted by a write-behind flush.
+    """
+    ids = set(created) | set(replied)
+    if not ids:
+        return
+    configs = dict((await conn.execute(
+        select(Conversation.id, Conversation.config).where(Conversation.id.in_(ids))
+    )).all())
+    deltas = {}
+    for name, conversation_ids in (("conversations", created), ("turns", replied)):
+        for conversation_id in conversation_ids:
+            counts = deltas.setdefault(variant_key(configs.get(conversation_id)), {})
+            counts[name] = counts.get(name, 0) + 1
+    await add_counts(conn, deltas)
+
+
+async def count_evaluations(db, inserted):
+    """
+    Count newly inserted evaluations, given as (conversation_id, message_seq) keys.
+
+    Only the latest evaluation of a conversation counts, so a newer score replaces the
+    one it supersedes.
+    """
+    inserted = set(inserted)
+    if not inserted:
+        return
+    rows = (await db.execute(
+        select(Evaluation.conversation_id, Evaluation.message_seq, Evaluation.config, Evaluation.score)
+        .where(Evaluation.conversation_id.in_({conversation_id for conversation_id, _ in inserted}))
+    )).all()
+    latest, previous = {}, {}
+    for row in rows:
+        if row.conversation_id not in latest or row.message_seq > latest[row.conversation_id].message_seq:
+            latest[row.conversation_id] = row
+        if (row.conversation_id, row.message_seq) not in inserted:
+            if row.conversation_id not in previous or row.message_seq > previous[row.conversation_id].message_seq:
+                previous[row.conversation_id] = row
+
+    deltas = {}
+    for conversation_id, new in latest.items():
+        old = previous.get(conversation_id)
+        if old is new:
+            continue
+        for row, sign in ((old, -1), (new, 1)):
+            if row is None or row.score is None:
+                continue
+            counts = deltas.setdefault(variant_key(row.config), {})
+            counts["evaluations"] = counts.get("evaluations", 0) + sign
+            counts["score_sum"] = counts.get("score_sum", 0) + sign * row.score
+            counts["score_sq_sum"] = counts.get("score_sq_sum", 0) + sign * row.score * row.score
+    await add_counts(db, deltas)
+
+
+def totals_query():
+    """The counters of each variant, summed over its shards."""
+    return (
+        select(VariantStats.variant, *(func.sum(VariantStats.__table__.c[c]).label(c) for c in COUNTERS))
+        .group_by(VariantStats.variant)
+        .order_by(VariantStats.variant)
+    )
+
+
+def _counts(variant, **counts):
+    return [variant.label("variant"), *(counts.get(c, literal(0)).label(c) for c in COUNTERS)]
+
+
+def recount_query():
+    """The counters recomputed from the tables they count, archive catalog included. Scans them all."""
+    flag = lambda condition: case((condition, 1), else_=0)
+    latest = (
+        select(Evaluation.conversation_id, func.max(Evaluation.message_seq).label("message_seq"))
+        .group_by(Evaluation.conversation_id)
+        .subquery()
+    )
+    parts = union_all(
+        select(*_counts(func.coalesce(Conversation.config, ""), conversations=literal(1))),
+        select(*_counts(
+            func.coalesce(Conversation.config, ""),
+            turns=flag(Message.role == "assistant"),
+            thumbs_up=flag(Message.thumbs_up.is_(True)),
+            thumbs_down=flag(Message.thumbs_down.is_(True)),
+            commented=flag(Message.feedback_text != ""),
+        )).select_from(Message).join(Conversation, Conversation.id == Message.conversation_id),
+        select(*_counts(
+            func.coalesce(ArchivedConversation.config, ""),
+            conversations=literal(1),
+            turns=ArchivedConversation.turns,
+            thumbs_up=ArchivedConversation.thumbs_up,
+            thumbs_down=ArchivedConversation.thumbs_down,
+            commented=ArchivedConversation.commented,
+        )),
+        select(*_counts(
+            func.coalesce(Evaluation.config, ""),
+            evaluations=literal(1),
+            score_sum=Evaluation.score,
+            score_sq_sum=Evaluation.score * Evaluation.score,
+        ))
+        .join(latest, (Evaluation.conversation_id == latest.c.conversation_id)
+              & (Evaluation.message_seq == latest.c.message_seq))
+        .where(Evaluation.score.is_not(None)),
+    ).subquery()
+    return (
+        select(parts.c.variant, *(func.sum(parts.c[c]).label(c) for c in COUNTERS))
+        .group_by(parts.c.variant)
+        .order_by(parts.c.variant)
+    )
+
+
+async def rebuild(db):
+    """Replace the counters with a full recount, e.g. after writes that bypassed them."""
+    if db.bind.dialect.name == "postgresql":
+        # Writers wait until the recount commits, so none is counted twice or missed
+        await db.execute(text("LOCK TABLE variant_stats IN EXCLUSIVE MODE"))
+    await db.execute(delete(VariantStats))
+    recount = recount_query().subquery()
+    await db.execute(VariantStats.__table__.insert().from_select(
+        ["variant", "shard", *COUNTERS],
+        select(recount.c.variant, literal(0), *(recount.c[c] for c in COUNTERS)),
+    ))
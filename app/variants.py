@@ -0,0 +1,163 @@
+import asyncio
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
+
+from app.log import get_logger
+
+logger = get_logger("variants")
+
+DEFAULT_CONFIG_PATH = os.getenv("MODEL_VARIANTS_PATH", "config/model_variants.json")
+DEFAULT_VARIANT = os.getenv("DEFAULT_MODEL_GROUP", "A")
+RELOAD_INTERVAL = float(os.getenv("MODEL_VARIANTS_RELOAD_INTERVAL", "5"))
+
+
+class ModelVariant(BaseModel):
+    # Unknown keys are kept so new variant options don't break older code
+    model_config = ConfigDict(extra="allow", frozen=True)
+
+    model: str
+    temperature: float = Field(ge=0, le=2)
+    presence_penalty: float = Field(0, ge=-2, le=2)
+    frequency_penalty: float = Field(0, ge=-2, le=2)
+    max_tokens: int = Field(gt=0)
+    system_prompt: str
+    knowledge_sources: List[str] = []
+
+    # Token budgets for context assembly
+    context_window: int = Field(8192, gt=0)
+    history_budget: Optional[int] = Field(None, gt=0)
+    summary_max_tokens: int = Field(300, gt=0)
+
+    # Identical requests reuse a cached reply when enabled, as long as the variant
+    # samples at or below the temperature threshold
+    completion_cache: bool = False
+    completion_cache_max_temperature: float = Field(0.3, ge=0, le=2)
+
+    # Models tried in order after the main one fails. With hedge_delay_ms, the next one
+    # is also raced against a call that hasn't produced a first token by then.
+    fallback_models: List[str] = []
+    hedge_delay_ms: Optional[int] = Field(None, gt=0)
+
+    # Chunks of the local knowledge index most relevant to the user's message, added to
+    # each call within retrieval_budget tokens. 0 turns retrieval off.
+    retrieval_top_k: int = Field(0, ge=0)
+    retrieval_budget: int = Field(800, gt=0)
+
+
+class VariantSnapshot:
+    """A validated set of variants. Replaced as a whole on reload, never edited in place."""
+
+    __slots__ = ("variants", "version", "digest", "mtime", "loaded_at")
+
+    def __init__(self, variants, version, digest, mtime):
+        self.variants: Dict[str, ModelVariant] = variants
+        self.version = version
+        self.digest = digest
+        self.mtime = mtime
+        self.loaded_at = datetime.now(timezone.utc)
+
+
+def parse_variants(raw):
+    data = json.loads(raw)
+    if not isinstance(data, dict) or not data:
+        raise ValueError("Model variants must be a non-empty JSON object")
+
+    variants = {}
+    for name, config in data.items():
+        try:
+            variants[name] = ModelVariant.model_validate(config)
+        except ValidationError as e:
+            raise ValueError(f"Invalid configuration '{name}': {e}") from e
+    return variants
+
+
+class ModelVariantRegistry:
+    """
+    Holds the model variants in memory so the request path never touches the file.
+
+    The file is validated as a whole before it replaces the active snapshot, so a bad
+    edit keeps serving the previous variants instead of failing at call time.
+    """
+
+    def __init__(self, path=DEFAULT_CONFIG_PATH):
+        self.path = path
+        self._snapshot = None
+
+    @classmethod
+    def from_file(cls, path):
+        registry = cls(path)
+        registry.load()
+        return registry
+
+    @property
+    def snapshot(self) -> VariantSnapshot:
+        # Loaded at startup by the app; scripts and tests load on first use
+        if self._snapshot is None:
+            self.load()
+        return self._snapshot
+
+    def load(self):
+        mtime = os.stat(self.path).st_mtime_ns
+        with open(self.path, "rb") as f:
+            raw = f.read()
+
+        digest = hashlib.sha256(raw).hexdigest()
+        if self._snapshot and self._snapshot.digest == digest:
+            # Touched but unchanged, keep the current version
+            self._snapshot.mtime = mtime
+            return self._snapshot
+
+        variants = parse_variants(raw)
+        version = self._snapshot.version + 1 if self._snapshot else 1
+
+        # Single reference swap, readers see either the old or the new set
+        self._snapshot = VariantSnapshot(variants, version, digest, mtime)
+        return self._snapshot
+
+    def reload_if_changed(self):
+        """Reload when the file's mtime moved. Returns True if a new snapshot is active."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError as e:
+            logger.warning("⚠️ Cannot stat model variants %s: %s", self.path, e)
+            return False
+
+        current = self._snapshot
+        if current and current.mtime == mtime:
+            return False
+
+        try:
+            snapshot = self.load()
+        except (OSError, ValueError) as e:
+            logger.error("❌ Keeping model variants v%d, reload failed: %s", current.version if current else 0, e)
+            if current:
+                # Don't retry the same broken file on every poll
+                current.mtime = mtime
+            return False
+
+        if snapshot is current:
+            return False
+        logger.info("🔁 Loaded model variants v%d from %s", snapshot.version, self.path)
+        return True
+
+    async def watch(self, interval=RELOAD_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            await asyncio.to_thread(self.reload_if_changed)
+
+    def get(self, name) -> ModelVariant:
+        variant = self.snapshot.variants.get(name)
+        if not variant:
+            raise ValueError(f"No configuration '{name}'")
+        return variant
+
+    def names(self):
+        return list(self.snapshot.variants)
+
+
+registry = ModelVariantRegistry()
@@ -0,0 +1,155 @@
+"""
+Stand-in for the Groq chat completions API, for load tests.
+
+Answers POST /openai/v1/chat/completions like Groq does, streaming or not, after a
+configurable latency and at a configurable token rate, and fails a share of requests on
+purpose. Point the app at it with GROQ_BASE_URL=http://<host>:<port>.
+
+    python -m bench.fake_groq --port 9100 --latency-ms 300 --tokens-per-second 400
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from dataclasses import dataclass
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+@dataclass
+class FakeGroqSettings:
+    # Time before the first token
+    latency_ms: float = 200.0
+    # Random extra latency, up to this share of latency_ms
+    latency_jitter: float = 0.2
+    tokens_per_second: float = 500.0
+    reply_tokens: int = 60
+    # Share of requests that fail with one of error_statuses
+    error_rate: float = 0.0
+    error_statuses: tuple = (429, 500, 503)
+    retry_after: float = 1.0
+
+
+def reply_words(count):
+    return [f"word{i} " for i in range(count)]
+
+
+def usage(messages, completion_tokens):
+    # Rough, but stable across runs
+    prompt_tokens = sum(len(str(m.get("content", ""))) for m in messages) // 4
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+def error_response(status, settings):
+    headers = {"retry-after": str(settings.retry_after)} if status == 429 else {}
+    body = {"error": {"message": f"Injected error {status}", "type": "fake_groq_error", "code": str(status)}}
+    return JSONResponse(body, status_code=status, headers=headers)
+
+
+def create_app(settings=None):
+    settings = settings or FakeGroqSettings()
+    app = FastAPI()
+    app.state.settings = settings
+    app.state.requests = 0
+
+    async def first_token_delay():
+        jitter = random.uniform(0, settings.latency_jitter) if settings.latency_jitter else 0
+        await asyncio.sleep(settings.latency_ms * (1 + jitter) / 1000)
+
+    @app.post("/openai/v1/chat/completions")
+    async def chat_completions(request: Request):
+        app.state.requests += 1
+        body = await request.json()
+        if settings.error_rate and random.random() < settings.error_rate:
+            return error_response(random.choice(settings.error_statuses), settings)
+
+        model = body.get("model", "fake-model")
+        words = reply_words(min(settings.reply_tokens, body.get("max_tokens") or settings.reply_tokens))
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        token_delay = 1 / settings.tokens_per_second if settings.tokens_per_second else 0
+
+        if not body.get("stream"):
+            await first_token_delay()
+            await asyncio.sleep(token_delay * len(words))
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(words)},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage(body.get("messages", []), len(words)),
+            }
+
+        def chunk(delta, finish_reason=None, **extra):
+            data = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                **extra,
+            }
+            return f"data: {json.dumps(data)}\n\n"
+
+        async def events():
+            await first_token_delay()
+            yield chunk({"role": "assistant", "content": ""})
+            for word in words:
+                yield chunk({"content": word})
+                await asyncio.sleep(token_delay)
+            # Groq reports usage on the last chunk
+            yield chunk({}, "stop", x_groq={"id": completion_id, "usage": usage(body.get("messages", []), len(words))})
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/stats")
+    def stats():
+        return {"requests": app.state.requests}
+
+    return app
+
+
+def parse_settings(args):
+    return FakeGroqSettings(
+        latency_ms=args.latency_ms,
+        latency_jitter=args.latency_jitter,
+        tokens_per_second=args.tokens_per_second,
+        reply_tokens=args.reply_tokens,
+        error_rate=args.error_rate,
+        error_statuses=tuple(int(s) for s in args.error_statuses.split(",")),
+        retry_after=args.retry_after,
+    )
+
+
+def add_arguments(parser):
+    defaults = FakeGroqSettings()
+    parser.add_argument("--latency-ms", type=float, default=defaults.latency_ms)
+    parser.add_argument("--latency-jitter", type=float, default=defaults.latency_jitter)
+    parser.add_argument("--tokens-per-second", type=float, default=defaults.tokens_per_second)
+    parser.add_argument("--reply-tokens", type=int, default=defaults.reply_tokens)
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate)
+    parser.add_argument("--error-statuses", default=",".join(str(s) for s in defaults.error_statuses))
+    parser.add_argument("--retry-after", type=float, default=defaults.retry_after)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Groq-compatible stand-in server for load tests.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    add_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(create_app(parse_settings(args)), host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,325 @@
+"""
+Load test of the chat service against the Groq stand-in.
+
+Starts bench.fake_groq and the app (uvicorn) as subprocesses, drives each scenario at
+the given concurrency for a fixed duration, and reports requests per second with
+p50/p95/p99 latency. Results are compared with a baseline file so regressions show up
+between commits.
+
+    DATABASE_URL=postgresql://... python -m bench.load --concurrency 32 --duration 20
+    python -m bench.load --check              # exit with status 1 on a regression
+    python -m bench.load --update-baseline    # after an intended change in performance
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import httpx
+
+from bench import fake_groq
+
+BENCH_DIR = Path(__file__).parent
+DEFAULT_BASELINE = BENCH_DIR / "baseline.json"
+# Budgets far above what a run sends, so the limiter doesn't shape the results
+BENCH_LIMITS = BENCH_DIR / "groq_limits.json"
+
+SCENARIOS = ("chat", "chat_stream", "feedback", "talks_data")
+
+# A conversation is continued for this many turns before a new one starts
+TURNS_PER_CONVERSATION = 5
+
+STARTUP_TIMEOUT = 60
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, round(pct / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(latencies, errors, elapsed, ttfts=None):
+    latencies = sorted(latencies)
+    ms = lambda value: round(value * 1000, 1) if value is not None else None
+    summary = {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+    }
+    if ttfts:
+        ttfts = sorted(ttfts)
+        summary["ttft_p50_ms"] = ms(percentile(ttfts, 50))
+        summary["ttft_p95_ms"] = ms(percentile(ttfts, 95))
+    return summary
+
+
+def compare(results, baseline, tolerance):
+    """Regressions against the baseline: lower throughput or higher tail latency than allowed."""
+    regressions = []
+    for scenario, current in results.items():
+        before = baseline.get(scenario)
+        if not before:
+            continue
+        if before.get("rps") and current["rps"] < before["rps"] * (1 - tolerance):
+            regressions.append(f"{scenario}: rps {current['rps']} < baseline {before['rps']}")
+        for key in ("p95_ms", "p99_ms"):
+            if before.get(key) and current.get(key) and current[key] > before[key] * (1 + tolerance):
+                regressions.append(f"{scenario}: {key} {current[key]} > baseline {before[key]}")
+    return regressions
+
+
+class Run:
+    def __init__(self, client, message_ids):
+        self.client = client
+        self.message_ids = message_ids
+        self.latencies = []
+        self.ttfts = []
+        self.errors = defaultdict(int)
+
+    def failed(self, reason):
+        self.errors[str(reason)] += 1
+
+
+async def chat_user(run, deadline, stream):
+    conversation_id = None
+    turn = 0
+    while time.perf_counter() < deadline:
+        payload = {"message": f"Question {random.randint(0, 10**9)} about movies?", "stream": stream}
+        if conversation_id and turn < TURNS_PER_CONVERSATION:
+            payload["conversation_id"] = conversation_id
+        else:
+            conversation_id, turn = None, 0
+
+        started = time.perf_counter()
+        try:
+            if stream:
+                ttft = None
+                async with run.client.stream("POST", "/chat", json=payload) as response:
+                    if response.status_code != 200:
+                        run.failed(response.status_code)
+                        continue
+                    async for line in response.aiter_lines():
+                        if line.startswith("event: token") and ttft is None:
+                            ttft = time.perf_counter() - started
+                        elif line.startswith("data:") and "conversation_id" in line:
+                            data = json.loads(line[5:])
+                            conversation_id = data["conversation_id"]
+                            run.message_ids.append(data["message_id"])
+                if ttft is not None:
+                    run.ttfts.append(ttft)
+            else:
+                response = await run.client.post("/chat", json=payload)
+                if response.status_code != 200:
+                    run.failed(response.status_code)
+                    continue
+                data = response.json()
+                conversation_id = data["conversation_id"]
+                run.message_ids.append(data["message_id"])
+        except httpx.HTTPError as e:
+            run.failed(type(e).__name__)
+            continue
+        run.latencies.append(time.perf_counter() - started)
+        turn += 1
+
+
+async def feedback_user(run, deadline):
+    while time.perf_counter() < deadline:
+        if not run.message_ids:
+            run.failed("no messages to rate")
+            return
+        payload = {"message_id": random.choice(run.message_ids), "thumbs_up": random.random() < 0.7}
+        started = time.perf_counter()
+        try:
+            response = await run.client.patch("/feedback", json=payload)
+        except httpx.HTTPError as e:
+            run.failed(type(e).__name__)
+            continue
+        if response.status_code != 200:
+            run.failed(response.status_code)
+            continue
+        run.latencies.append(time.perf_counter() - started)
+
+
+async def talks_user(run, deadline):
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            response = await run.client.get("/talks-data", params={"limit": 50})
+        except httpx.HTTPError as e:
+            run.failed(type(e).__name__)
+            continue
+        if response.status_code != 200:
+            run.failed(response.status_code)
+            continue
+        run.latencies.append(time.perf_counter() - started)
+
+
+def user_for(scenario):
+    return {
+        "chat": lambda run, deadline: chat_user(run, deadline, stream=False),
+        "chat_stream": lambda run, deadline: chat_user(run, deadline, stream=True),
+        "feedback": feedback_user,
+        "talks_data": talks_user,
+    }[scenario]
+
+
+async def run_scenarios(base_url, scenarios, concurrency, duration, warmup):
+    message_ids = []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        # Warm up caches and connection pools, and leave messages to rate
+        warm = Run(client, message_ids)
+        await asyncio.gather(*(chat_user(warm, time.perf_counter() + warmup, False) for _ in range(concurrency)))
+
+        results = {}
+        for scenario in scenarios:
+            run = Run(client, message_ids)
+            user = user_for(scenario)
+            started = time.perf_counter()
+            deadline = started + duration
+            await asyncio.gather(*(user(run, deadline) for _ in range(concurrency)))
+            elapsed = time.perf_counter() - started
+            results[scenario] = {**summarize(run.latencies, sum(run.errors.values()), elapsed, run.ttfts)}
+            if run.errors:
+                results[scenario]["error_kinds"] = dict(run.errors)
+            print(f"📊 {scenario}: {json.dumps(results[scenario])}", flush=True)
+        return results
+
+
+def wait_until_up(url, process, name):
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{name} exited with code {process.returncode}")
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{name} did not start within {STARTUP_TIMEOUT}s")
+
+
+def start_services(args):
+    fake_url = f"http://127.0.0.1:{args.fake_port}"
+    app_url = f"http://127.0.0.1:{args.app_port}"
+    fake_cmd = [
+        sys.executable, "-m", "bench.fake_groq", "--port", str(args.fake_port),
+        "--latency-ms", str(args.latency_ms), "--latency-jitter", str(args.latency_jitter),
+        "--tokens-per-second", str(args.tokens_per_second), "--reply-tokens", str(args.reply_tokens),
+        "--error-rate", str(args.error_rate), "--error-statuses", args.error_statuses,
+        "--retry-after", str(args.retry_after),
+    ]
+    env = {
+        **os.environ,
+        "GROQ_API_KEY": "bench",
+        "GROQ_BASE_URL": fake_url,
+        "GROQ_LIMITS_PATH": str(BENCH_LIMITS),
+        "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING"),
+    }
+    app_cmd = [
+        sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(args.app_port),
+        "--workers", str(args.workers), "--log-level", "warning", "--no-access-log",
+    ]
+
+    processes = [subprocess.Popen(fake_cmd)]
+    try:
+        wait_until_up(f"{fake_url}/stats", processes[0], "fake Groq server")
+        processes.append(subprocess.Popen(app_cmd, env=env))
+        wait_until_up(f"{app_url}/metrics", processes[1], "app")
+    except Exception:
+        stop_services(processes)
+        raise
+    return app_url, processes
+
+
+def stop_services(processes):
+    for process in reversed(processes):
+        process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test /chat, /feedback and /talks-data against a fake Groq.")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=15, help="Seconds per scenario")
+    parser.add_argument("--warmup", type=float, default=3, help="Seconds of chat traffic before measuring")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the app")
+    parser.add_argument("--app-port", type=int, default=9000)
+    parser.add_argument("--fake-port", type=int, default=9100)
+    parser.add_argument("--app-url", help="Drive an app that is already running instead of starting one")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--update-baseline", action="store_true", help="Save this run as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed change against the baseline")
+    parser.add_argument("--check", action="store_true", help="Exit with status 1 on a regression")
+    parser.add_argument("--output", type=Path, help="Also write the results to this file")
+    fake_groq.add_arguments(parser)
+    args = parser.parse_args()
+
+    scenarios = [s for s in args.scenarios.split(",") if s]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    processes = []
+    if args.app_url:
+        app_url = args.app_url
+    else:
+        app_url, processes = start_services(args)
+    try:
+        results = asyncio.run(run_scenarios(app_url, scenarios, args.concurrency, args.duration, args.warmup))
+    finally:
+        stop_services(processes)
+
+    report = {
+        "settings": {
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "workers": args.workers,
+            "latency_ms": args.latency_ms,
+            "tokens_per_second": args.tokens_per_second,
+            "reply_tokens": args.reply_tokens,
+            "error_rate": args.error_rate,
+        },
+        "results": results,
+    }
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2) + "\n")
+
+    if args.update_baseline:
+        args.baseline.write_text(json.dumps(report, indent=2) + "\n")
+        print(f"💾 Saved baseline to {args.baseline}")
+        return 0
+
+    if not args.baseline.exists():
+        print(f"ℹ️ No baseline at {args.baseline}; run with --update-baseline to create one")
+        return 0
+    baseline = json.loads(args.baseline.read_text())
+    if baseline.get("settings") != report["settings"]:
+        print("⚠️ Baseline was recorded with different settings; comparison is only indicative")
+    regressions = compare(results, baseline.get("results", {}), args.tolerance)
+    for regression in regressions:
+        print(f"❌ Regression: {regression}")
+    if not regressions:
+        print(f"✅ Within {args.tolerance:.0%} of the baseline")
+    return 1 if regressions and args.check else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,69 @@
+"""
+Ingestion and query latency of the knowledge index on a synthetic corpus.
+
+Chunks are drawn from a Zipf-distributed vocabulary, like natural text, so common
+terms have long postings lists.
+
+    python -m bench.retrieval --chunks 100000 --queries 1000
+"""
+import argparse
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from app.retrieval import KnowledgeIndex
+
+
+def synthetic_corpus(chunks, words_per_chunk, vocabulary, seed=0):
+    rng = np.random.default_rng(seed)
+    words = np.array([f"term{i}" for i in range(vocabulary)])
+    ranks = np.minimum(rng.zipf(1.2, size=(chunks, words_per_chunk)), vocabulary) - 1
+    return [" ".join(words[row]) for row in ranks], words
+
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark knowledge index ingestion and queries.")
+    parser.add_argument("--chunks", type=int, default=100_000)
+    parser.add_argument("--words-per-chunk", type=int, default=180)
+    parser.add_argument("--vocabulary", type=int, default=50_000)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--top-k", type=int, default=5)
+    args = parser.parse_args()
+
+    corpus, words = synthetic_corpus(args.chunks, args.words_per_chunk, args.vocabulary)
+    index, build = timed(lambda: KnowledgeIndex.build([("synthetic", corpus)]))
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "index.npz"
+        _, save = timed(lambda: index.save(path))
+        size = path.stat().st_size
+        index, load = timed(lambda: KnowledgeIndex.load(path))
+
+    rng = np.random.default_rng(1)
+    latencies = []
+    for _ in range(args.queries):
+        # A mix of common and rare terms, like a user question
+        query = " ".join(words[np.minimum(rng.zipf(1.2, size=8), args.vocabulary) - 1])
+        _, seconds = timed(lambda: index.search(query, args.top_k))
+        latencies.append(seconds * 1000)
+    latencies.sort()
+
+    print(f"📚 {len(index)} chunks, {len(index.vocabulary)} terms, {len(index.doc_ids)} postings, "
+          f"{size / 2**20:.1f} MiB on disk")
+    print(f"⏱️ build {build:.1f}s, save {save:.2f}s, load {load:.2f}s")
+    print(f"📊 query p50 {statistics.median(latencies):.2f} ms, "
+          f"p95 {latencies[int(len(latencies) * 0.95) - 1]:.2f} ms, max {latencies[-1]:.2f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
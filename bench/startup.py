@@ -0,0 +1,77 @@
+"""
+Cold start benchmark of the app.
+
+Measures, over several runs, how long `import app.main` takes and how long a fresh
+uvicorn process takes to serve its first request, and fails when the median goes over
+the budget.
+
+    DATABASE_URL=postgresql://... python -m bench.startup --runs 5 --budget-ms 3000
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+IMPORT_SCRIPT = "import time; t = time.perf_counter(); import app.main; print(time.perf_counter() - t)"
+
+TIMEOUT = 60
+
+
+def import_seconds(env):
+    out = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT], env=env, check=True, capture_output=True, text=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def ready_seconds(env, port, workers):
+    started = time.perf_counter()
+    process = subprocess.Popen([
+        sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port),
+        "--workers", str(workers), "--log-level", "warning",
+    ], env=env)
+    try:
+        while time.perf_counter() - started < TIMEOUT:
+            if process.poll() is not None:
+                raise RuntimeError(f"app exited with code {process.returncode}")
+            try:
+                if httpx.get(f"http://127.0.0.1:{port}/metrics", timeout=1).status_code == 200:
+                    return time.perf_counter() - started
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.02)
+        raise RuntimeError(f"app did not start within {TIMEOUT}s")
+    finally:
+        process.terminate()
+        process.wait(timeout=15)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the app's cold start.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("STARTUP_BUDGET_MS", "3000")),
+                        help="Largest acceptable median time to the first served request")
+    args = parser.parse_args()
+
+    # The Groq key isn't needed to start; clients are built on first use
+    env = {**os.environ, "GROQ_API_KEY": os.getenv("GROQ_API_KEY", "bench"), "LOG_LEVEL": "WARNING"}
+    imports = [import_seconds(env) for _ in range(args.runs)]
+    ready = [ready_seconds(env, args.port, args.workers) for _ in range(args.runs)]
+
+    import_ms = statistics.median(imports) * 1000
+    ready_ms = statistics.median(ready) * 1000
+    print(f"📊 import app.main: median {import_ms:.0f} ms, max {max(imports) * 1000:.0f} ms")
+    print(f"📊 first request ({args.workers} worker(s)): median {ready_ms:.0f} ms, max {max(ready) * 1000:.0f} ms")
+    if ready_ms > args.budget_ms:
+        print(f"❌ Cold start over budget: {ready_ms:.0f} ms > {args.budget_ms:.0f} ms")
+        return 1
+    print(f"✅ Cold start within {args.budget_ms:.0f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,17 @@
+import logging
 import time
 from sqlalchemy.exc import OperationalError
 from sqlalchemy import create_engine, text
 import os
 
 from .database import Base, engine
+from .migrations import migrate
+from .models import utcnow
+from .partitions import ensure_partitions
+
+logger = logging.getLogger("noxus.db")
+
+DB_STARTUP_TIMEOUT = float(os.getenv("DB_STARTUP_TIMEOUT", "30"))
 
 # Create the test database
 def create_test_db():
@@ -19,20 +27,34 @@ def create_test_db():
         result = conn.execute(text("SELECT 1 FROM pg_database WHERE datname='noxus_test'"))
         if not result.fetchone():
             conn.execute(text("CREATE DATABASE noxus_test"))
-            print("🆕 Created test database: noxus_test")
+            logger.info("🆕 Created test database: noxus_test")
 
-# Create the main database and tables
-def init_db():
-    create_test_db()
+def create_schema():
+    # Postgres is versioned through migrations; other databases (SQLite in unit tests)
+    # are created straight from the models
+    if engine.dialect.name == "postgresql":
+        migrate(engine)
+        ensure_partitions(engine, utcnow())
+    else:
+        Base.metadata.create_all(bind=engine)
 
-    for attempt in range(5):
+
+# Create the main database and bring its schema up to date.
+# Retries with backoff while the database is starting, up to DB_STARTUP_TIMEOUT seconds.
+def init_db(timeout=DB_STARTUP_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    delay = 0.1
+    attempt = 0
+    while True:
+        attempt += 1
         try:
-            Base.metadata.create_all(bind=engine)
-            print("✅ Database connected and tables created.")
-            break
-        except OperationalError as e:
-            print(f"⏳ Waiting for database... attempt {attempt + 1}")
-            time.sleep(2)
-    else:
-        raise RuntimeError("❌ Could not connect to the database after multiple attempts.")
-    
+            create_test_db()
+            create_schema()
+            logger.info("✅ Database connected and schema up to date.")
+            return
+        except OperationalError:
+            if time.monotonic() + delay > deadline:
+                raise RuntimeError("❌ Could not connect to the database after multiple attempts.")
+            logger.warning("⏳ Waiting for database... attempt %d", attempt)
+            time.sleep(delay)
+            delay = min(delay * 2, 2.0)
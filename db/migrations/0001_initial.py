@@ -0,0 +1,57 @@
+"""
+Baseline schema, as previously created by `Base.metadata.create_all`.
+
+Uses IF NOT EXISTS so databases created before migrations existed are adopted as-is.
+"""
+from sqlalchemy import text
+
+STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS prompt_profiles (
+        id UUID PRIMARY KEY,
+        system_prompt TEXT,
+        created_at TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS conversations (
+        id UUID PRIMARY KEY,
+        started_at TIMESTAMP,
+        prompt_profile_id UUID REFERENCES prompt_profiles (id),
+        config VARCHAR
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS messages (
+        id UUID PRIMARY KEY,
+        conversation_id UUID REFERENCES conversations (id),
+        role VARCHAR,
+        content TEXT,
+        "timestamp" TIMESTAMP,
+        thumbs_up BOOLEAN,
+        thumbs_down BOOLEAN,
+        feedback_text TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS knowledge_sources (
+        id UUID PRIMARY KEY,
+        conversation_id UUID REFERENCES conversations (id),
+        content TEXT,
+        added_at TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS conversation_summaries (
+        conversation_id UUID PRIMARY KEY REFERENCES conversations (id),
+        content TEXT,
+        message_count INTEGER,
+        updated_at TIMESTAMP
+    )
+    """,
+]
+
+
+def upgrade(conn):
+    for statement in STATEMENTS:
+        conn.execute(text(statement))
@@ -0,0 +1,29 @@
+"""
+Order messages by a per-conversation sequence and index the hot queries.
+
+Existing messages are numbered by timestamp. Rows written before timestamps were
+evaluated per insert share one value per process, so ties fall back to the id.
+"""
+from sqlalchemy import text
+
+STATEMENTS = [
+    "ALTER TABLE messages ADD COLUMN IF NOT EXISTS seq INTEGER",
+    """
+    UPDATE messages
+    SET seq = ordered.seq
+    FROM (
+        SELECT id, row_number() OVER (PARTITION BY conversation_id ORDER BY "timestamp", id) AS seq
+        FROM messages
+    ) AS ordered
+    WHERE messages.id = ordered.id AND messages.seq IS NULL
+    """,
+    "ALTER TABLE messages ALTER COLUMN seq SET NOT NULL",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_messages_conversation_id_seq ON messages (conversation_id, seq)",
+    "CREATE INDEX IF NOT EXISTS ix_knowledge_sources_conversation_id ON knowledge_sources (conversation_id)",
+    "CREATE INDEX IF NOT EXISTS ix_conversations_started_at ON conversations (started_at, id)",
+]
+
+
+def upgrade(conn):
+    for statement in STATEMENTS:
+        conn.execute(text(statement))
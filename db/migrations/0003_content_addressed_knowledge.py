@@ -0,0 +1,124 @@
+"""
+Store prompt profiles and knowledge sources once, keyed by the sha256 of their content.
+
+Duplicate prompt profiles are merged. Per-conversation knowledge source rows become
+shared sources, grouped into one knowledge set per distinct ordered list.
+"""
+from sqlalchemy import text
+
+
+def sha256_hex(expr):
+    # Same digest as db.models.content_hash
+    return f"encode(sha256(convert_to({expr}, 'UTF8')), 'hex')"
+
+
+STATEMENTS = [
+    # Prompt profiles: hash, point conversations at one copy of each prompt, drop the rest
+    "ALTER TABLE prompt_profiles ADD COLUMN content_hash VARCHAR(64)",
+    "UPDATE prompt_profiles SET content_hash = " + sha256_hex("coalesce(system_prompt, '')"),
+    """
+    CREATE TEMPORARY TABLE canonical_prompts ON COMMIT DROP AS
+    SELECT p.id, c.id AS canonical_id
+    FROM prompt_profiles p
+    JOIN (
+        SELECT DISTINCT ON (content_hash) content_hash, id
+        FROM prompt_profiles
+        ORDER BY content_hash, created_at, id
+    ) c ON c.content_hash = p.content_hash
+    WHERE p.id <> c.id
+    """,
+    """
+    UPDATE conversations
+    SET prompt_profile_id = canonical_prompts.canonical_id
+    FROM canonical_prompts
+    WHERE conversations.prompt_profile_id = canonical_prompts.id
+    """,
+    "DELETE FROM prompt_profiles WHERE id IN (SELECT id FROM canonical_prompts)",
+    "ALTER TABLE prompt_profiles ALTER COLUMN content_hash SET NOT NULL",
+    "CREATE UNIQUE INDEX ix_prompt_profiles_content_hash ON prompt_profiles (content_hash)",
+
+    # Knowledge: shared sources, ordered sets of them, and one set per conversation
+    "ALTER TABLE knowledge_sources RENAME TO legacy_knowledge_sources",
+    "DROP INDEX IF EXISTS ix_knowledge_sources_conversation_id",
+    """
+    CREATE TABLE knowledge_sources (
+        id UUID PRIMARY KEY,
+        content_hash VARCHAR(64) NOT NULL,
+        content TEXT NOT NULL,
+        added_at TIMESTAMP WITHOUT TIME ZONE
+    )
+    """,
+    "CREATE UNIQUE INDEX ix_knowledge_sources_content_hash ON knowledge_sources (content_hash)",
+    """
+    CREATE TABLE knowledge_sets (
+        id UUID PRIMARY KEY,
+        content_hash VARCHAR(64) NOT NULL,
+        created_at TIMESTAMP WITHOUT TIME ZONE
+    )
+    """,
+    "CREATE UNIQUE INDEX ix_knowledge_sets_content_hash ON knowledge_sets (content_hash)",
+    """
+    CREATE TABLE knowledge_set_items (
+        knowledge_set_id UUID NOT NULL REFERENCES knowledge_sets (id),
+        position INTEGER NOT NULL,
+        knowledge_source_id UUID NOT NULL REFERENCES knowledge_sources (id),
+        PRIMARY KEY (knowledge_set_id, position)
+    )
+    """,
+    "ALTER TABLE conversations ADD COLUMN knowledge_set_id UUID REFERENCES knowledge_sets (id)",
+
+    f"""
+    CREATE TEMPORARY TABLE legacy_items ON COMMIT DROP AS
+    SELECT
+        conversation_id,
+        {sha256_hex("coalesce(content, '')")} AS content_hash,
+        coalesce(content, '') AS content,
+        added_at,
+        row_number() OVER (PARTITION BY conversation_id ORDER BY added_at, id) - 1 AS position
+    FROM legacy_knowledge_sources
+    WHERE conversation_id IS NOT NULL
+    """,
+    """
+    INSERT INTO knowledge_sources (id, content_hash, content, added_at)
+    SELECT gen_random_uuid(), content_hash, min(content), min(added_at)
+    FROM legacy_items
+    GROUP BY content_hash
+    """,
+    f"""
+    CREATE TEMPORARY TABLE legacy_sets ON COMMIT DROP AS
+    SELECT
+        conversation_id,
+        {sha256_hex("string_agg(content_hash, chr(10) ORDER BY position)")} AS content_hash,
+        min(added_at) AS created_at
+    FROM legacy_items
+    GROUP BY conversation_id
+    """,
+    """
+    INSERT INTO knowledge_sets (id, content_hash, created_at)
+    SELECT gen_random_uuid(), content_hash, min(created_at)
+    FROM legacy_sets
+    GROUP BY content_hash
+    """,
+    """
+    INSERT INTO knowledge_set_items (knowledge_set_id, position, knowledge_source_id)
+    SELECT DISTINCT ON (ks.id, i.position) ks.id, i.position, src.id
+    FROM legacy_sets s
+    JOIN knowledge_sets ks ON ks.content_hash = s.content_hash
+    JOIN legacy_items i ON i.conversation_id = s.conversation_id
+    JOIN knowledge_sources src ON src.content_hash = i.content_hash
+    ORDER BY ks.id, i.position
+    """,
+    """
+    UPDATE conversations
+    SET knowledge_set_id = ks.id
+    FROM legacy_sets s
+    JOIN knowledge_sets ks ON ks.content_hash = s.content_hash
+    WHERE conversations.id = s.conversation_id
+    """,
+    "DROP TABLE legacy_knowledge_sources",
+]
+
+
+def upgrade(conn):
+    for statement in STATEMENTS:
+        conn.execute(text(statement))
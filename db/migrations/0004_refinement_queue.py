@@ -0,0 +1,37 @@
+"""
+Queue feedback-driven prompt refinements instead of running them in the request.
+"""
+from sqlalchemy import text
+
+STATEMENTS = [
+    """
+    CREATE TABLE refinement_feedback (
+        id SERIAL PRIMARY KEY,
+        message_id UUID NOT NULL REFERENCES messages (id),
+        conversation_id UUID NOT NULL REFERENCES conversations (id),
+        thumbs_up BOOLEAN,
+        thumbs_down BOOLEAN,
+        feedback_text TEXT,
+        created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL
+    )
+    """,
+    "CREATE INDEX ix_refinement_feedback_conversation_id ON refinement_feedback (conversation_id)",
+    """
+    CREATE TABLE refinement_jobs (
+        prompt_profile_id UUID PRIMARY KEY REFERENCES prompt_profiles (id),
+        enqueued_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+        run_after TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+        run_before TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+        feedback_count INTEGER NOT NULL,
+        attempts INTEGER NOT NULL,
+        locked_until TIMESTAMP WITHOUT TIME ZONE,
+        last_error TEXT
+    )
+    """,
+    "CREATE INDEX ix_refinement_jobs_run_after ON refinement_jobs (run_after)",
+]
+
+
+def upgrade(conn):
+    for statement in STATEMENTS:
+        conn.execute(text(statement))
@@ -0,0 +1,24 @@
+"""
+Persist conversation evaluations, keyed by the last message each one scored.
+"""
+from sqlalchemy import text
+
+STATEMENTS = [
+    """
+    CREATE TABLE evaluations (
+        conversation_id UUID NOT NULL REFERENCES conversations (id),
+        message_seq INTEGER NOT NULL,
+        config VARCHAR,
+        score INTEGER,
+        comment TEXT,
+        model VARCHAR NOT NULL,
+        evaluated_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+        PRIMARY KEY (conversation_id, message_seq)
+    )
+    """,
+]
+
+
+def upgrade(conn):
+    for statement in STATEMENTS:
+        conn.execute(text(statement))
@@ -0,0 +1,19 @@
+"""
+Token buckets for the Groq rate limiter, shared by every worker.
+"""
+from sqlalchemy import text
+
+STATEMENTS = [
+    """
+    CREATE TABLE rate_limit_buckets (
+        key VARCHAR PRIMARY KEY,
+        tokens DOUBLE PRECISION NOT NULL,
+        updated_at TIMESTAMP WITH TIME ZONE NOT NULL
+    )
+    """,
+]
+
+
+def upgrade(conn):
+    for statement in STATEMENTS:
+        conn.execute(text(statement))
@@ -0,0 +1,23 @@
+"""
+Persistent tier of the completion cache.
+"""
+from sqlalchemy import text
+
+STATEMENTS = [
+    """
+    CREATE TABLE completion_cache (
+        key VARCHAR(64) PRIMARY KEY,
+        variant VARCHAR,
+        reply TEXT NOT NULL,
+        latency_ms INTEGER NOT NULL,
+        created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+        expires_at TIMESTAMP WITHOUT TIME ZONE NOT NULL
+    )
+    """,
+    "CREATE INDEX ix_completion_cache_expires_at ON completion_cache (expires_at)",
+]
+
+
+def upgrade(conn):
+    for statement in STATEMENTS:
+        conn.execute(text(statement))
@@ -0,0 +1,13 @@
+"""
+Model that produced each assistant message, which may be a fallback of its variant.
+"""
+from sqlalchemy import text
+
+STATEMENTS = [
+    "ALTER TABLE messages ADD COLUMN model VARCHAR",
+]
+
+
+def upgrade(conn):
+    for statement in STATEMENTS:
+        conn.execute(text(statement))
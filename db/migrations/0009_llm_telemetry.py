@@ -0,0 +1,34 @@
+"""
+Token usage and latency of assistant messages, and of the Groq calls made outside of
+chat turns.
+"""
+from sqlalchemy import text
+
+STATEMENTS = [
+    "ALTER TABLE messages ADD COLUMN prompt_tokens INTEGER",
+    "ALTER TABLE messages ADD COLUMN completion_tokens INTEGER",
+    "ALTER TABLE messages ADD COLUMN ttft_ms INTEGER",
+    "ALTER TABLE messages ADD COLUMN latency_ms INTEGER",
+    """
+    CREATE INDEX ix_messages_assistant_timestamp ON messages (timestamp)
+    INCLUDE (conversation_id, latency_ms, ttft_ms, prompt_tokens, completion_tokens)
+    WHERE role = 'assistant'
+    """,
+    """
+    CREATE TABLE llm_calls (
+        id SERIAL PRIMARY KEY,
+        created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+        purpose VARCHAR NOT NULL,
+        model VARCHAR NOT NULL,
+        prompt_tokens INTEGER,
+        completion_tokens INTEGER,
+        latency_ms INTEGER NOT NULL
+    )
+    """,
+    "CREATE INDEX ix_llm_calls_purpose_created_at ON llm_calls (purpose, created_at)",
+]
+
+
+def upgrade(conn):
+    for statement in STATEMENTS:
+        conn.execute(text(statement))
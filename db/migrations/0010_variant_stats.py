@@ -0,0 +1,57 @@
+"""
+Per-variant A/B counters, maintained by the writes they count, backfilled from the
+existing conversations, messages and evaluations.
+"""
+from sqlalchemy import text
+
+STATEMENTS = [
+    """
+    CREATE TABLE variant_stats (
+        variant VARCHAR NOT NULL,
+        shard INTEGER NOT NULL,
+        conversations INTEGER NOT NULL DEFAULT 0,
+        turns INTEGER NOT NULL DEFAULT 0,
+        thumbs_up INTEGER NOT NULL DEFAULT 0,
+        thumbs_down INTEGER NOT NULL DEFAULT 0,
+        commented INTEGER NOT NULL DEFAULT 0,
+        evaluations INTEGER NOT NULL DEFAULT 0,
+        score_sum INTEGER NOT NULL DEFAULT 0,
+        score_sq_sum INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (variant, shard)
+    )
+    """,
+    """
+    INSERT INTO variant_stats (
+        variant, shard, conversations, turns, thumbs_up, thumbs_down, commented,
+        evaluations, score_sum, score_sq_sum
+    )
+    SELECT variant, 0, SUM(conversations), SUM(turns), SUM(thumbs_up), SUM(thumbs_down), SUM(commented),
+           SUM(evaluations), SUM(score_sum), SUM(score_sq_sum)
+    FROM (
+        SELECT COALESCE(config, '') AS variant, 1 AS conversations, 0 AS turns, 0 AS thumbs_up,
+               0 AS thumbs_down, 0 AS commented, 0 AS evaluations, 0 AS score_sum, 0 AS score_sq_sum
+        FROM conversations
+        UNION ALL
+        SELECT COALESCE(c.config, ''), 0,
+               CASE WHEN m.role = 'assistant' THEN 1 ELSE 0 END,
+               CASE WHEN m.thumbs_up THEN 1 ELSE 0 END,
+               CASE WHEN m.thumbs_down THEN 1 ELSE 0 END,
+               CASE WHEN m.feedback_text <> '' THEN 1 ELSE 0 END,
+               0, 0, 0
+        FROM messages m JOIN conversations c ON c.id = m.conversation_id
+        UNION ALL
+        SELECT COALESCE(e.config, ''), 0, 0, 0, 0, 0, 1, e.score, e.score * e.score
+        FROM evaluations e
+        JOIN (
+            SELECT conversation_id, MAX(message_seq) AS message_seq FROM evaluations GROUP BY conversation_id
+        ) latest ON latest.conversation_id = e.conversation_id AND latest.message_seq = e.message_seq
+        WHERE e.score IS NOT NULL
+    ) counts
+    GROUP BY variant
+    """,
+]
+
+
+def upgrade(conn):
+    for statement in STATEMENTS:
+        conn.execute(text(statement))
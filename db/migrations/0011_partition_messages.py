@@ -0,0 +1,98 @@
+"""
+Range partition messages by the month their conversation started, and add the catalog
+of archived conversations.
+
+Keys of a partitioned table must include the partition column, so the primary key
+becomes (id, conversation_started_at) and the foreign keys that pointed at messages.id
+(refinement feedback) or would block archival (evaluations) are dropped.
+"""
+from datetime import datetime
+
+from sqlalchemy import text
+
+from db.partitions import MONTHS_AHEAD, add_months, create_default_partition, create_partition, month_start
+
+COLUMNS = (
+    "id, conversation_id, seq, role, content, model, prompt_tokens, completion_tokens, ttft_ms, latency_ms, "
+    "timestamp, thumbs_up, thumbs_down, feedback_text"
+)
+
+BEFORE = [
+    "ALTER TABLE refinement_feedback DROP CONSTRAINT IF EXISTS refinement_feedback_message_id_fkey",
+    "ALTER TABLE evaluations DROP CONSTRAINT IF EXISTS evaluations_conversation_id_fkey",
+    "ALTER TABLE messages RENAME TO messages_unpartitioned",
+    "ALTER INDEX messages_pkey RENAME TO messages_unpartitioned_pkey",
+    "ALTER INDEX ix_messages_conversation_id_seq RENAME TO ix_messages_unpartitioned_conversation_id_seq",
+    "ALTER INDEX ix_messages_assistant_timestamp RENAME TO ix_messages_unpartitioned_assistant_timestamp",
+    """
+    CREATE TABLE messages (
+        id UUID NOT NULL,
+        conversation_id UUID REFERENCES conversations (id),
+        conversation_started_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+        seq INTEGER NOT NULL,
+        role VARCHAR,
+        content TEXT,
+        model VARCHAR,
+        prompt_tokens INTEGER,
+        completion_tokens INTEGER,
+        ttft_ms INTEGER,
+        latency_ms INTEGER,
+        timestamp TIMESTAMP WITHOUT TIME ZONE,
+        thumbs_up BOOLEAN,
+        thumbs_down BOOLEAN,
+        feedback_text TEXT,
+        PRIMARY KEY (id, conversation_started_at)
+    ) PARTITION BY RANGE (conversation_started_at)
+    """,
+    "CREATE UNIQUE INDEX ix_messages_conversation_id_seq ON messages (conversation_id, seq, conversation_started_at)",
+    """
+    CREATE INDEX ix_messages_assistant_timestamp ON messages (timestamp)
+    INCLUDE (conversation_id, latency_ms, ttft_ms, prompt_tokens, completion_tokens)
+    WHERE role = 'assistant'
+    """,
+]
+
+AFTER = [
+    f"""
+    INSERT INTO messages ({COLUMNS}, conversation_started_at)
+    SELECT {", ".join(f"m.{column}" for column in COLUMNS.split(", "))},
+           COALESCE(c.started_at, TIMESTAMP '1970-01-01')
+    FROM messages_unpartitioned m LEFT JOIN conversations c ON c.id = m.conversation_id
+    """,
+    "DROP TABLE messages_unpartitioned",
+    """
+    CREATE TABLE archived_conversations (
+        id UUID PRIMARY KEY,
+        started_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+        config VARCHAR,
+        has_feedback BOOLEAN NOT NULL,
+        message_count INTEGER NOT NULL,
+        turns INTEGER NOT NULL,
+        thumbs_up INTEGER NOT NULL,
+        thumbs_down INTEGER NOT NULL,
+        commented INTEGER NOT NULL,
+        segment VARCHAR NOT NULL,
+        "offset" BIGINT NOT NULL,
+        length INTEGER NOT NULL,
+        archived_at TIMESTAMP WITHOUT TIME ZONE NOT NULL
+    )
+    """,
+    "CREATE INDEX ix_archived_conversations_started_at ON archived_conversations (started_at, id)",
+]
+
+
+def upgrade(conn):
+    for statement in BEFORE:
+        conn.execute(text(statement))
+
+    create_default_partition(conn)
+    months = set(conn.execute(text(
+        "SELECT DISTINCT date_trunc('month', started_at) FROM conversations WHERE started_at IS NOT NULL"
+    )).scalars())
+    current = month_start(datetime.utcnow())
+    months.update(add_months(current, i) for i in range(MONTHS_AHEAD + 1))
+    for month in sorted(months):
+        create_partition(conn, month)
+
+    for statement in AFTER:
+        conn.execute(text(statement))
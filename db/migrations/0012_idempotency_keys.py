@@ -0,0 +1,26 @@
+"""
+Idempotency keys of /chat requests, with the replies they are replayed from.
+"""
+from sqlalchemy import text
+
+STATEMENTS = [
+    """
+    CREATE TABLE idempotency_keys (
+        key VARCHAR(255) PRIMARY KEY,
+        fingerprint VARCHAR(64) NOT NULL,
+        status VARCHAR NOT NULL,
+        conversation_id UUID,
+        message_id UUID,
+        reply TEXT,
+        complete BOOLEAN,
+        created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+        expires_at TIMESTAMP WITHOUT TIME ZONE NOT NULL
+    )
+    """,
+    "CREATE INDEX ix_idempotency_keys_expires_at ON idempotency_keys (expires_at)",
+]
+
+
+def upgrade(conn):
+    for statement in STATEMENTS:
+        conn.execute(text(statement))
@@ -0,0 +1,81 @@
+"""
+Versioned schema migrations for Postgres.
+
+Each module in this package named `NNNN_description.py` defines `upgrade(conn)` and is
+applied once, in order, inside its own transaction. Applied versions are recorded in
+the `schema_migrations` table.
+"""
+import importlib
+import logging
+import pkgutil
+
+from sqlalchemy import text
+
+logger = logging.getLogger("noxus.db.migrations")
+
+MIGRATIONS_TABLE = "schema_migrations"
+
+# Advisory lock held while migrating; any constant unique to this app will do
+MIGRATION_LOCK_KEY = 0x6E6F7875
+
+
+def discover():
+    names = sorted(
+        module.name for module in pkgutil.iter_modules(__path__)
+        if module.name[:4].isdigit()
+    )
+    return [(name, importlib.import_module(f"{__name__}.{name}")) for name in names]
+
+
+def applied_versions(conn):
+    if conn.execute(text("SELECT to_regclass(:table)"), {"table": MIGRATIONS_TABLE}).scalar() is None:
+        return set()
+    return set(conn.execute(text(f"SELECT version FROM {MIGRATIONS_TABLE}")).scalars())
+
+
+def create_migrations_table(conn):
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {MIGRATIONS_TABLE} (
+            version VARCHAR PRIMARY KEY,
+            applied_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc')
+        )
+    """))
+
+
+def pending_migrations(conn):
+    applied = applied_versions(conn)
+    return [(version, module) for version, module in discover() if version not in applied]
+
+
+def migrate(engine):
+    """
+    Apply every pending migration. Returns the versions that were applied.
+
+    Workers starting together serialize on an advisory lock: the first applies the
+    migrations, the others wait for it and then find nothing left to do. An up-to-date
+    schema is detected with one query and no lock.
+    """
+    with engine.connect() as conn:
+        if not pending_migrations(conn):
+            return []
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as lock:
+        lock.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        try:
+            with engine.begin() as conn:
+                create_migrations_table(conn)
+                # Another worker may have applied some while we waited for the lock
+                pending = pending_migrations(conn)
+
+            for version, module in pending:
+                with engine.begin() as conn:
+                    module.upgrade(conn)
+                    conn.execute(
+                        text(f"INSERT INTO {MIGRATIONS_TABLE} (version) VALUES (:version)"),
+                        {"version": version},
+                    )
+                logger.info("🛠️ Applied migration %s", version)
+        finally:
+            lock.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY})
+
+    return [version for version, _ in pending]
@@ -1,50 +1,333 @@
+import hashlib
 import uuid
 from datetime import datetime, timezone
 
-from sqlalchemy import Boolean, Column, DateTime, ForeignKey, String, Text
+from sqlalchemy import (
+    BigInteger, Boolean, Column, DateTime, Float, ForeignKey, Index, Integer, String, Table, Text, event, func,
+    select, text,
+)
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 
 from .database import Base
 
 
+# Partition key of messages whose conversation has no start time
+EPOCH = datetime(1970, 1, 1)
+
+
+def utcnow():
+    # Naive UTC to match the TIMESTAMP WITHOUT TIME ZONE columns (asyncpg rejects aware values)
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
 class Conversation(Base):
     __tablename__ = "conversations"
+    __table_args__ = (
+        # Keyset pagination of /talks-data, newest first
+        Index("ix_conversations_started_at", "started_at", "id"),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    started_at = Column(DateTime, default=datetime.now(timezone.utc))
-    messages = relationship("Message", back_populates="conversation")
+    started_at = Column(DateTime, default=utcnow)
+    messages = relationship("Message", back_populates="conversation", order_by="Message.seq")
     prompt_profile_id = Column(UUID(as_uuid=True), ForeignKey("prompt_profiles.id"), nullable=True)
     prompt_profile = relationship("PromptProfile")
-    knowledge_sources = relationship("KnowledgeSource", back_populates="conversation")
+    knowledge_set_id = Column(UUID(as_uuid=True), ForeignKey("knowledge_sets.id"), nullable=True)
+    knowledge_sources = relationship(
+        "KnowledgeSource",
+        secondary="knowledge_set_items",
+        primaryjoin="Conversation.knowledge_set_id == knowledge_set_items.c.knowledge_set_id",
+        secondaryjoin="KnowledgeSource.id == knowledge_set_items.c.knowledge_source_id",
+        order_by="knowledge_set_items.c.position",
+        viewonly=True,
+    )
+    summary = relationship("ConversationSummary", uselist=False)
     config = Column(String, nullable=True)
 
 class Message(Base):
+    """
+    On Postgres, messages are range partitioned by the month their conversation started
+    (see db/partitions.py), so a conversation lives in one partition and old months can
+    be archived and dropped whole. Keys include the partition column, as Postgres
+    requires; a conversation has one start time, so they are as unique as without it.
+    """
     __tablename__ = "messages"
+    __table_args__ = (
+        # History of a conversation in order, and the uniqueness of each position
+        Index("ix_messages_conversation_id_seq", "conversation_id", "seq", "conversation_started_at", unique=True),
+        # Telemetry of recent replies, read without touching the table
+        Index(
+            "ix_messages_assistant_timestamp", "timestamp",
+            postgresql_include=["conversation_id", "latency_ms", "ttft_ms", "prompt_tokens", "completion_tokens"],
+            postgresql_where=text("role = 'assistant'"),
+            sqlite_where=text("role = 'assistant'"),
+        ),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     conversation_id = Column(UUID(as_uuid=True), ForeignKey("conversations.id"))
+    # Partition key: its conversation's started_at
+    conversation_started_at = Column(DateTime, primary_key=True)
+    # Position of the message in its conversation, starting at 1
+    seq = Column(Integer, nullable=False)
     role = Column(String)  # 'user' or 'assistant'
     content = Column(Text)
-    timestamp = Column(DateTime, default=datetime.now(timezone.utc))
+    # Model that wrote an assistant message: the variant's, or one of its fallbacks
+    model = Column(String, nullable=True)
+    # Usage and latency of the call that wrote an assistant message; latency runs from
+    # the start of the Groq call, and is null like the tokens for a cached reply
+    prompt_tokens = Column(Integer, nullable=True)
+    completion_tokens = Column(Integer, nullable=True)
+    ttft_ms = Column(Integer, nullable=True)
+    latency_ms = Column(Integer, nullable=True)
+    timestamp = Column(DateTime, default=utcnow)
     thumbs_up = Column(Boolean, nullable=True)
     thumbs_down = Column(Boolean, nullable=True)
     feedback_text = Column(Text, nullable=True)
     conversation = relationship("Conversation", back_populates="messages")
 
+    # Identified by id alone; the partition key only completes the table's key
+    __mapper_args__ = {"primary_key": [id]}
+
+
+def next_seq(conversation_id):
+    """The next position in a conversation, evaluated inside the INSERT itself."""
+    return (
+        select(func.coalesce(func.max(Message.seq), 0) + 1)
+        .where(Message.conversation_id == conversation_id)
+        .scalar_subquery()
+    )
+
+
+def conversation_started_at(conversation_id):
+    """The partition key of a conversation's messages, evaluated inside the INSERT."""
+    started_at = select(Conversation.started_at).where(Conversation.id == conversation_id).scalar_subquery()
+    return func.coalesce(started_at, EPOCH)
+
+
+@event.listens_for(Message, "before_insert")
+def assign_seq(mapper, connection, target):
+    if target.seq is None:
+        target.seq = next_seq(target.conversation_id)
+    if target.conversation_started_at is None:
+        target.conversation_started_at = conversation_started_at(target.conversation_id)
+
+
 class PromptProfile(Base):
+    """A system prompt, stored once and shared by every conversation that uses it."""
     __tablename__ = "prompt_profiles"
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    # sha256 of system_prompt; rows are never edited, a refined prompt is a new row
+    content_hash = Column(String(64), nullable=False, unique=True, index=True)
     system_prompt = Column(Text)
-    created_at = Column(DateTime, default=datetime.now(timezone.utc))
+    created_at = Column(DateTime, default=utcnow)
 
 class KnowledgeSource(Base):
+    """A knowledge source, stored once however many conversations use it."""
     __tablename__ = "knowledge_sources"
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    conversation_id = Column(UUID(as_uuid=True), ForeignKey("conversations.id"))
-    content = Column(Text)
-    added_at = Column(DateTime, default=datetime.now(timezone.utc))
+    content_hash = Column(String(64), nullable=False, unique=True, index=True)
+    content = Column(Text, nullable=False)
+    added_at = Column(DateTime, default=utcnow)
+
+
+class KnowledgeSet(Base):
+    """An ordered list of knowledge sources, keyed by the hashes of its members."""
+    __tablename__ = "knowledge_sets"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    content_hash = Column(String(64), nullable=False, unique=True, index=True)
+    created_at = Column(DateTime, default=utcnow)
+
+
+knowledge_set_items = Table(
+    "knowledge_set_items",
+    Base.metadata,
+    Column("knowledge_set_id", UUID(as_uuid=True), ForeignKey("knowledge_sets.id"), primary_key=True),
+    Column("position", Integer, primary_key=True),
+    Column("knowledge_source_id", UUID(as_uuid=True), ForeignKey("knowledge_sources.id"), nullable=False),
+)
+
+
+def knowledge_set_hash(source_hashes):
+    return content_hash("\n".join(source_hashes))
+
+
+class ConversationSummary(Base):
+    __tablename__ = "conversation_summaries"
+
+    conversation_id = Column(UUID(as_uuid=True), ForeignKey("conversations.id"), primary_key=True)
+    content = Column(Text, default="")
+    # Number of messages, in conversation order, already folded into the summary
+    message_count = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=utcnow, onupdate=utcnow)
+
+
+class RefinementFeedback(Base):
+    """Feedback on a message that hasn't been folded into a prompt refinement yet."""
+    __tablename__ = "refinement_feedback"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    # No foreign key: the key of partitioned messages also has conversation_started_at
+    message_id = Column(UUID(as_uuid=True), nullable=False)
+    conversation_id = Column(UUID(as_uuid=True), ForeignKey("conversations.id"), nullable=False, index=True)
+    thumbs_up = Column(Boolean, nullable=True)
+    thumbs_down = Column(Boolean, nullable=True)
+    feedback_text = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=utcnow, nullable=False)
+
+
+class RefinementJob(Base):
+    """
+    A pending refinement of one prompt profile.
+
+    Feedback on any conversation using the profile lands on the same row, so a burst of
+    feedback becomes a single refinement once it settles.
+    """
+    __tablename__ = "refinement_jobs"
+
+    prompt_profile_id = Column(UUID(as_uuid=True), ForeignKey("prompt_profiles.id"), primary_key=True)
+    enqueued_at = Column(DateTime, default=utcnow, nullable=False)
+    # Pushed back by each new feedback event, but never past run_before
+    run_after = Column(DateTime, nullable=False, index=True)
+    run_before = Column(DateTime, nullable=False)
+    feedback_count = Column(Integer, default=1, nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    # Set while a worker holds the job; an expired lease means the worker died
+    locked_until = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+
+
+class Evaluation(Base):
+    """An LLM score for a conversation, as of its message with seq `message_seq`."""
+    __tablename__ = "evaluations"
+
+    # No foreign key: evaluations outlive the archival of their conversation
+    conversation_id = Column(UUID(as_uuid=True), primary_key=True)
+    # Watermark: the conversation only needs scoring again once it has a later message
+    message_seq = Column(Integer, primary_key=True)
+    config = Column(String, nullable=True)
+    score = Column(Integer, nullable=True)
+    comment = Column(Text, nullable=True)
+    model = Column(String, nullable=False)
+    evaluated_at = Column(DateTime, default=utcnow, nullable=False)
+
+
+class ArchivedConversation(Base):
+    """
+    Catalog entry of a conversation moved out of the hot tables by the archival job.
+
+    The conversation itself, with its messages, is one gzip member of an archive
+    segment file, at `offset` and `length` bytes (see app/archive.py). The per-variant
+    counts keep the A/B recount exact after archival.
+    """
+    __tablename__ = "archived_conversations"
+    __table_args__ = (
+        # Keyset pagination of /talks-data past the hot conversations
+        Index("ix_archived_conversations_started_at", "started_at", "id"),
+    )
+
+    id = Column(UUID(as_uuid=True), primary_key=True)
+    started_at = Column(DateTime, nullable=False)
+    config = Column(String, nullable=True)
+    has_feedback = Column(Boolean, nullable=False)
+    message_count = Column(Integer, nullable=False)
+    turns = Column(Integer, nullable=False)
+    thumbs_up = Column(Integer, nullable=False)
+    thumbs_down = Column(Integer, nullable=False)
+    commented = Column(Integer, nullable=False)
+    segment = Column(String, nullable=False)
+    offset = Column(BigInteger, nullable=False)
+    length = Column(Integer, nullable=False)
+    archived_at = Column(DateTime, default=utcnow, nullable=False)
+
+
+class VariantStats(Base):
+    """
+    A/B counters of a variant, kept up to date by the writes they count.
+
+    Each variant has several shard rows, so concurrent turns don't queue on one row
+    lock; readers sum the shards.
+    """
+    __tablename__ = "variant_stats"
+
+    # Conversation config; empty for conversations without one
+    variant = Column(String, primary_key=True)
+    shard = Column(Integer, primary_key=True)
+    conversations = Column(Integer, nullable=False, default=0)
+    # Assistant messages
+    turns = Column(Integer, nullable=False, default=0)
+    thumbs_up = Column(Integer, nullable=False, default=0)
+    thumbs_down = Column(Integer, nullable=False, default=0)
+    commented = Column(Integer, nullable=False, default=0)
+    # Over the latest scored evaluation of each conversation
+    evaluations = Column(Integer, nullable=False, default=0)
+    score_sum = Column(Integer, nullable=False, default=0)
+    score_sq_sum = Column(Integer, nullable=False, default=0)
+
+
+class LLMCall(Base):
+    """Token usage and latency of a Groq call made outside of a chat turn."""
+    __tablename__ = "llm_calls"
+    __table_args__ = (
+        Index("ix_llm_calls_purpose_created_at", "purpose", "created_at"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    created_at = Column(DateTime, default=utcnow, nullable=False)
+    # summary, refinement, evaluation or prompt_refinement
+    purpose = Column(String, nullable=False)
+    model = Column(String, nullable=False)
+    prompt_tokens = Column(Integer, nullable=True)
+    completion_tokens = Column(Integer, nullable=True)
+    latency_ms = Column(Integer, nullable=False)
+
+
+class RateLimitBucket(Base):
+    """Groq budget shared by all workers when GROQ_RATE_LIMIT_BACKEND=postgres."""
+    __tablename__ = "rate_limit_buckets"
+
+    # "<model>:requests" or "<model>:tokens"
+    key = Column(String, primary_key=True)
+    tokens = Column(Float, nullable=False)
+    updated_at = Column(DateTime(timezone=True), nullable=False)
+
+
+class CompletionCacheEntry(Base):
+    """Persistent tier of the completion cache, shared by every worker."""
+    __tablename__ = "completion_cache"
+
+    # sha256 of the model, sampling parameters and normalized messages
+    key = Column(String(64), primary_key=True)
+    variant = Column(String, nullable=True)
+    reply = Column(Text, nullable=False)
+    # How long the reply took to generate, i.e. what a hit saves
+    latency_ms = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=utcnow, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
+class IdempotencyKey(Base):
+    """A /chat request sent with an Idempotency-Key, and its reply once it has one."""
+    __tablename__ = "idempotency_keys"
 
-    conversation = relationship("Conversation", back_populates="knowledge_sources")
+    key = Column(String(255), primary_key=True)
+    # sha256 of the request, so a key can't be reused for a different one
+    fingerprint = Column(String(64), nullable=False)
+    # pending while the turn runs, then done
+    status = Column(String, nullable=False)
+    conversation_id = Column(UUID(as_uuid=True), nullable=True)
+    message_id = Column(UUID(as_uuid=True), nullable=True)
+    reply = Column(Text, nullable=True)
+    # False when the reply was cut short, e.g. by a failed stream
+    complete = Column(Boolean, nullable=True)
+    created_at = Column(DateTime, default=utcnow, nullable=False)
+    # A pending key past this belongs to a worker that died mid-turn; a done one is forgotten
+    expires_at = Column(DateTime, nullable=False, index=True)
@@ -0,0 +1,138 @@
+"""
+Monthly range partitions of `messages` on Postgres.
+
+Messages are partitioned by `conversation_started_at`, the start of their conversation,
+so each conversation lives in one partition and a month whose conversations were all
+archived can be dropped whole. Partitions are created a few months ahead at startup and
+by the archival job; `messages_default` catches anything outside them.
+"""
+import logging
+from datetime import datetime
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from .migrations import MIGRATION_LOCK_KEY
+
+logger = logging.getLogger("noxus.db.partitions")
+
+DEFAULT_PARTITION = "messages_default"
+
+# Months created ahead of the current one
+MONTHS_AHEAD = 2
+
+
+def month_start(value):
+    return datetime(value.year, value.month, 1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"messages_{month:%Y_%m}"
+
+
+def partition_month(name):
+    try:
+        return datetime.strptime(name, "messages_%Y_%m")
+    except ValueError:
+        return None
+
+
+def exists(conn, name):
+    return conn.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar() is not None
+
+
+def name_indexes(conn, partition, suffix):
+    """Name a partition's indexes after the parent's, so query plans show which one is used."""
+    rows = conn.execute(text("""
+        SELECT child.relname, parent.relname
+        FROM pg_index x
+        JOIN pg_class child ON child.oid = x.indexrelid
+        JOIN pg_inherits i ON i.inhrelid = child.oid
+        JOIN pg_class parent ON parent.oid = i.inhparent
+        WHERE x.indrelid = to_regclass(:partition)
+    """), {"partition": partition}).all()
+    for child, parent in rows:
+        conn.execute(text(f'ALTER INDEX "{child}" RENAME TO "{parent}_{suffix}"'))
+
+
+def create_default_partition(conn):
+    conn.execute(text(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF messages DEFAULT"))
+    name_indexes(conn, DEFAULT_PARTITION, "default")
+
+
+def create_partition(conn, month):
+    """Create the partition of `month` if it is missing. Returns whether it was created."""
+    name = partition_name(month)
+    if exists(conn, name):
+        return False
+    bounds = {"low": month, "high": add_months(month, 1)}
+    in_range = "conversation_started_at >= :low AND conversation_started_at < :high"
+    # Rows of the month already in the default partition would break the new bound
+    stray = conn.execute(text(f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} WHERE {in_range})"), bounds).scalar()
+    if stray:
+        conn.execute(text(f"ALTER TABLE messages DETACH PARTITION {DEFAULT_PARTITION}"))
+    conn.execute(text(
+        f"CREATE TABLE {name} PARTITION OF messages "
+        f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{bounds['high']:%Y-%m-%d}')"
+    ))
+    name_indexes(conn, name, f"{month:%Y_%m}")
+    if stray:
+        conn.execute(text(f"INSERT INTO messages SELECT * FROM {DEFAULT_PARTITION} WHERE {in_range}"), bounds)
+        conn.execute(text(f"DELETE FROM {DEFAULT_PARTITION} WHERE {in_range}"), bounds)
+        conn.execute(text(f"ALTER TABLE messages ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT"))
+    return True
+
+
+def ensure_partitions(engine, now, months_ahead=MONTHS_AHEAD):
+    """Create the partitions of `now`'s month and the next `months_ahead`. Returns their names."""
+    if engine.dialect.name != "postgresql":
+        return []
+    first = month_start(now)
+    months = [add_months(first, i) for i in range(months_ahead + 1)]
+    with engine.connect() as conn:
+        if all(exists(conn, partition_name(month)) for month in months):
+            return []
+    with engine.begin() as conn:
+        # Workers starting together would race on the same CREATE TABLE
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        created = [partition_name(month) for month in months if create_partition(conn, month)]
+    for name in created:
+        logger.info("🗓️ Created partition %s", name)
+    return created
+
+
+def drop_empty_partitions(engine, before):
+    """
+    Drop the monthly partitions that end by `before` and hold no rows, e.g. once the
+    archival job has moved all of their conversations. Returns their names.
+    """
+    if engine.dialect.name != "postgresql":
+        return []
+    with engine.connect() as conn:
+        names = conn.execute(text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass('messages')"
+        )).scalars().all()
+    dropped = []
+    for name in sorted(names):
+        month = partition_month(name)
+        if month is None or add_months(month, 1) > before:
+            continue
+        try:
+            with engine.begin() as conn:
+                # Dropping locks the parent table; don't queue chat turns behind it for long
+                conn.execute(text("SET LOCAL lock_timeout = '2s'"))
+                if conn.execute(text(f"SELECT EXISTS (SELECT 1 FROM {name})")).scalar():
+                    continue
+                conn.execute(text(f"DROP TABLE {name}"))
+        except OperationalError as e:
+            logger.warning("⚠️ Could not drop partition %s: %s", name, e)
+            continue
+        dropped.append(name)
+        logger.info("🗑️ Dropped empty partition %s", name)
+    return dropped
@@ -4,6 +4,13 @@ const sendButton = document.getElementById("send");
 const feedbackTrigger = document.getElementById("feedback-trigger");
 
 let conversationId = null;
+
+// Keeps this browser on the same model variant across new conversations
+let clientId = localStorage.getItem("clientId");
+if (!clientId) {
+  clientId = crypto.randomUUID();
+  localStorage.setItem("clientId", clientId);
+}
 let lastBotMessageId = null;
 let currentThumb = null;
 
@@ -15,22 +22,53 @@ sendButton.onclick = async () => {
   chatBox.scrollTop = chatBox.scrollHeight;
   messageInput.value = "";
 
-  const response = await fetch("/chat", {
-    method: "POST",
-    headers: { "Content-Type": "application/json" },
-    body: JSON.stringify({ message, conversation_id: conversationId, max_length: 500, temperature: 0.7 })
-  });
-
-  const data = await response.json();
-  const reply = data.reply || "(No reply)";
-  if (data.conversation_id) conversationId = data.conversation_id;
-  if (data.message_id) lastBotMessageId = data.message_id;
-
   const botDiv = document.createElement("div");
   botDiv.className = "assistant";
-  botDiv.innerHTML = `<strong>Bot:</strong> ${reply}`;
+  botDiv.innerHTML = "<strong>Bot:</strong> ";
+  const replySpan = document.createElement("span");
+  botDiv.appendChild(replySpan);
   chatBox.appendChild(botDiv);
 
+  // One key per message: a retry of it is answered with the same reply, never a second one
+  const request = {
+    method: "POST",
+    headers: { "Content-Type": "application/json", "Idempotency-Key": crypto.randomUUID() },
+    body: JSON.stringify({ message, conversation_id: conversationId, client_id: clientId, stream: true, max_length: 500, temperature: 0.7 })
+  };
+  let response;
+  try {
+    response = await fetch("/chat", request);
+  } catch (e) {
+    // The request may have reached the server; the key makes sending it again safe
+    response = await fetch("/chat", request).catch(() => null);
+  }
+
+  if (!response || !response.ok || !response.body) {
+    const data = response ? await response.json().catch(() => ({})) : {};
+    replySpan.textContent = data.detail || "(No reply)";
+    return;
+  }
+
+  // Render tokens as they arrive from the Server-Sent Events stream
+  let pendingMessageId = null;
+  await readEventStream(response, (event, data) => {
+    if (event === "start") {
+      conversationId = data.conversation_id;
+      pendingMessageId = data.message_id;
+    } else if (event === "token") {
+      replySpan.textContent += data.content;
+      chatBox.scrollTop = chatBox.scrollHeight;
+    } else if (event === "done") {
+      lastBotMessageId = data.message_id;
+      if (data.ttft_ms !== null) console.log(`Time to first token: ${data.ttft_ms} ms`);
+    } else if (event === "error") {
+      // A partial reply is still saved by the server and can receive feedback
+      if (replySpan.textContent) lastBotMessageId = pendingMessageId;
+      replySpan.textContent += ` (${data.detail})`;
+    }
+  });
+  if (!replySpan.textContent) replySpan.textContent = "(No reply)";
+
   feedbackTrigger.style.display = "inline-block";
   feedbackTrigger.onclick = () => {
     feedbackTrigger.style.display = "none";
@@ -40,6 +78,32 @@ sendButton.onclick = async () => {
   chatBox.scrollTop = chatBox.scrollHeight;
 };
 
+async function readEventStream(response, onEvent) {
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let boundary;
+    while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+      const raw = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+
+      let event = "message";
+      let data = "";
+      raw.split("\n").forEach(line => {
+        if (line.startsWith("event: ")) event = line.slice(7);
+        else if (line.startsWith("data: ")) data += line.slice(6);
+      });
+      if (data) onEvent(event, JSON.parse(data));
+    }
+  }
+}
+
 function showFeedbackForm(messageId) {
   const feedbackDiv = document.createElement("div");
   feedbackDiv.className = "feedback";
@@ -1,37 +1,68 @@
+const container = document.getElementById('content');
+const loadMoreButton = document.getElementById('load-more');
+
+// Filters (config, since, until, has_feedback) are taken from the page URL
+const filters = new URLSearchParams(window.location.search);
+let nextCursor = null;
+let loading = false;
+
+function renderConversation(convo) {
+  const convoDiv = document.createElement('div');
+  convoDiv.className = 'conversation';
+  convoDiv.innerHTML = `<h2>Conversation ID: ${convo.conversation_id}</h2> <h2> Model: ${convo.config}</h2> `;
+
+  convo.messages.forEach(msg => {
+    const msgDiv = document.createElement('div');
+    msgDiv.className = `message ${msg.role}`;
+    msgDiv.innerHTML = `<strong>${msg.role}:</strong> ${msg.content} <small>(${msg.timestamp})</small>`;
+
+    if (msg.thumbs_up || msg.thumbs_down || msg.feedback_text) {
+      const feedback = document.createElement('div');
+      feedback.className = 'feedback';
+      let feedbackStr = 'Feedback: ';
+      if (msg.thumbs_up) feedbackStr += '👍 ';
+      if (msg.thumbs_down) feedbackStr += '👎 ';
+      if (msg.feedback_text) feedbackStr += `"${msg.feedback_text}"`;
+      feedback.textContent = feedbackStr;
+      msgDiv.appendChild(feedback);
+    }
+
+    convoDiv.appendChild(msgDiv);
+  });
+
+  container.appendChild(convoDiv);
+}
+
+// Fetch the next page and append it, keeping the conversations already shown
 async function loadConversations() {
-    const response = await fetch('/talks-data');
-    const conversations = await response.json();
-    const container = document.getElementById('content');
-    container.innerHTML = '';
-  
-    conversations.forEach(convo => {
-      const convoDiv = document.createElement('div');
-      convoDiv.className = 'conversation';
-      convoDiv.innerHTML = `<h2>Conversation ID: ${convo.conversation_id}</h2> <h2> Model: ${convo.config}</h2> `;
-  
-      convo.messages.forEach(msg => {
-        const msgDiv = document.createElement('div');
-        msgDiv.className = `message ${msg.role}`;
-        msgDiv.innerHTML = `<strong>${msg.role}:</strong> ${msg.content} <small>(${msg.timestamp})</small>`;
-        console.log(msg);
-  
-        if (msg.thumbs_up || msg.thumbs_down || msg.feedback_text) {
-          const feedback = document.createElement('div');
-          feedback.className = 'feedback';
-          let feedbackStr = 'Feedback: ';
-          if (msg.thumbs_up) feedbackStr += '👍 ';
-          if (msg.thumbs_down) feedbackStr += '👎 ';
-          if (msg.feedback_text) feedbackStr += `"${msg.feedback_text}"`;
-          feedback.textContent = feedbackStr;
-          msgDiv.appendChild(feedback);
-        }
-  
-        convoDiv.appendChild(msgDiv);
-      });
-  
-      container.appendChild(convoDiv);
-    });
+  if (loading) return;
+  loading = true;
+  loadMoreButton.disabled = true;
+
+  const params = new URLSearchParams(filters);
+  if (nextCursor) params.set('cursor', nextCursor);
+
+  try {
+    const response = await fetch(`/talks-data?${params}`);
+    const page = await response.json();
+    if (!nextCursor) container.innerHTML = '';
+
+    page.conversations.forEach(renderConversation);
+    if (!nextCursor && page.conversations.length === 0) container.textContent = 'No conversations yet.';
+
+    nextCursor = page.next_cursor;
+    loadMoreButton.style.display = nextCursor ? 'inline-block' : 'none';
+  } finally {
+    loading = false;
+    loadMoreButton.disabled = false;
   }
-  
-  loadConversations();
-  
\ No newline at end of file
+}
+
+loadMoreButton.onclick = loadConversations;
+
+// Load the next page automatically when the button scrolls into view
+new IntersectionObserver(entries => {
+  if (entries.some(entry => entry.isIntersecting) && nextCursor) loadConversations();
+}).observe(loadMoreButton);
+
+loadConversations();
@@ -0,0 +1,96 @@
+# tests/conftest.py
+
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from db.database import SessionLocal, async_engine
+from db.models import Conversation, Message
+
+
+@pytest.fixture(scope="module")
+def running_app(request):
+    """
+    Keep the module's `client` open for all of its tests, so pooled async DB connections
+    stay on one event loop. The in-app refinement worker is off, so tests decide when
+    jobs run and no worker calls their mocked Groq client. Modules opt in with:
+
+        pytestmark = pytest.mark.usefixtures("running_app")
+    """
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv("REFINEMENT_WORKER", "0")
+        with request.module.client:
+            yield
+
+
+@pytest.fixture
+def seeded_config():
+    """
+    Five conversations of a fresh variant, one a day from 2024-01-01, each a question
+    and an answer. Only the answer of conversation 3 has feedback, a thumbs up.
+    """
+    # A unique variant name isolates these rows from other tests sharing the database
+    config = f"T-{uuid.uuid4().hex[:8]}"
+    start = datetime(2024, 1, 1)
+    with SessionLocal() as db:
+        for i in range(5):
+            convo = Conversation(config=config, started_at=start + timedelta(days=i))
+            db.add(convo)
+            db.flush()
+            db.add(Message(conversation_id=convo.id, role="user", content=f"question {i}",
+                           timestamp=start + timedelta(days=i, minutes=1)))
+            db.add(Message(conversation_id=convo.id, role="assistant", content=f"answer {i}",
+                           timestamp=start + timedelta(days=i, minutes=2),
+                           thumbs_up=True if i == 3 else None))
+        db.commit()
+    return config
+
+
+class QueryCounter:
+    def __init__(self):
+        self.statements = []
+        self.transactions = 0
+
+    def on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def on_begin(self, conn):
+        self.transactions += 1
+
+
+@pytest.fixture
+def query_budget():
+    """
+    Fail a block that makes the app run more SQL than its budget allows.
+
+        with query_budget(statements=2, transactions=1):
+            client.post("/chat", json={"message": "Hi"})
+
+    Counts what goes through the async engine used by the routers. An executemany
+    counts as one statement, since it is one round trip.
+    """
+    @contextmanager
+    def budget(statements, transactions=None):
+        counter = QueryCounter()
+        engine = async_engine.sync_engine
+        event.listen(engine, "before_cursor_execute", counter.on_execute)
+        event.listen(engine, "begin", counter.on_begin)
+        try:
+            yield counter
+        finally:
+            event.remove(engine, "before_cursor_execute", counter.on_execute)
+            event.remove(engine, "begin", counter.on_begin)
+
+        listing = "\n".join(counter.statements)
+        assert len(counter.statements) <= statements, (
+            f"{len(counter.statements)} statements, budget is {statements}:\n{listing}"
+        )
+        if transactions is not None:
+            assert counter.transactions <= transactions, (
+                f"{counter.transactions} transactions, budget is {transactions}:\n{listing}"
+            )
+
+    return budget
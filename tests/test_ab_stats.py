@@ -0,0 +1,140 @@
+# tests/test_ab_stats.py
+
+import uuid
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.ab_stats import mean_interval, wilson_interval
+from app.main import app
+from app.message_writer import MessageWriter
+from app.scripts.evaluate import run_evaluations
+from app.variant_stats import rebuild, recount_query, totals_query
+from db.database import AsyncSessionLocal, SessionLocal
+from db.models import Conversation, Message
+
+client = TestClient(app)
+
+
+pytestmark = pytest.mark.usefixtures("running_app")
+
+
+def completion(text):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))], usage=None)
+
+
+def scored(score):
+    return AsyncMock(return_value=completion(f'{{"score": {score}, "comment": "ok"}}'))
+
+
+def variant_counts(variant):
+    stats = client.get("/ab-stats").json()["variants"]
+    return next((row for row in stats if row["variant"] == variant), None)
+
+
+def seed(config, turns=1):
+    with SessionLocal() as db:
+        convo = Conversation(config=config)
+        db.add(convo)
+        db.flush()
+        for i in range(turns):
+            db.add(Message(conversation_id=convo.id, role="user", content=f"question {i}"))
+            db.add(Message(conversation_id=convo.id, role="assistant", content=f"answer {i}"))
+        db.commit()
+        return convo.id
+
+
+async def recount():
+    async with AsyncSessionLocal() as db:
+        await rebuild(db)
+        await db.commit()
+
+
+async def compare():
+    async with AsyncSessionLocal() as db:
+        return (await db.execute(totals_query())).all(), (await db.execute(recount_query())).all()
+
+
+def turn(user, reply):
+    return [(uuid.uuid4(), "user", user), (uuid.uuid4(), "assistant", reply)]
+
+
+# Test the confidence intervals against known values and their edge cases
+def test_intervals():
+    assert wilson_interval(0, 0, 1.96) is None
+    low, high = wilson_interval(8, 10, 1.96)
+    assert round(low, 3) == 0.490 and round(high, 3) == 0.943
+    assert wilson_interval(0, 5, 1.96)[0] == 0.0
+
+    assert mean_interval(7, 49, 1, 1.96) is None
+    low, high = mean_interval(6 + 8, 36 + 64, 2, 1.96)
+    assert low < 7 < high
+    assert round(high - 7, 2) == round(1.96 * 2 ** 0.5 / 2 ** 0.5, 2)
+
+
+# Test that turns and feedback changes move the counters, with /ab-stats reading them
+def test_turns_and_feedback_are_counted():
+    before = variant_counts("A") or {"conversations": 0, "turns": 0, "thumbs_up": 0, "thumbs_down": 0}
+    with patch("app.chat.client.chat.completions.create", new=AsyncMock(return_value=completion("Hi!"))):
+        first = client.post("/chat", json={"message": f"Hello {uuid.uuid4()}"}).json()
+        client.post("/chat", json={"message": f"More {uuid.uuid4()}", "conversation_id": first["conversation_id"]})
+
+    client.patch("/feedback", json={"message_id": first["message_id"], "thumbs_up": True})
+    client.patch("/feedback", json={"message_id": first["message_id"], "thumbs_up": False, "thumbs_down": True})
+
+    after = variant_counts("A")
+    assert after["conversations"] - before["conversations"] == 1
+    assert after["turns"] - before["turns"] == 2
+    assert after["thumbs_up"] == before["thumbs_up"]
+    assert after["thumbs_down"] - before["thumbs_down"] == 1
+    assert after["thumbs_up_rate"]["interval"] is not None
+
+
+# Test that a newer evaluation of a conversation replaces its older score
+def test_newer_evaluation_replaces_older():
+    config = f"AB-{uuid.uuid4().hex[:8]}"
+    convo_id = seed(config)
+    with patch("app.scripts.evaluate.client.chat.completions.create", new=scored(7)):
+        client.portal.call(run_evaluations, 2, config)
+    assert variant_counts(config)["mean_score"]["value"] == 7
+
+    with SessionLocal() as db:
+        db.add(Message(conversation_id=convo_id, role="user", content="one more thing"))
+        db.commit()
+    with patch("app.scripts.evaluate.client.chat.completions.create", new=scored(3)):
+        client.portal.call(run_evaluations, 2, config)
+
+    counts = variant_counts(config)
+    assert counts["evaluations"] == 1
+    assert counts["mean_score"]["value"] == 3
+
+
+# Test that maintained counters match a full recount, write-behind turns and replays included
+def test_counters_match_recount():
+    config = f"AB-{uuid.uuid4().hex[:8]}"
+    seed(config, turns=2)
+    client.portal.call(recount)
+
+    conversation = Conversation(id=uuid.uuid4(), config=config)
+    messages = turn("hello", "hi")
+
+    async def write_behind():
+        writer = MessageWriter(enabled=True)
+        await writer.add_turn(conversation.id, messages, conversation)
+        await writer.flush()
+        # A journal replay of the same turn inserts nothing, so counts nothing
+        replay = MessageWriter(enabled=True)
+        await replay.add_turn(conversation.id, messages, conversation)
+        await replay.flush()
+
+    client.portal.call(write_behind)
+    client.patch("/feedback", json={"message_id": str(messages[1][0]), "feedback_text": "Too short"})
+    with patch("app.scripts.evaluate.client.chat.completions.create", new=scored(5)):
+        client.portal.call(run_evaluations, 2, config)
+
+    totals, recounted = client.portal.call(compare)
+    assert [tuple(row) for row in totals] == [tuple(row) for row in recounted]
+    counts = variant_counts(config)
+    assert (counts["conversations"], counts["turns"], counts["commented"], counts["evaluations"]) == (2, 3, 1, 2)
@@ -0,0 +1,147 @@
+# tests/test_archive.py
+
+import gzip
+import json
+import uuid
+from datetime import datetime
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import delete, select
+
+from app.archive import ArchiveReader, SegmentWriter, archive_reader, run_archival
+from app.main import app
+from app.scripts.evaluate import run_evaluations
+from app.variant_stats import rebuild, recount_query, totals_query
+from db.database import AsyncSessionLocal, SessionLocal, engine
+from db.models import ArchivedConversation, Conversation, ConversationSummary, Evaluation, Message
+from db.partitions import create_partition, drop_empty_partitions, exists, partition_name
+
+client = TestClient(app)
+
+# Old enough for any retention the tests use, and a month nothing else writes to
+OLD_MONTH = datetime(2001, 3, 1)
+
+
+pytestmark = pytest.mark.usefixtures("running_app")
+
+
+@pytest.fixture
+def archive_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(archive_reader, "directory", str(tmp_path))
+    yield tmp_path
+    # The segments go away with tmp_path, so must the catalog entries pointing into them
+    with SessionLocal() as db:
+        db.execute(delete(ArchivedConversation).where(
+            ArchivedConversation.segment.in_([path.name for path in tmp_path.iterdir()])
+        ))
+        db.commit()
+
+
+def seed_old(config):
+    if engine.dialect.name == "postgresql":
+        with engine.begin() as conn:
+            create_partition(conn, OLD_MONTH)
+    with SessionLocal() as db:
+        convo = Conversation(config=config, started_at=OLD_MONTH.replace(day=15))
+        db.add(convo)
+        db.flush()
+        db.add(Message(conversation_id=convo.id, role="user", content="What is a partition?"))
+        db.add(Message(
+            conversation_id=convo.id, role="assistant", content="A slice of a table.",
+            thumbs_up=True, feedback_text="Clear",
+        ))
+        db.add(ConversationSummary(conversation_id=convo.id, content="Partitions", message_count=2))
+        db.commit()
+        return convo.id
+
+
+async def recount():
+    async with AsyncSessionLocal() as db:
+        await rebuild(db)
+        await db.commit()
+
+
+async def compare(config):
+    async with AsyncSessionLocal() as db:
+        totals = [tuple(row) for row in (await db.execute(totals_query())).all() if row.variant == config]
+        recounted = [tuple(row) for row in (await db.execute(recount_query())).all() if row.variant == config]
+        return totals, recounted
+
+
+# Test that each record of a segment reads back by offset, and the segment is plain gzipped JSONL
+def test_segment_round_trip(tmp_path):
+    records = [{"conversation_id": str(uuid.uuid4()), "messages": [{"content": "x" * i}]} for i in range(5)]
+    writer = SegmentWriter(tmp_path)
+    positions = [writer.add(record) for record in records]
+    writer.commit()
+
+    assert [p.name for p in tmp_path.iterdir()] == [writer.name]
+    reader = ArchiveReader(tmp_path, max_open=1)
+    assert [reader.read(writer.name, *position) for position in reversed(positions)] == records[::-1]
+    reader.close()
+
+    with gzip.open(tmp_path / writer.name, "rt") as f:
+        assert [json.loads(line) for line in f] == records
+
+
+# Test that an aborted segment leaves nothing behind
+def test_segment_abort(tmp_path):
+    writer = SegmentWriter(tmp_path)
+    writer.add({"conversation_id": "1"})
+    writer.abort()
+    assert list(tmp_path.iterdir()) == []
+
+
+# Test that archival moves old conversations out of the hot tables, and that /talks-data,
+# the evaluator and the A/B counters still see them
+def test_archival_keeps_conversations_readable(archive_dir):
+    config = f"ARCH-{uuid.uuid4().hex[:8]}"
+    convo_id = seed_old(config)
+    client.portal.call(recount)
+
+    result = client.portal.call(run_archival, AsyncSessionLocal, 365, 1, str(archive_dir))
+    assert result["archived"] >= 1
+
+    with SessionLocal() as db:
+        assert db.get(Conversation, convo_id) is None
+        assert db.scalar(select(Message.id).where(Message.conversation_id == convo_id)) is None
+        assert db.get(ConversationSummary, convo_id) is None
+        entry = db.get(ArchivedConversation, convo_id)
+    assert (entry.message_count, entry.turns, entry.thumbs_up, entry.commented) == (2, 1, 1, 1)
+    assert entry.has_feedback
+
+    data = client.get("/talks-data", params={"config": config}).json()
+    [convo] = data["conversations"]
+    assert convo["archived"] is True
+    assert [msg["content"] for msg in convo["messages"]] == ["What is a partition?", "A slice of a table."]
+    assert convo["messages"][1]["feedback_text"] == "Clear"
+
+    assert client.get("/talks-data", params={"config": config, "has_feedback": False}).json()["conversations"] == []
+    lines = client.get("/talks-data/stream", params={"config": config}).text.splitlines()
+    assert [json.loads(line)["conversation_id"] for line in lines] == [str(convo_id)]
+
+    reply = SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content='{"score": 8, "comment": "ok"}'))])
+    with patch("app.scripts.evaluate.client.chat.completions.create", new=AsyncMock(return_value=reply)):
+        client.portal.call(run_evaluations, 2, config, None, True)
+    with SessionLocal() as db:
+        evaluation = db.scalar(select(Evaluation).where(Evaluation.conversation_id == convo_id))
+    assert (evaluation.message_seq, evaluation.score) == (2, 8)
+
+    totals, recounted = client.portal.call(compare, config)
+    assert totals == recounted
+    assert totals[0][1:] == (1, 1, 1, 0, 1, 1, 8, 64)
+
+
+# Test that partitions emptied by archival are dropped, and the current ones never are
+@pytest.mark.skipif(engine.dialect.name != "postgresql", reason="partitions need Postgres")
+def test_empty_partitions_dropped(archive_dir):
+    seed_old(f"ARCH-{uuid.uuid4().hex[:8]}")
+    client.portal.call(run_archival, AsyncSessionLocal, 365, 200, str(archive_dir))
+
+    with engine.connect() as conn:
+        assert not exists(conn, partition_name(OLD_MONTH))
+        assert exists(conn, partition_name(datetime.utcnow()))
+    assert drop_empty_partitions(engine, datetime(2001, 1, 1)) == []
@@ -0,0 +1,56 @@
+# tests/test_bench.py
+
+import json
+
+from fastapi.testclient import TestClient
+
+from bench.fake_groq import FakeGroqSettings, create_app
+from bench.load import compare, percentile
+
+FAST = dict(latency_ms=0, latency_jitter=0, tokens_per_second=0, reply_tokens=5)
+MESSAGES = [{"role": "user", "content": "Hello there!"}]
+
+
+# Test that the stand-in answers a plain completion with usage
+def test_fake_groq_completion():
+    fake = TestClient(create_app(FakeGroqSettings(**FAST)))
+    response = fake.post("/openai/v1/chat/completions", json={"model": "m", "messages": MESSAGES})
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["choices"][0]["message"]["content"].split() == [f"word{i}" for i in range(5)]
+    assert body["usage"]["completion_tokens"] == 5
+
+
+# Test that streams end with usage under x_groq and [DONE]
+def test_fake_groq_stream():
+    fake = TestClient(create_app(FakeGroqSettings(**FAST)))
+    response = fake.post("/openai/v1/chat/completions", json={"model": "m", "messages": MESSAGES, "stream": True})
+
+    events = [line[6:] for line in response.text.splitlines() if line.startswith("data: ")]
+    assert events[-1] == "[DONE]"
+    last = json.loads(events[-2])
+    assert last["choices"][0]["finish_reason"] == "stop"
+    assert last["x_groq"]["usage"]["completion_tokens"] == 5
+
+
+# Test that injected 429s carry Retry-After
+def test_fake_groq_error_injection():
+    fake = TestClient(create_app(FakeGroqSettings(**FAST, error_rate=1.0, error_statuses=(429,), retry_after=2)))
+    response = fake.post("/openai/v1/chat/completions", json={"model": "m", "messages": MESSAGES})
+
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "2"
+
+
+# Test nearest-rank percentiles and regression detection against a baseline
+def test_percentiles_and_compare():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([], 50) is None
+
+    baseline = {"chat": {"rps": 100, "p95_ms": 100, "p99_ms": 200}}
+    assert compare({"chat": {"rps": 90, "p95_ms": 110, "p99_ms": 210}}, baseline, 0.2) == []
+    regressions = compare({"chat": {"rps": 70, "p95_ms": 130, "p99_ms": 210}}, baseline, 0.2)
+    assert len(regressions) == 2
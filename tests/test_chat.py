@@ -1,11 +1,22 @@
 # tests/test_chat.py
 
+import json
+import uuid
+
+import pytest
+from types import SimpleNamespace
+
 from fastapi.testclient import TestClient
 from app.main import app
 from unittest.mock import patch
+from db.database import SessionLocal
+from db.models import Message
 
 client = TestClient(app)
 
+
+pytestmark = pytest.mark.usefixtures("running_app")
+
 # Test the chat endpoint with a basic request
 def test_chat_endpoint_basic():
     response = client.post("/chat", json={"message": "Hello!", "max_length": 50, "temperature": 0.7})
@@ -49,4 +60,81 @@ def test_groq_api_failure():
     with patch("app.chat.client.chat.completions.create") as mock_groq:
         mock_groq.side_effect = Exception("Simulated Groq failure")
         response = client.post("/chat", json={"message": "trigger failure"})
-        assert response.status_code == 502
\ No newline at end of file
+        assert response.status_code == 502
+
+class FakeStream:
+    def __init__(self, parts):
+        self.parts = parts
+
+    async def __aiter__(self):
+        for part in self.parts:
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=part))])
+
+    async def close(self):
+        pass
+
+
+def sse_events(body):
+    parsed = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        parsed.append((lines["event"], json.loads(lines["data"])))
+    return parsed
+
+
+# Test streaming a reply as Server-Sent Events
+def test_chat_streaming():
+    with patch("app.chat.client.chat.completions.create", return_value=FakeStream(["Hel", "lo ", "there"])):
+        response = client.post("/chat", json={"message": "Hello!", "stream": True})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+
+    events = sse_events(response.text)
+    assert [event for event, _ in events] == ["start", "token", "token", "token", "done"]
+    assert [data["content"] for event, data in events if event == "token"] == ["Hel", "lo ", "there"]
+    start, done = events[0][1], events[-1][1]
+    assert done["message_id"] == start["message_id"]
+    assert done["conversation_id"] == start["conversation_id"]
+
+    db = SessionLocal()
+    try:
+        saved = db.query(Message).filter_by(id=uuid.UUID(start["message_id"])).first()
+        assert saved is not None
+        assert saved.role == "assistant"
+        assert saved.content == "Hello there"
+    finally:
+        db.close()
+
+
+class FailingStream:
+    def __init__(self):
+        self.closed = False
+
+    async def __aiter__(self):
+        chunk = SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content="Partial"))])
+        yield chunk
+        raise Exception("Simulated stream failure")
+
+    async def close(self):
+        self.closed = True
+
+
+# Test that a provider failure mid-stream still saves the partial reply
+def test_chat_streaming_failure_saves_partial_reply():
+    stream = FailingStream()
+    with patch("app.chat.client.chat.completions.create", return_value=stream):
+        response = client.post("/chat", json={"message": "trigger stream failure", "stream": True})
+
+    assert response.status_code == 200
+    assert "event: error" in response.text
+    assert stream.closed
+
+    start = response.text.split("event: start\ndata: ", 1)[1].split("\n", 1)[0]
+    message_id = uuid.UUID(json.loads(start)["message_id"])
+    db = SessionLocal()
+    try:
+        saved = db.query(Message).filter_by(id=message_id).first()
+        assert saved is not None
+        assert saved.content == "Partial"
+    finally:
+        db.close()
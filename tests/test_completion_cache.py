@@ -0,0 +1,113 @@
+# tests/test_completion_cache.py
+
+import asyncio
+import uuid
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.completion_cache import CompletionCache, completion_key
+from app.main import app
+from app.variants import ModelVariant
+from db.database import async_engine, engine
+
+client = TestClient(app)
+
+
+pytestmark = pytest.mark.usefixtures("running_app")
+
+
+def make_variant(**overrides):
+    fields = {
+        "model": "llama3-8b-8192",
+        "temperature": 0.2,
+        "max_tokens": 300,
+        "system_prompt": "Be brief.",
+        "completion_cache": True,
+    }
+    fields.update(overrides)
+    return ModelVariant(**fields)
+
+
+MESSAGES = [{"role": "system", "content": "Be brief."}, {"role": "user", "content": "Hello!"}]
+
+
+# Test that the key ignores spacing but not sampling parameters
+def test_key_normalizes_history():
+    variant = make_variant()
+    spaced = [{"role": "system", "content": " Be   brief. "}, {"role": "user", "content": "Hello!\n"}]
+
+    assert completion_key(variant, MESSAGES) == completion_key(variant, spaced)
+    assert completion_key(variant, MESSAGES) != completion_key(make_variant(temperature=0.1), MESSAGES)
+
+
+# Test that only opted-in variants at or below their temperature threshold are eligible
+def test_eligibility():
+    assert CompletionCache.eligible(make_variant())
+    assert not CompletionCache.eligible(make_variant(completion_cache=False))
+    assert not CompletionCache.eligible(make_variant(temperature=0.7))
+    assert CompletionCache.eligible(make_variant(temperature=0.7, completion_cache_max_temperature=0.7))
+
+
+# Test hits, misses, saved latency, TTL expiry and LRU eviction
+def test_lru_ttl_and_stats():
+    async def run():
+        cache = CompletionCache(max_entries=2)
+        await cache.put("a", "A", "reply a", 0.8)
+        assert await cache.get("a", "A") == "reply a"
+        assert await cache.get("missing", "A") is None
+
+        await cache.put("b", "A", "reply b", 0.1)
+        await cache.put("c", "A", "reply c", 0.1)
+        assert await cache.get("a", "A") is None
+
+        expiring = CompletionCache(ttl=0)
+        await expiring.put("a", "A", "reply a", 0.1)
+        assert await expiring.get("a", "A") is None
+        return cache.stats()
+
+    stats = asyncio.run(run())
+    assert stats["entries"] == 2
+    assert stats["evictions"] == 1
+    assert stats["variants"]["A"]["hits"] == 1
+    assert stats["variants"]["A"]["misses"] == 2
+    assert stats["variants"]["A"]["saved_ms"] == 800
+
+
+# Test that a second identical opening message is answered from the cache
+def test_chat_reuses_cached_reply():
+    message = f"Hello {uuid.uuid4()}!"
+    completion = SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="Hi!"))])
+    with patch("app.chat.completion_cache.eligible", return_value=True), \
+         patch("app.chat.client.chat.completions.create", new=AsyncMock(return_value=completion)) as mock_groq:
+        first = client.post("/chat", json={"message": message})
+        second = client.post("/chat", json={"message": message})
+        streamed = client.post("/chat", json={"message": message, "stream": True})
+
+    assert first.json()["reply"] == second.json()["reply"] == "Hi!"
+    assert first.json()["conversation_id"] != second.json()["conversation_id"]
+    assert 'data: {"content": "Hi!"}' in streamed.text
+    assert mock_groq.call_count == 1
+
+
+# Test that replies in the Postgres tier are found by a cache with an empty memory tier
+@pytest.mark.skipif(engine.dialect.name != "postgresql", reason="persistent tier needs Postgres")
+def test_persistent_tier():
+    key = uuid.uuid4().hex
+
+    async def put():
+        await CompletionCache(persistent=True).put(key, "A", "stored reply", 0.5)
+
+    async def get():
+        try:
+            cache = CompletionCache(persistent=True)
+            return await cache.get(key, "A"), cache.stats()
+        finally:
+            await async_engine.dispose()
+
+    client.portal.call(put)
+    reply, stats = client.portal.call(get)
+    assert reply == "stored reply"
+    assert stats["variants"]["A"]["persistent_hits"] == 1
@@ -24,9 +24,10 @@ def db_session():
 
 
 # Test the addConfigurations function to verify knowledge sources and prompt profile creation
-def test_add_configurations(db_session):
-    # Temporarily replace the config file
-    with open("config/test_model_variants.json", "w") as f:
+def test_add_configurations(db_session, tmp_path):
+    # A config file of its own, outside the repository
+    config_path = str(tmp_path / "model_variants.json")
+    with open(config_path, "w") as f:
         json.dump({
             "D": {
                 "model": "llama3-8b-8192",
@@ -47,10 +48,18 @@ def test_add_configurations(db_session):
     db_session.refresh(conversation)
 
     # Override your function to read the test file
-    addConfigurations(db_session, conversation, "D", config_path="config/test_model_variants.json")
+    addConfigurations(db_session, conversation, "D", config_path=config_path)
 
-    sources = db_session.query(KnowledgeSource).filter_by(conversation_id=conversation.id).all()
-    print([s.content for s in sources])
-    assert len(sources) == 2
-    assert sources[0].content == "Test source one."
-    assert sources[1].content == "Test source two."
\ No newline at end of file
+    assert [s.content for s in conversation.knowledge_sources] == ["Test source one.", "Test source two."]
+    assert conversation.prompt_profile.system_prompt == "This is a test prompt for variant D."
+
+    # A second conversation on the same variant reuses the stored prompt and sources
+    other = Conversation()
+    db_session.add(other)
+    db_session.commit()
+    addConfigurations(db_session, other, "D", config_path=config_path)
+
+    assert other.prompt_profile_id == conversation.prompt_profile_id
+    assert other.knowledge_set_id == conversation.knowledge_set_id
+    assert db_session.query(PromptProfile).count() == 1
+    assert db_session.query(KnowledgeSource).count() == 2
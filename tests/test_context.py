@@ -0,0 +1,79 @@
+# tests/test_context.py
+
+from types import SimpleNamespace
+
+from app.context import assemble_context, count_message_tokens, history_budget
+from app.variants import ModelVariant
+
+SYSTEM = [{"role": "system", "content": "You are a helpful assistant."}]
+
+
+def make_variant(**overrides):
+    config = {
+        "model": "llama3-70b-8192",
+        "temperature": 0.7,
+        "max_tokens": 100,
+        "system_prompt": "You are a helpful assistant.",
+        "history_budget": 200,
+    }
+    config.update(overrides)
+    return ModelVariant.model_validate(config)
+
+
+def make_turns(count, size=70):
+    return [
+        ("user" if i % 2 == 0 else "assistant", f"{i}:" + "x" * size)
+        for i in range(count)
+    ]
+
+
+def as_messages(turns):
+    return [{"role": role, "content": content} for role, content in turns]
+
+
+# Test that a short conversation is sent in full without compaction
+def test_short_conversation_fits():
+    turns = make_turns(3)
+    history, compact_until = assemble_context(SYSTEM, None, turns, make_variant())
+
+    assert history == SYSTEM + as_messages(turns)
+    assert compact_until is None
+
+
+# Test that old turns are dropped and marked for compaction when over budget
+def test_long_conversation_is_trimmed():
+    variant = make_variant()
+    turns = make_turns(20)
+    history, compact_until = assemble_context(SYSTEM, None, turns, variant)
+
+    kept = history[len(SYSTEM):]
+    assert kept == as_messages(turns[-len(kept):])
+    assert kept[-1] == as_messages(turns)[-1]
+    assert sum(count_message_tokens(t["content"], variant.model) for t in kept) <= variant.history_budget
+    # Compaction folds past the dropped turns so the summary isn't rewritten every turn
+    assert compact_until > len(turns) - len(kept)
+
+
+# Test that turns already in the summary are replaced by it
+def test_summary_replaces_folded_turns():
+    turns = make_turns(6)
+    summary = SimpleNamespace(content="The user said hello.", message_count=4)
+    history, compact_until = assemble_context(SYSTEM, summary, turns, make_variant())
+
+    assert history[len(SYSTEM)]["content"].endswith("The user said hello.")
+    assert history[len(SYSTEM) + 1:] == as_messages(turns[4:])
+    assert compact_until is None
+
+
+# Test that the newest message is kept even if it exceeds the budget on its own
+def test_latest_turn_always_kept():
+    turns = make_turns(3, size=5000)
+    history, _ = assemble_context(SYSTEM, None, turns, make_variant())
+
+    assert history[-1] == as_messages(turns)[-1]
+
+
+# Test that the budget never exceeds the context window minus the reply
+def test_history_budget_respects_window():
+    variant = make_variant(context_window=1000, max_tokens=500, history_budget=None)
+    assert history_budget(variant, system_tokens=100) < 400
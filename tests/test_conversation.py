@@ -1,3 +1,4 @@
+import pytest
 from fastapi.testclient import TestClient
 from app.main import app
 from db.database import SessionLocal
@@ -5,6 +6,10 @@ from db.models import Conversation, Message
 
 client = TestClient(app)
 
+
+pytestmark = pytest.mark.usefixtures("running_app")
+
+
 def test_conversation_missing_prompt():
     db = SessionLocal()
     try:
@@ -0,0 +1,95 @@
+# tests/test_evaluate.py
+
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+
+from app.scripts.evaluate import run_evaluations
+from db.database import SessionLocal, async_engine
+from db.init_db import create_schema
+from db.models import Conversation, Evaluation, Message
+
+
+@pytest.fixture(scope="module", autouse=True)
+def schema():
+    create_schema()
+
+
+class FakeGroq:
+    """Scores every conversation 7 and records how many calls overlap."""
+
+    def __init__(self):
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        content = 'Here you go: {"score": 7, "comment": "Clear."}'
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+def evaluate(config, concurrency=2):
+    fake = FakeGroq()
+
+    async def run():
+        try:
+            with patch("app.scripts.evaluate.client.chat.completions.create", new=fake.create):
+                return await run_evaluations(concurrency=concurrency, config=config)
+        finally:
+            await async_engine.dispose()
+
+    results, summary = asyncio.run(run())
+    return fake, results, summary
+
+
+# Test that every conversation is scored once, with bounded concurrency, and persisted
+def test_evaluates_concurrently_and_persists(seeded_config):
+    fake, results, summary = evaluate(seeded_config, concurrency=2)
+
+    assert fake.calls == 5
+    assert fake.max_in_flight == 2
+    assert summary["evaluated"] == 5
+    assert {r["score"] for r in results} == {7}
+
+    db = SessionLocal()
+    try:
+        rows = db.query(Evaluation).filter_by(config=seeded_config).all()
+        assert len(rows) == 5
+        assert {row.message_seq for row in rows} == {2}
+    finally:
+        db.close()
+
+
+# Test that only conversations with new messages are evaluated again
+def test_reevaluates_only_changed_conversations(seeded_config):
+    evaluate(seeded_config)
+
+    fake, _, _ = evaluate(seeded_config)
+    assert fake.calls == 0
+
+    db = SessionLocal()
+    try:
+        convo = db.query(Conversation).filter_by(config=seeded_config).first()
+        db.add(Message(conversation_id=convo.id, role="user", content="one more thing"))
+        db.commit()
+        convo_id = convo.id
+    finally:
+        db.close()
+
+    fake, results, _ = evaluate(seeded_config)
+    assert fake.calls == 1
+    assert results[0]["conversation_id"] == str(convo_id)
+
+    db = SessionLocal()
+    try:
+        seqs = sorted(row.message_seq for row in db.query(Evaluation).filter_by(conversation_id=convo_id))
+        assert seqs == [2, 3]
+    finally:
+        db.close()
@@ -0,0 +1,89 @@
+# tests/test_export.py
+
+import gzip
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app.export as export
+import app.talks as talks
+from app.export import CHECKPOINT, run_export
+from app.main import app
+from app.talks import TalksFilters
+
+client = TestClient(app)
+
+
+pytestmark = pytest.mark.usefixtures("running_app")
+
+
+def exported(directory):
+    conversations = []
+    for shard in sorted(directory.glob("conversations-*.ndjson.gz")):
+        with gzip.open(shard, "rt") as f:
+            conversations += [json.loads(line) for line in f]
+    return conversations
+
+
+# Test that an export writes every matching conversation, newest first, across shards
+# and across the batches of the server-side cursor
+def test_export_shards(seeded_config, tmp_path, monkeypatch):
+    monkeypatch.setattr(talks, "STREAM_BATCH_SIZE", 3)
+    result = client.portal.call(run_export, TalksFilters(config=seeded_config), str(tmp_path), "ndjson", 2)
+
+    assert (result["shards"], result["conversations"], result["messages"], result["done"]) == (3, 5, 10, True)
+    assert result["conversations_per_second"] > 0
+    conversations = exported(tmp_path)
+    assert [c["messages"][0]["content"] for c in conversations] == [f"question {i}" for i in range(4, -1, -1)]
+    assert not any(c["archived"] for c in conversations)
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        CHECKPOINT, "conversations-00000.ndjson.gz", "conversations-00001.ndjson.gz", "conversations-00002.ndjson.gz",
+    ]
+
+    # Run again, a finished export has nothing left to do
+    assert client.portal.call(run_export, TalksFilters(config=seeded_config), str(tmp_path), "ndjson", 2)["exported"] == 0
+
+
+# Test that an interrupted export resumes after its last complete shard, without duplicates
+def test_export_resumes(seeded_config, tmp_path, monkeypatch):
+    stream = export.iter_conversations
+
+    async def interrupted(filters, cursor=None):
+        count = 0
+        async for item in stream(filters, cursor):
+            if count == 3:
+                raise ConnectionError("connection lost")
+            count += 1
+            yield item
+
+    filters = TalksFilters(config=seeded_config)
+    monkeypatch.setattr(export, "iter_conversations", interrupted)
+    with pytest.raises(ConnectionError):
+        client.portal.call(run_export, filters, str(tmp_path), "ndjson", 2)
+    assert sorted(p.name for p in tmp_path.iterdir()) == [CHECKPOINT, "conversations-00000.ndjson.gz"]
+
+    monkeypatch.setattr(export, "iter_conversations", stream)
+    result = client.portal.call(run_export, filters, str(tmp_path), "ndjson", 2)
+    assert (result["exported"], result["conversations"], result["messages"]) == (3, 5, 10)
+    ids = [c["conversation_id"] for c in exported(tmp_path)]
+    assert len(ids) == len(set(ids)) == 5
+
+
+# Test the feedback filter, and that a directory only resumes the export it holds
+def test_export_filters(seeded_config, tmp_path):
+    filters = TalksFilters(config=seeded_config, has_feedback=True)
+    client.portal.call(run_export, filters, str(tmp_path), "ndjson", 10)
+    [conversation] = exported(tmp_path)
+    assert conversation["messages"][1]["thumbs_up"] is True
+
+    with pytest.raises(ValueError):
+        client.portal.call(run_export, TalksFilters(config=seeded_config), str(tmp_path), "ndjson", 10)
+
+
+# Test the Parquet shards, when pyarrow is installed
+def test_export_parquet(seeded_config, tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    client.portal.call(run_export, TalksFilters(config=seeded_config), str(tmp_path), "parquet", 3)
+    rows = [row for shard in sorted(tmp_path.glob("*.parquet")) for row in pq.read_table(shard).to_pylist()]
+    assert [len(row["messages"]) for row in rows] == [2] * 5
@@ -0,0 +1,96 @@
+# tests/test_hedging.py
+
+import asyncio
+import uuid
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from groq import APIStatusError
+from prometheus_client import REGISTRY
+
+from app.hedging import hedged_call
+from app.main import app
+from app.variants import registry
+from db.database import SessionLocal
+from db.models import Message
+
+client = TestClient(app)
+
+
+pytestmark = pytest.mark.usefixtures("running_app")
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def unavailable():
+    request = httpx.Request("POST", "https://api.groq.com/openai/v1/chat/completions")
+    return APIStatusError("unavailable", response=httpx.Response(503, request=request), body=None)
+
+
+class FakeModels:
+    """Answers after a per-model delay, or fails; remembers which calls were cancelled."""
+
+    def __init__(self, delays, failing=()):
+        self.delays = delays
+        self.failing = set(failing)
+        self.cancelled = []
+
+    async def __call__(self, model):
+        try:
+            await asyncio.sleep(self.delays[model])
+        except asyncio.CancelledError:
+            self.cancelled.append(model)
+            raise
+        if model in self.failing:
+            raise unavailable()
+        return f"reply from {model}"
+
+
+# Test that a slow call is hedged with the next model, which wins and cancels the first
+def test_hedge_wins_over_slow_primary():
+    models = FakeModels({"big": 5, "small": 0.01})
+    hedges = sample("groq_hedges_total", variant="T", reason="slow")
+    wins = sample("groq_hedge_wins_total", variant="T", model="small")
+
+    result, model = asyncio.run(hedged_call(models, ["big", "small"], hedge_delay=0.05, variant="T"))
+
+    assert (result, model) == ("reply from small", "small")
+    assert models.cancelled == ["big"]
+    assert sample("groq_hedges_total", variant="T", reason="slow") == hedges + 1
+    assert sample("groq_hedge_wins_total", variant="T", model="small") == wins + 1
+
+
+# Test that a fast primary never triggers a hedge, and a failed one falls back at once
+def test_fast_primary_and_fallback_on_error():
+    assert asyncio.run(hedged_call(FakeModels({"big": 0, "small": 0}), ["big", "small"], 0.05)) == (
+        "reply from big", "big",
+    )
+    failing = FakeModels({"big": 0, "small": 0}, failing={"big"})
+    assert asyncio.run(hedged_call(failing, ["big", "small"]))[1] == "small"
+
+    with pytest.raises(APIStatusError):
+        asyncio.run(hedged_call(FakeModels({"big": 0, "small": 0}, failing={"big", "small"}), ["big", "small"]))
+
+
+# Test that /chat records the fallback model that actually answered
+def test_chat_records_answering_model():
+    variant = registry.get("A").model_copy(update={"fallback_models": ["backup-model"]})
+
+    async def create(**kwargs):
+        if kwargs["model"] != "backup-model":
+            raise unavailable()
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="Backup!"))], usage=None)
+
+    with patch("app.chat.registry.get", return_value=variant), \
+         patch("app.chat.client.chat.completions.create", new=create):
+        response = client.post("/chat", json={"message": "Hello?"})
+
+    assert response.status_code == 200
+    assert response.json()["reply"] == "Backup!"
+    with SessionLocal() as db:
+        assert db.get(Message, uuid.UUID(response.json()["message_id"])).model == "backup-model"
@@ -0,0 +1,79 @@
+# tests/test_history_cache.py
+
+import uuid
+
+from app import history_cache as cache_module
+from app.history_cache import HistoryCache
+
+
+# Test that a cached history is returned and extended by write-through
+def test_cache_hit_and_append():
+    cache = HistoryCache()
+    convo = uuid.uuid4()
+    cache.put(convo, [("user", "Hello!"), ("assistant", "Hi there.")])
+
+    cache.append(convo, "user", "How are you?")
+
+    assert cache.get(convo) == [("user", "Hello!"), ("assistant", "Hi there."), ("user", "How are you?")]
+    assert cache.hits == 1
+
+
+# Test that appending to a conversation that isn't cached does nothing
+def test_append_without_entry_is_noop():
+    cache = HistoryCache()
+    convo = uuid.uuid4()
+
+    cache.append(convo, "user", "Hello!")
+
+    assert cache.get(convo) is None
+    assert cache.misses == 1
+
+
+# Test that the least recently used conversation is evicted past the conversation cap
+def test_evicts_least_recently_used():
+    cache = HistoryCache(max_conversations=2)
+    first, second, third = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    cache.put(first, [("user", "one")])
+    cache.put(second, [("user", "two")])
+    cache.get(first)
+    cache.put(third, [("user", "three")])
+
+    assert cache.get(second) is None
+    assert cache.get(first) is not None
+    assert cache.get(third) is not None
+    assert cache.evictions == 1
+
+
+# Test that the memory cap bounds the cache
+def test_evicts_past_memory_cap():
+    cache = HistoryCache(max_bytes=2_000)
+    for _ in range(10):
+        cache.put(uuid.uuid4(), [("user", "x" * 500)])
+
+    assert cache.bytes <= 2_000
+    assert len(cache._entries) < 10
+
+
+# Test that an inactive cache (no invalidation channel) never serves entries
+def test_inactive_cache_misses():
+    cache = HistoryCache()
+    cache.active = False
+    convo = uuid.uuid4()
+    turns = cache.put(convo, [("user", "Hello!")])
+
+    assert turns == [("user", "Hello!")]
+    assert cache.get(convo) is None
+
+
+# Test that notifications from other workers evict, and our own are ignored
+def test_notifications_invalidate_other_workers_writes(monkeypatch):
+    cache = HistoryCache()
+    monkeypatch.setattr(cache_module, "history_cache", cache)
+    convo = uuid.uuid4()
+    cache.put(convo, [("user", "Hello!")])
+
+    cache_module._on_notify(None, 0, cache_module.CHANNEL, f"{cache_module.WORKER_ID} {convo}")
+    assert cache.get(convo) is not None
+
+    cache_module._on_notify(None, 0, cache_module.CHANNEL, f"otherworker {convo}")
+    assert cache.get(convo) is None
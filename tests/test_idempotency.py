@@ -0,0 +1,260 @@
+# tests/test_idempotency.py
+
+import asyncio
+import json
+import uuid
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+
+from app.idempotency import fingerprint, idempotency_keys
+from app.main import app
+from app.message_writer import message_writer
+from app.turn_lock import ConversationLocks, TurnLockTimeout, conversation_locks, lock_key
+from db.database import SessionLocal, engine
+from db.models import IdempotencyKey, Message, utcnow
+
+client = TestClient(app)
+
+
+pytestmark = pytest.mark.usefixtures("running_app")
+
+
+def completion(text):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))], usage=None)
+
+
+def chunk(text):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))], x_groq=None)
+
+
+class SlowStream:
+    def __init__(self, parts, delay=0.05):
+        self.parts = parts
+        self.delay = delay
+
+    async def __aiter__(self):
+        for part in self.parts:
+            await asyncio.sleep(self.delay)
+            yield chunk(part)
+
+    async def close(self):
+        pass
+
+
+def slow_groq(reply, delay=0.2, calls=None):
+    async def create(**kwargs):
+        if calls is not None:
+            calls.append(kwargs["messages"])
+        await asyncio.sleep(delay)
+        return completion(reply)
+    return AsyncMock(side_effect=create)
+
+
+def events(body):
+    parsed = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        parsed.append((lines["event"], json.loads(lines["data"])))
+    return parsed
+
+
+def post_together(*requests):
+    """Send the requests at the same time, each a (json, headers) pair."""
+    async def send():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as http:
+            async def post(body, headers, delay):
+                await asyncio.sleep(delay)
+                return await http.post("/chat", json=body, headers=headers)
+            return await asyncio.gather(*(post(body, headers, i * 0.02) for i, (body, headers) in enumerate(requests)))
+    return client.portal.call(send)
+
+
+def messages_of(conversation_id):
+    # Turns buffered with write-behind are stored once flushed
+    client.portal.call(message_writer.flush)
+    with SessionLocal() as db:
+        return db.query(Message).filter_by(conversation_id=uuid.UUID(conversation_id)).order_by(Message.seq).all()
+
+
+# Test that a retried request replays the stored reply without calling Groq again
+def test_retry_replays_reply():
+    key = str(uuid.uuid4())
+    create = AsyncMock(return_value=completion("Only once"))
+    with patch("app.chat.client.chat.completions.create", new=create):
+        first = client.post("/chat", json={"message": "Hello"}, headers={"Idempotency-Key": key})
+        retry = client.post("/chat", json={"message": "Hello"}, headers={"Idempotency-Key": key})
+        streamed = client.post("/chat", json={"message": "Hello", "stream": True}, headers={"Idempotency-Key": key})
+
+    assert create.await_count == 1
+    assert retry.json() == first.json()
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert [event for event, _ in events(streamed.text)] == ["start", "token", "done"]
+    assert events(streamed.text)[1][1]["content"] == "Only once"
+    assert len(messages_of(first.json()["conversation_id"])) == 2
+
+    # The key belongs to that request
+    reused = client.post("/chat", json={"message": "Something else"}, headers={"Idempotency-Key": key})
+    assert reused.status_code == 422
+
+
+# Test that duplicates sent while the turn is in flight follow it instead of calling Groq
+def test_in_flight_duplicates_follow_the_turn():
+    key = str(uuid.uuid4())
+    headers = {"Idempotency-Key": key}
+    body = {"message": f"Tell me a story {key}", "stream": True}
+    create = AsyncMock(return_value=SlowStream(["Once ", "upon ", "a ", "time"]))
+    with patch("app.chat.client.chat.completions.create", new=create):
+        original, streamed, plain = post_together(
+            (body, headers), (body, headers), ({**body, "stream": False}, headers),
+        )
+
+    assert create.await_count == 1
+    tokens = lambda response: "".join(data["content"] for event, data in events(response.text) if event == "token")
+    assert tokens(original) == tokens(streamed) == plain.json()["reply"] == "Once upon a time"
+    assert events(streamed.text)[0][1] == events(original.text)[0][1]
+    assert streamed.headers["Idempotent-Replayed"] == plain.headers["Idempotent-Replayed"] == "true"
+    assert len(messages_of(plain.json()["conversation_id"])) == 2
+
+
+# Test that a turn that fails releases its key, so a retry runs it
+def test_failed_turn_releases_key():
+    headers = {"Idempotency-Key": str(uuid.uuid4())}
+    with patch("app.chat.client.chat.completions.create", new=AsyncMock(side_effect=RuntimeError("down"))):
+        failed = client.post("/chat", json={"message": "Hi"}, headers=headers)
+    assert failed.status_code == 502
+
+    with patch("app.chat.client.chat.completions.create", new=AsyncMock(return_value=completion("Back"))):
+        retried = client.post("/chat", json={"message": "Hi"}, headers=headers)
+    assert retried.status_code == 200
+    assert "Idempotent-Replayed" not in retried.headers
+
+
+# Test that a duplicate of a turn hung on this worker gives up like one of a turn elsewhere
+def test_duplicate_wait_is_bounded(monkeypatch):
+    key = str(uuid.uuid4())
+    headers = {"Idempotency-Key": key}
+    body = {"message": f"Take your time {key}"}
+    monkeypatch.setattr(idempotency_keys, "wait", 0.2)
+    with patch("app.chat.client.chat.completions.create", new=slow_groq("Eventually", delay=1)):
+        original, duplicate, streamed = post_together(
+            (body, headers), (body, headers), ({**body, "stream": True}, headers),
+        )
+
+    assert original.json()["reply"] == "Eventually"
+    assert duplicate.status_code == streamed.status_code == 409
+    assert duplicate.headers["Retry-After"] == streamed.headers["Retry-After"] == "1"
+
+
+# Test that a turn cancelled mid-flight, as on a client disconnect, releases its key
+def test_cancelled_turn_releases_key():
+    key = str(uuid.uuid4())
+    headers = {"Idempotency-Key": key}
+
+    async def cancel():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as http:
+            task = asyncio.create_task(http.post("/chat", json={"message": "Hi"}, headers=headers))
+            await asyncio.sleep(0.2)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+    with patch("app.chat.client.chat.completions.create", new=slow_groq("Too late", delay=5)):
+        client.portal.call(cancel)
+    assert idempotency_keys.stats()["in_flight"] == 0
+    with SessionLocal() as db:
+        assert db.get(IdempotencyKey, key) is None
+
+    with patch("app.chat.client.chat.completions.create", new=AsyncMock(return_value=completion("Back"))):
+        retried = client.post("/chat", json={"message": "Hi"}, headers=headers)
+    assert retried.json()["reply"] == "Back"
+    assert "Idempotent-Replayed" not in retried.headers
+
+
+# Test keys claimed by another worker: waited on while pending, replayed once done, taken over once expired
+def test_key_claimed_elsewhere(monkeypatch):
+    key = str(uuid.uuid4())
+    body = {"message": "From another worker"}
+    now = utcnow()
+    with SessionLocal() as db:
+        db.add(IdempotencyKey(
+            key=key, fingerprint=fingerprint(body["message"], None), status="pending",
+            created_at=now, expires_at=now + timedelta(minutes=5),
+        ))
+        db.commit()
+
+    monkeypatch.setattr(idempotency_keys, "wait", 0.3)
+    create = AsyncMock(return_value=completion("Should not run"))
+    with patch("app.chat.client.chat.completions.create", new=create):
+        assert client.post("/chat", json=body, headers={"Idempotency-Key": key}).status_code == 409
+
+        conversation_id, message_id = uuid.uuid4(), uuid.uuid4()
+        with SessionLocal() as db:
+            row = db.get(IdempotencyKey, key)
+            row.status, row.reply, row.complete = "done", "Answered there", True
+            row.conversation_id, row.message_id = conversation_id, message_id
+            db.commit()
+        replayed = client.post("/chat", json=body, headers={"Idempotency-Key": key})
+    assert create.await_count == 0
+    assert replayed.json() == {
+        "reply": "Answered there", "conversation_id": str(conversation_id), "message_id": str(message_id),
+    }
+
+    with SessionLocal() as db:
+        db.get(IdempotencyKey, key).expires_at = now - timedelta(seconds=1)
+        db.commit()
+    with patch("app.chat.client.chat.completions.create", new=AsyncMock(return_value=completion("Fresh"))):
+        assert client.post("/chat", json=body, headers={"Idempotency-Key": key}).json()["reply"] == "Fresh"
+
+
+# Test that concurrent turns of one conversation run one after the other, each seeing the previous one
+def test_turns_of_a_conversation_are_serialized():
+    with patch("app.chat.client.chat.completions.create", new=AsyncMock(return_value=completion("Hi"))):
+        conversation_id = client.post("/chat", json={"message": "Start"}).json()["conversation_id"]
+
+    calls = []
+    with patch("app.chat.client.chat.completions.create", new=slow_groq("Noted", calls=calls)):
+        first, second = post_together(
+            ({"message": "First", "conversation_id": conversation_id}, {}),
+            ({"message": "Second", "conversation_id": conversation_id}, {}),
+        )
+
+    assert first.status_code == second.status_code == 200
+    assert [m["content"] for m in calls[1] if m["role"] != "system"][-3:] == ["First", "Noted", "Second"]
+    assert [m.content for m in messages_of(conversation_id)] == ["Start", "Hi", "First", "Noted", "Second", "Noted"]
+    assert conversation_locks.stats()["locked"] == 0
+
+
+# Test that a turn gives up on a conversation locked by another worker
+@pytest.mark.skipif(engine.dialect.name != "postgresql", reason="advisory locks need Postgres")
+def test_lock_held_by_another_worker():
+    conversation_id = uuid.uuid4()
+    locks = ConversationLocks(timeout=0.2)
+
+    async def acquire():
+        lock = await locks.acquire(conversation_id)
+        await lock.release()
+
+    try:
+        with engine.connect() as other:
+            other.execute(text("SELECT pg_advisory_lock(:k)"), {"k": lock_key(conversation_id)})
+            with pytest.raises(TurnLockTimeout):
+                client.portal.call(acquire)
+            other.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": lock_key(conversation_id)})
+        client.portal.call(acquire)
+        assert locks.stats() == {"locked": 0, "waited": 0, "timeouts": 1}
+    finally:
+        client.portal.call(locks.close)
+
+
+# Test that conversations whose ids only differ past the first 32 bits get different lock keys
+def test_lock_key_uses_64_bits():
+    first = uuid.UUID("12345678-0000-4000-8000-000000000000")
+    second = uuid.UUID("12345678-0001-4000-8000-000000000000")
+    assert lock_key(first) != lock_key(second)
+    assert -2**63 <= lock_key(uuid.UUID(int=2**128 - 1)) < 0
@@ -0,0 +1,119 @@
+# tests/test_message_writer.py
+
+import asyncio
+import uuid
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.message_writer import MessageWriter, message_writer
+from db.database import SessionLocal, async_engine
+from db.models import Conversation, Message
+
+client = TestClient(app)
+
+
+pytestmark = pytest.mark.usefixtures("running_app")
+
+
+def stored_messages(conversation_id):
+    with SessionLocal() as db:
+        return db.query(Message.seq, Message.role, Message.content).filter_by(
+            conversation_id=conversation_id
+        ).order_by(Message.seq).all()
+
+
+def turn(user, reply):
+    return [(uuid.uuid4(), "user", user), (uuid.uuid4(), "assistant", reply)]
+
+
+# Test that buffered turns are written in order, after the messages already stored
+def test_flush_assigns_positions():
+    conversation = Conversation(id=uuid.uuid4(), config="A")
+
+    async def run():
+        try:
+            writer = MessageWriter(enabled=True)
+            await writer.add_turn(conversation.id, turn("one", "two"), conversation)
+            await writer.add_turn(conversation.id, turn("three", "four"))
+            assert writer.pending(conversation.id)
+            await writer.flush()
+            assert not writer.pending()
+
+            await writer.add_turn(conversation.id, turn("five", "six"))
+            await writer.flush()
+            return writer.metrics()
+        finally:
+            await async_engine.dispose()
+
+    metrics = asyncio.run(run())
+    assert [seq for seq, _, _ in stored_messages(conversation.id)] == [1, 2, 3, 4, 5, 6]
+    assert [content for _, _, content in stored_messages(conversation.id)][-1] == "six"
+    assert metrics["flushes"] == 2
+    assert metrics["messages_written"] == 6
+
+
+# Test that turns journaled by a crashed process are written once on recovery
+def test_journal_recovery(tmp_path):
+    conversation = Conversation(id=uuid.uuid4(), config="A")
+
+    async def crash():
+        writer = MessageWriter(enabled=True, journal_dir=tmp_path)
+        await writer.add_turn(conversation.id, turn("hello", "hi"), conversation)
+        # The process dies before flushing; its lock goes with it
+        writer.journal._file.close()
+
+    async def recover():
+        try:
+            return [await MessageWriter(enabled=True, journal_dir=tmp_path).recover() for _ in range(2)]
+        finally:
+            await async_engine.dispose()
+
+    asyncio.run(crash())
+    assert asyncio.run(recover()) == [2, 0]
+    assert [role for _, role, _ in stored_messages(conversation.id)] == ["user", "assistant"]
+    assert not list(tmp_path.iterdir())
+
+
+# Test that a buffered turn costs no statements and is visible to the next reads
+def test_chat_reads_its_own_writes(query_budget):
+    completion = SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="Hi!"))])
+    with patch.object(message_writer, "enabled", True), \
+         patch("app.chat.client.chat.completions.create", new=AsyncMock(return_value=completion)):
+        client.post("/chat", json={"message": "Warm up"})
+        with query_budget(statements=0):
+            first = client.post("/chat", json={"message": "Hello!"}).json()
+        assert message_writer.pending(uuid.UUID(first["conversation_id"]))
+
+        second = client.post("/chat", json={"message": "And?", "conversation_id": first["conversation_id"]})
+        assert second.status_code == 200
+
+        feedback = client.patch("/feedback", json={"message_id": second.json()["message_id"], "thumbs_up": True})
+        assert feedback.status_code == 200
+
+        page = client.get("/talks-data?limit=200").json()["conversations"]
+
+    convo = next(c for c in page if c["conversation_id"] == first["conversation_id"])
+    assert [m["content"] for m in convo["messages"]] == ["Hello!", "Hi!", "And?", "Hi!"]
+    assert convo["messages"][-1]["thumbs_up"] is True
+
+
+# Test that feedback flushes the buffer only when the rated message is still in it
+def test_feedback_flushes_only_its_conversation():
+    completion = SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="Hi!"))])
+    with patch.object(message_writer, "enabled", True), \
+         patch("app.chat.client.chat.completions.create", new=AsyncMock(return_value=completion)):
+        rated = client.post("/chat", json={"message": "Rate me"}).json()
+        message_id = uuid.UUID(rated["message_id"])
+        assert message_writer.conversation_of(message_id) == uuid.UUID(rated["conversation_id"])
+        client.portal.call(message_writer.flush)
+        assert message_writer.conversation_of(message_id) is None
+
+        other = client.post("/chat", json={"message": "Still buffered"}).json()
+        feedback = client.patch("/feedback", json={"message_id": rated["message_id"], "thumbs_up": True})
+        assert feedback.status_code == 200
+        assert message_writer.pending(uuid.UUID(other["conversation_id"]))
+        client.portal.call(message_writer.flush)
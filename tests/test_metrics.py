@@ -0,0 +1,107 @@
+# tests/test_metrics.py
+
+import json
+import logging
+import uuid
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from groq import APIStatusError
+from prometheus_client import REGISTRY
+
+from app.log import JSONFormatter
+from app.main import app
+from app.variants import registry
+
+client = TestClient(app)
+
+
+pytestmark = pytest.mark.usefixtures("running_app")
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+# Test that a chat turn records its phases and token usage, and leaves nothing in flight
+def test_chat_turn_metrics():
+    completion = SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content="Hi!"))],
+        usage=SimpleNamespace(prompt_tokens=42, completion_tokens=7),
+    )
+    phases = ("context_load", "generation", "persistence")
+    before = {phase: sample("chat_phase_seconds_count", phase=phase, variant="A") for phase in phases}
+    model = registry.get("A").model
+    prompt_tokens = sample("llm_tokens_total", variant="A", model=model, kind="prompt")
+
+    with patch("app.chat.client.chat.completions.create", new=AsyncMock(return_value=completion)):
+        assert client.post("/chat", json={"message": "Hello!"}).status_code == 200
+
+    for phase in phases:
+        assert sample("chat_phase_seconds_count", phase=phase, variant="A") == before[phase] + 1
+    assert sample("llm_tokens_total", variant="A", model=model, kind="prompt") == prompt_tokens + 42
+    assert sample("chat_requests_in_flight") == 0
+
+
+# Test that failed Groq calls are counted by status and the scrape exposes the cache stats
+def test_groq_errors_and_scrape():
+    request = httpx.Request("POST", "https://api.groq.com/openai/v1/chat/completions")
+    error = APIStatusError("unavailable", response=httpx.Response(503, request=request), body=None)
+    before = sample("groq_errors_total", status="503")
+
+    with patch("app.chat.client.chat.completions.create", new=AsyncMock(side_effect=error)):
+        assert client.post("/chat", json={"message": "Hello?"}).status_code == 502
+
+    assert sample("groq_errors_total", status="503") == before + 1
+    body = client.get("/metrics").text
+    assert "history_cache_hits" in body
+    assert "groq_limiter_calls" in body
+    assert "message_writer_buffered" in body
+
+
+class FailingStream:
+    async def __aiter__(self):
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content="Hal"))], x_groq=None)
+        raise RuntimeError("connection reset")
+
+    async def close(self):
+        pass
+
+
+# Test that each chat turn is counted once by its variant and outcome
+def test_chat_requests_by_outcome():
+    completion = SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="Hi!"))], usage=None)
+    outcomes = {
+        ("A", "ok"): 2, ("A", "error"): 1, ("none", "error"): 1, ("none", "replayed"): 1,
+    }
+    before = {key: sample("chat_requests_total", variant=key[0], outcome=key[1]) for key in outcomes}
+    headers = {"Idempotency-Key": str(uuid.uuid4())}
+
+    with patch("app.chat.client.chat.completions.create", new=AsyncMock(return_value=completion)):
+        conversation_id = client.post("/chat", json={"message": "Hello!"}).json()["conversation_id"]
+        client.post("/chat", json={"message": "Again", "conversation_id": conversation_id}, headers=headers)
+        assert client.post("/chat", json={"message": "Again", "conversation_id": conversation_id},
+                           headers=headers).headers["Idempotent-Replayed"] == "true"
+        # A conversation that doesn't exist has no variant yet
+        missing = client.post("/chat", json={"message": "?", "conversation_id": str(uuid.uuid4())})
+        assert missing.status_code == 404
+    with patch("app.chat.client.chat.completions.create", new=AsyncMock(return_value=FailingStream())):
+        streamed = client.post("/chat", json={"message": "Stream it", "conversation_id": conversation_id, "stream": True})
+        assert "event: error" in streamed.text
+
+    for (variant, outcome), count in outcomes.items():
+        assert sample("chat_requests_total", variant=variant, outcome=outcome) == before[(variant, outcome)] + count
+
+
+# Test that structured fields end up in JSON log lines
+def test_json_log_fields():
+    record = logging.LogRecord("noxus.chat", logging.INFO, __file__, 1, "💾 Saved turn", None, None)
+    record.conversation_id = "abc"
+    entry = json.loads(JSONFormatter().format(record))
+
+    assert entry["message"] == "💾 Saved turn"
+    assert entry["conversation_id"] == "abc"
+    assert entry["level"] == "INFO"
@@ -0,0 +1,97 @@
+# tests/test_query_budget.py
+
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from db.database import engine
+
+client = TestClient(app)
+
+POSTGRES = engine.dialect.name == "postgresql"
+
+
+pytestmark = pytest.mark.usefixtures("running_app")
+
+
+@pytest.fixture
+def mock_groq():
+    completion = SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="Hi!"))])
+    with patch("app.chat.client.chat.completions.create", new=AsyncMock(return_value=completion)) as mock:
+        yield mock
+
+
+class FakeStream:
+    def __init__(self, content):
+        self.chunks = [SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))])]
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield chunk
+
+    async def close(self):
+        pass
+
+
+def start_conversation():
+    response = client.post("/chat", json={"message": "Hello!"})
+    assert response.status_code == 200
+    return response.json()["conversation_id"]
+
+
+# Test that a new conversation and its first turn are written in one transaction
+def test_new_conversation_budget(mock_groq, query_budget):
+    # Resolve the variant's prompt and knowledge ids once
+    start_conversation()
+
+    # Two inserts and the A/B counters
+    with query_budget(statements=3, transactions=1):
+        response = client.post("/chat", json={"message": "Hello again!"})
+    assert response.status_code == 200
+
+
+# Test that a turn loads the conversation in one query and saves both messages together
+def test_continue_conversation_budget(mock_groq, query_budget):
+    conversation_id = start_conversation()
+
+    # Conversation with its relationships, two inserts, the A/B counters, and the cache
+    # invalidation on Postgres
+    with query_budget(statements=5 if POSTGRES else 4, transactions=2):
+        response = client.post("/chat", json={"message": "And then?", "conversation_id": conversation_id})
+    assert response.status_code == 200
+
+    # A history cache miss costs one more query
+    with patch("app.chat.history_cache.get", return_value=None):
+        with query_budget(statements=6 if POSTGRES else 5, transactions=2):
+            response = client.post("/chat", json={"message": "Go on", "conversation_id": conversation_id})
+    assert response.status_code == 200
+
+
+# Test that a streamed turn has the same budget as a regular one
+def test_streamed_turn_budget(mock_groq, query_budget):
+    conversation_id = start_conversation()
+
+    mock_groq.return_value = FakeStream("Hi!")
+    with query_budget(statements=5 if POSTGRES else 4, transactions=2):
+        response = client.post("/chat", json={"message": "More", "conversation_id": conversation_id, "stream": True})
+    assert 'data: {"content": "Hi!"}' in response.text
+
+
+# Test that a page of conversations loads its messages in one extra query
+def test_talks_data_budget(mock_groq, query_budget):
+    start_conversation()
+
+    with query_budget(statements=2, transactions=1):
+        response = client.get("/talks-data?limit=20")
+    assert response.status_code == 200
+
+
+# Test that a turn whose Groq call fails leaves nothing behind
+def test_failed_turn_writes_nothing(query_budget):
+    with patch("app.chat.client.chat.completions.create", new=AsyncMock(side_effect=RuntimeError("down"))):
+        with query_budget(statements=0):
+            response = client.post("/chat", json={"message": "Hello?"})
+    assert response.status_code == 502
@@ -0,0 +1,80 @@
+# tests/test_query_plans.py
+
+import uuid
+from datetime import datetime
+
+import pytest
+from sqlalchemy import select, text
+
+from app.chat import history_query
+from app.talks import TalksFilters, encode_cursor, page_query
+from app.telemetry import turn_stats_query
+from db.database import engine
+from db.models import Conversation, KnowledgeSource, Message
+from db.init_db import create_schema
+
+
+@pytest.fixture(scope="module", autouse=True)
+def schema():
+    create_schema()
+
+
+def query_plan(stmt):
+    """The database's plan for a statement, as one lowercase string."""
+    sql = str(stmt.compile(engine, compile_kwargs={"literal_binds": True}))
+    with engine.begin() as conn:
+        if engine.dialect.name == "postgresql":
+            # Tiny test tables are always cheaper to scan; check an index scan is usable
+            conn.execute(text("SET LOCAL enable_seqscan = off"))
+            conn.execute(text("SET LOCAL enable_bitmapscan = off"))
+            rows = conn.execute(text(f"EXPLAIN {sql}")).all()
+            return "\n".join(row[0] for row in rows).lower()
+        rows = conn.execute(text(f"EXPLAIN QUERY PLAN {sql}")).all()
+        return "\n".join(row[-1] for row in rows).lower()
+
+
+def assert_no_sort(plan):
+    assert "temp b-tree" not in plan
+    assert "sort" not in plan.replace("sort key", "")
+
+
+# Test that the chat history is read in order straight from the (conversation_id, seq) index
+def test_chat_history_uses_index():
+    plan = query_plan(history_query(uuid.uuid4()))
+    assert "ix_messages_conversation_id_seq" in plan
+    assert_no_sort(plan)
+
+
+# Test that the first /talks-data page walks the started_at index
+def test_talks_first_page_uses_index():
+    plan = query_plan(page_query(TalksFilters(), 51))
+    assert "ix_conversations_started_at" in plan
+    assert_no_sort(plan)
+
+
+# Test that following pages seek into the started_at index with the cursor
+def test_talks_next_page_uses_index():
+    cursor = encode_cursor(Conversation(id=uuid.uuid4(), started_at=datetime(2024, 1, 1)))
+    plan = query_plan(page_query(TalksFilters(), 51, cursor))
+    assert "ix_conversations_started_at" in plan
+
+
+# Test that loading the messages of a page uses the conversation index
+def test_talks_page_messages_use_index():
+    ids = [uuid.uuid4() for _ in range(3)]
+    plan = query_plan(select(Message).where(Message.conversation_id.in_(ids)))
+    assert "ix_messages_conversation_id_seq" in plan
+
+
+# Test that knowledge sources are resolved by content hash through the unique index
+def test_knowledge_sources_use_index():
+    plan = query_plan(select(KnowledgeSource.id).where(KnowledgeSource.content_hash == "0" * 64))
+    assert "ix_knowledge_sources_content_hash" in plan
+
+
+# Test that the per-variant turn stats read the partial index of assistant replies
+def test_turn_stats_use_index():
+    if engine.dialect.name != "postgresql":
+        pytest.skip("percentile_cont needs Postgres")
+    plan = query_plan(turn_stats_query(24))
+    assert "ix_messages_assistant_timestamp" in plan
@@ -0,0 +1,118 @@
+# tests/test_rate_limit.py
+
+import asyncio
+import uuid
+
+import httpx
+import pytest
+
+from app import rate_limit
+from app.rate_limit import (
+    BACKGROUND,
+    INTERACTIVE,
+    PostgresBuckets,
+    RateLimitedTransport,
+    RateLimiter,
+    retry_delay,
+)
+from db.database import async_engine, engine
+from db.init_db import create_schema
+
+
+def completion_request(model="test-model"):
+    return httpx.Request(
+        "POST", "https://api.groq.com/openai/v1/chat/completions",
+        json={"model": model, "messages": [{"role": "user", "content": "hi"}], "max_tokens": 10},
+    )
+
+
+# Test that a waiting interactive call is served before a background call queued earlier
+def test_interactive_goes_first():
+    limiter = RateLimiter({"default": (600, 1_000_000)}, reserve=0)
+    order = []
+
+    async def call(priority):
+        await limiter.acquire("m", 10, priority)
+        order.append(priority)
+
+    async def run():
+        for _ in range(600):
+            await limiter.acquire("m", 10, INTERACTIVE)
+        queued = asyncio.create_task(call(BACKGROUND))
+        await asyncio.sleep(0.01)
+        await asyncio.gather(queued, call(INTERACTIVE))
+
+    asyncio.run(run())
+    assert order == [INTERACTIVE, BACKGROUND]
+
+
+# Test that background work leaves the reserved share of the budget untouched
+def test_background_keeps_reserve():
+    limiter = RateLimiter({"default": (10, 1_000_000)}, reserve=0.2)
+
+    assert limiter.store.take_sync("m", (10, 1_000_000), 1, 0.2) == 0
+    for _ in range(7):
+        limiter.store.take_sync("m", (10, 1_000_000), 1, 0.2)
+    # 2 requests left, both reserved for interactive calls
+    assert limiter.store.take_sync("m", (10, 1_000_000), 1, 0.2) > 0
+    assert limiter.store.take_sync("m", (10, 1_000_000), 1, 0) == 0
+
+
+# Test that Retry-After is honored, with jitter on top, and backoff is used without it
+def test_retry_delay():
+    assert 2 <= retry_delay(httpx.Headers({"retry-after": "2"}), 0) <= 3
+    assert 0.5 <= retry_delay(httpx.Headers({"retry-after-ms": "500"}), 0) <= 1.0
+    assert 0 <= retry_delay(httpx.Headers(), 3) <= 8
+
+
+# Test that a 429 is retried by the transport and not passed on to the SDK's retries
+def test_transport_retries_429():
+    responses = [
+        httpx.Response(429, headers={"retry-after-ms": "50"}),
+        httpx.Response(200, json={"ok": True}),
+    ]
+    limiter = RateLimiter({"default": (600, 1_000_000)})
+    transport = RateLimitedTransport(limiter, httpx.MockTransport(lambda request: responses.pop(0)))
+
+    response = asyncio.run(transport.handle_async_request(completion_request()))
+
+    assert response.status_code == 200
+    assert limiter.stats[INTERACTIVE]["throttled"] == 1
+    assert not responses
+
+
+# Test that an interactive call that would wait too long fails fast as a non-retryable 429
+def test_interactive_wait_is_capped(monkeypatch):
+    monkeypatch.setattr(rate_limit, "MAX_INTERACTIVE_WAIT", 0.1)
+    limiter = RateLimiter({"default": (1, 1_000_000)})
+    transport = RateLimitedTransport(limiter, httpx.MockTransport(lambda request: httpx.Response(200)))
+
+    async def run():
+        await transport.handle_async_request(completion_request())
+        return await transport.handle_async_request(completion_request())
+
+    response = asyncio.run(run())
+    assert response.status_code == 429
+    assert response.headers["x-should-retry"] == "false"
+    assert limiter.stats[INTERACTIVE]["timeouts"] == 1
+
+
+# Test that workers sharing Postgres buckets draw from one budget
+@pytest.mark.skipif(engine.dialect.name != "postgresql", reason="shared buckets need Postgres")
+def test_postgres_buckets_are_shared():
+    create_schema()
+    model = f"test-{uuid.uuid4().hex[:8]}"
+    limits = (2, 1_000_000)
+    first, second = PostgresBuckets(async_engine, engine), PostgresBuckets(async_engine, engine)
+
+    assert first.take_sync(model, limits, 10, 0) == 0
+    assert second.take_sync(model, limits, 10, 0) == 0
+    assert first.take_sync(model, limits, 10, 0) > 0
+
+    async def run():
+        try:
+            return await second.take(model, limits, 10, 0)
+        finally:
+            await async_engine.dispose()
+
+    assert asyncio.run(run()) > 0
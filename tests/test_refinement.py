@@ -0,0 +1,122 @@
+# tests/test_refinement.py
+
+import uuid
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.knowledge import get_or_create_prompt_profile
+from app.main import app
+from app.refinement import claim_jobs, process_job
+from db.database import AsyncSessionLocal, SessionLocal
+from db.models import Conversation, Message, PromptProfile, RefinementFeedback, RefinementJob, utcnow
+
+client = TestClient(app)
+
+
+pytestmark = pytest.mark.usefixtures("running_app")
+
+
+@pytest.fixture
+def seeded():
+    """Two conversations sharing a prompt profile, each with one assistant reply."""
+    db = SessionLocal()
+    try:
+        profile_id = get_or_create_prompt_profile(db, f"Test prompt {uuid.uuid4()}")
+        replies = []
+        for i in range(2):
+            convo = Conversation(config="A", prompt_profile_id=profile_id)
+            db.add(convo)
+            db.flush()
+            db.add(Message(conversation_id=convo.id, role="user", content=f"question {i}"))
+            reply = Message(conversation_id=convo.id, role="assistant", content=f"answer {i}")
+            db.add(reply)
+            db.flush()
+            replies.append(str(reply.id))
+        db.commit()
+    finally:
+        db.close()
+    return profile_id, replies
+
+
+def completion(text):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))])
+
+
+async def claim():
+    async with AsyncSessionLocal() as db:
+        return await claim_jobs(db, limit=1000)
+
+
+# Test that feedback is acknowledged without calling the LLM and coalesced into one job
+def test_feedback_is_queued(seeded):
+    profile_id, replies = seeded
+    with patch("app.refinement.client.chat.completions.create", new=AsyncMock()) as mock_groq:
+        for message_id in replies:
+            res = client.patch("/feedback", json={"message_id": message_id, "thumbs_down": True})
+            assert res.status_code == 200
+    mock_groq.assert_not_called()
+
+    db = SessionLocal()
+    try:
+        job = db.get(RefinementJob, profile_id)
+        assert job.feedback_count == 2
+        assert job.run_after > utcnow()
+    finally:
+        db.close()
+
+
+# Test that a due job is leased by one worker and skipped by the next
+def test_due_job_is_claimed_once(seeded):
+    profile_id, replies = seeded
+    client.patch("/feedback", json={"message_id": replies[0], "thumbs_up": True})
+
+    # Not due until the debounce window has passed
+    assert profile_id not in [job.prompt_profile_id for job in client.portal.call(claim)]
+
+    db = SessionLocal()
+    try:
+        db.get(RefinementJob, profile_id).run_after = utcnow() - timedelta(seconds=1)
+        db.commit()
+    finally:
+        db.close()
+
+    assert profile_id in [job.prompt_profile_id for job in client.portal.call(claim)]
+    assert profile_id not in [job.prompt_profile_id for job in client.portal.call(claim)]
+
+
+# Test that all queued feedback for a profile becomes a single refinement
+def test_job_refines_once_for_all_feedback(seeded):
+    profile_id, replies = seeded
+    for message_id in replies:
+        client.patch("/feedback", json={"message_id": message_id, "feedback_text": "Too long"})
+
+    db = SessionLocal()
+    try:
+        job = db.get(RefinementJob, profile_id)
+        enqueued_at = job.enqueued_at
+    finally:
+        db.close()
+
+    refined = f"Refined prompt {uuid.uuid4()}"
+    with patch("app.refinement.client.chat.completions.create",
+               new=AsyncMock(return_value=completion(refined))) as mock_groq:
+        client.portal.call(process_job, profile_id, enqueued_at, 1)
+
+    assert mock_groq.call_count == 1
+    assert mock_groq.call_args.kwargs["messages"][0]["content"].count("Too long") == 2
+
+    db = SessionLocal()
+    try:
+        assert db.get(RefinementJob, profile_id) is None
+        new_profile = db.query(PromptProfile).filter_by(system_prompt=refined).one()
+        convos = db.query(Conversation).join(Message).filter(Message.id.in_([uuid.UUID(m) for m in replies])).all()
+        assert {c.prompt_profile_id for c in convos} == {new_profile.id}
+        assert db.query(RefinementFeedback).filter(
+            RefinementFeedback.conversation_id.in_([c.id for c in convos])
+        ).count() == 0
+    finally:
+        db.close()
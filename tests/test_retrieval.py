@@ -0,0 +1,98 @@
+# tests/test_retrieval.py
+
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.context import knowledge_context
+from app.main import app
+from app.retrieval import KnowledgeIndex, chunk_text, html_to_text, knowledge_index
+from app.scripts.ingest_knowledge import ingest
+from app.variants import registry
+
+client = TestClient(app)
+
+DOCUMENTS = [
+    ("mickey17.md", [
+        "Mickey 17 is a 2025 science fiction film directed by Bong Joon Ho.",
+        "Robert Pattinson plays Mickey Barnes, an expendable clone sent on dangerous missions.",
+    ]),
+    ("cooking.txt", ["A good risotto needs arborio rice, warm stock and patience."]),
+]
+
+
+pytestmark = pytest.mark.usefixtures("running_app")
+
+
+@pytest.fixture
+def loaded_index(monkeypatch):
+    monkeypatch.setattr(knowledge_index, "index", KnowledgeIndex.build(DOCUMENTS))
+
+
+# Test that paragraphs are packed into chunks and long ones split on words
+def test_chunk_text():
+    text = "First paragraph.\n\nSecond one.\n\n" + "word " * 100
+    chunks = chunk_text(text, max_chars=60)
+
+    assert chunks[0] == "First paragraph. Second one."
+    assert all(len(chunk) <= 60 for chunk in chunks)
+    assert " ".join(chunks[1:]).split() == ["word"] * 100
+
+
+# Test that HTML is reduced to its visible text
+def test_html_to_text():
+    text = html_to_text("<html><script>var x;</script><p>Hello <b>there</b></p><p>Bye</p></html>")
+    assert "var x" not in text
+    assert chunk_text(text) == ["Hello there Bye"]
+
+
+# Test that an index survives a save and load and ranks the relevant chunk first
+def test_index_round_trip(tmp_path):
+    KnowledgeIndex.build(DOCUMENTS).save(tmp_path / "index.npz")
+    index = KnowledgeIndex.load(tmp_path / "index.npz")
+
+    results = index.search("Who plays the clone in Mickey 17?", k=2)
+    assert index.chunks[results[0][0]].startswith("Robert Pattinson")
+    assert index.source(results[0][0]) == "mickey17.md"
+    assert index.search("quantum chromodynamics", k=2) == []
+
+
+# Test that the ingestion command reads text, markdown and HTML files
+def test_ingest_directory(tmp_path):
+    (tmp_path / "docs").mkdir()
+    (tmp_path / "docs" / "a.md").write_text("# Risotto\n\nStir the rice often.")
+    (tmp_path / "docs" / "b.html").write_text("<p>Bong Joon Ho directed Parasite.</p>")
+    (tmp_path / "docs" / "ignored.bin").write_bytes(b"\x00\x01")
+
+    index, _ = ingest([tmp_path / "docs"], tmp_path / "index.npz")
+
+    assert len(index.sources) == 2
+    assert KnowledgeIndex.load(tmp_path / "index.npz").search("parasite", 1)
+
+
+# Test that retrieved chunks respect the variant's top-k and token budget
+def test_knowledge_context_budget(loaded_index):
+    variant = registry.get("A").model_copy(update={"retrieval_top_k": 2, "retrieval_budget": 50})
+    messages = knowledge_context("Mickey 17 clone Pattinson", variant)
+
+    assert len(messages) == 1
+    assert "Robert Pattinson" in messages[0]["content"]
+    # The second chunk doesn't fit in 50 tokens
+    assert "Bong Joon Ho" not in messages[0]["content"]
+    assert knowledge_context("Mickey 17", registry.get("A")) == []
+
+
+# Test that /chat sends the relevant excerpts to the model
+def test_chat_injects_retrieved_chunks(loaded_index):
+    variant = registry.get("A").model_copy(update={"retrieval_top_k": 1})
+    completion = SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="Risotto!"))], usage=None)
+
+    with patch("app.chat.registry.get", return_value=variant), \
+         patch("app.chat.client.chat.completions.create", new=AsyncMock(return_value=completion)) as mock_groq:
+        assert client.post("/chat", json={"message": "How do I make risotto?"}).status_code == 200
+
+    system = [m["content"] for m in mock_groq.call_args.kwargs["messages"] if m["role"] == "system"]
+    assert any("arborio rice" in content for content in system)
+    assert not any("Pattinson" in content for content in system)
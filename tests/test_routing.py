@@ -0,0 +1,124 @@
+# tests/test_routing.py
+
+import asyncio
+import uuid
+from collections import Counter
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.routing import RoutingPolicy, VariantRouter, variant_router
+from db.database import SessionLocal
+from db.models import Conversation
+
+client = TestClient(app)
+
+
+# Put the configured routing policy back once the module is done
+@pytest.fixture(autouse=True, scope="module")
+def restore_routes(running_app):
+    yield
+    variant_router.load()
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def split(router, keys=2000):
+    return Counter(router.assign(f"client-{i}") for i in range(keys))
+
+
+# Test that weights split new conversations and the same key keeps its variant
+def test_weighted_sticky_assignment():
+    router = VariantRouter(RoutingPolicy(weights={"A": 3, "B": 1}))
+    counts = split(router)
+
+    assert 0.7 < counts["A"] / 2000 < 0.8
+    assert {router.assign("client-7") for _ in range(5)} == {router.assign("client-7")}
+
+
+# Test that a slow variant hands share to its shift target, keeping at least min_share
+def test_slow_variant_shifts_share():
+    clock = Clock()
+    policy = RoutingPolicy(
+        weights={"A": 1}, shift_to={"A": "B"}, min_samples=10, max_p95_ms=1000, min_share=0.25,
+    )
+    router = VariantRouter(policy, clock=clock)
+    assert split(router) == {"A": 2000}
+
+    for _ in range(20):
+        router.record("A", latency_seconds=8.0)
+    clock.now += 10
+    counts = split(router)
+    assert 0.2 < counts["A"] / 2000 < 0.3
+    assert counts["B"] > counts["A"]
+
+    # Once the slow samples leave the window, the share comes back
+    clock.now += policy.window_seconds + 10
+    assert split(router) == {"A": 2000}
+
+
+# Test that failures count against a variant and unknown variants are never assigned
+def test_errors_and_unknown_variants():
+    clock = Clock()
+    policy = RoutingPolicy(weights={"A": 1, "B": 1, "Z": 5}, min_samples=10, max_error_rate=0.1)
+    router = VariantRouter(policy, clock=clock)
+    assert set(split(router)) == {"A", "B"}
+
+    for _ in range(20):
+        router.record("B", error=True)
+    clock.now += 10
+    # Failing every call, B keeps min_share of its half
+    counts = split(router)
+    assert 0.07 < counts["B"] / 2000 < 0.13
+
+
+# Test that /chat routes new conversations with the live policy and records their latency
+def test_chat_uses_router():
+    completion = SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content="Hi!"))],
+        usage=None,
+    )
+    variant_router.set_policy(RoutingPolicy(weights={"B": 1}))
+
+    with patch("app.chat.client.chat.completions.create", new=AsyncMock(return_value=completion)):
+        response = client.post("/chat", json={"message": "Hello!", "client_id": "abc"})
+    assert response.status_code == 200
+    with SessionLocal() as db:
+        assert db.get(Conversation, uuid.UUID(response.json()["conversation_id"])).config == "B"
+
+    stats = client.get("/admin/routing").json()
+    assert stats["shares"] == {"B": 1.0}
+    assert stats["variants"]["B"]["requests"] == 1
+
+
+class SlowStream:
+    # The first token comes right away, the rest of the reply later
+    async def __aiter__(self):
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content="Hi"))], x_groq=None)
+        await asyncio.sleep(0.4)
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=" there"))], x_groq=None)
+
+    async def close(self):
+        pass
+
+
+# Test that a streamed turn records the latency of its complete reply, like a regular one
+def test_streamed_turn_records_complete_reply():
+    variant_router.set_policy(RoutingPolicy(weights={"B": 1}))
+
+    with patch("app.chat.client.chat.completions.create", new=AsyncMock(return_value=SlowStream())):
+        response = client.post("/chat", json={"message": "Hello!", "stream": True})
+    assert "event: done" in response.text
+
+    stats = client.get("/admin/routing").json()["variants"]["B"]
+    assert stats["requests"] == 1
+    assert stats["p95_ms"] >= 400
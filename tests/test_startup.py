@@ -0,0 +1,61 @@
+# tests/test_startup.py
+
+import os
+import subprocess
+import sys
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from db.database import engine
+from db.migrations import MIGRATIONS_TABLE, discover, migrate
+
+
+# Test that importing the app needs no Groq key and does no database or client work
+def test_import_is_side_effect_free(tmp_path):
+    database = tmp_path / "import.db"
+    script = (
+        "import app.main, app.llm\n"
+        "assert not app.llm.client.built and not app.llm.sync_client.built\n"
+    )
+    env = {**os.environ, "GROQ_API_KEY": "", "DATABASE_URL": f"sqlite:///{database}"}
+    subprocess.run([sys.executable, "-c", script], env=env, check=True)
+
+    assert not database.exists() or database.stat().st_size == 0
+
+
+# Test that a missing Groq key fails the first call instead of the import
+def test_lazy_client_requires_key(monkeypatch):
+    from app import llm
+
+    monkeypatch.setattr(llm, "GROQ_API_KEY", None)
+    lazy = llm.LazyClient(llm.build_async_client)
+    with pytest.raises(ValueError, match="GROQ_API_KEY"):
+        lazy.chat
+    assert not lazy.built
+
+
+# Test that workers migrating a fresh database at once apply each migration exactly once
+@pytest.mark.skipif(engine.dialect.name != "postgresql", reason="migrations run on Postgres")
+def test_concurrent_migrations():
+    name = f"noxus_migrate_{uuid.uuid4().hex[:8]}"
+    admin = create_engine(engine.url.set(database="postgres"), isolation_level="AUTOCOMMIT")
+    with admin.connect() as conn:
+        conn.execute(text(f"CREATE DATABASE {name}"))
+    workers = [create_engine(engine.url.set(database=name)) for _ in range(4)]
+    try:
+        with ThreadPoolExecutor(len(workers)) as pool:
+            applied = list(pool.map(migrate, workers))
+
+        versions = [version for version, _ in discover()]
+        assert sorted(v for run in applied for v in run) == versions
+        with workers[0].connect() as conn:
+            assert conn.execute(text(f"SELECT count(*) FROM {MIGRATIONS_TABLE}")).scalar() == len(versions)
+    finally:
+        for worker in workers:
+            worker.dispose()
+        with admin.connect() as conn:
+            conn.execute(text(f"DROP DATABASE IF EXISTS {name}"))
+        admin.dispose()
@@ -0,0 +1,88 @@
+# tests/test_talks.py
+
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app.talks as talks
+from app.main import app
+
+client = TestClient(app)
+
+
+pytestmark = pytest.mark.usefixtures("running_app")
+
+
+# Test walking every page with the keyset cursor
+def test_talks_data_pagination(seeded_config):
+    seen = []
+    cursor = None
+    while True:
+        params = {"config": seeded_config, "limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        res = client.get("/talks-data", params=params)
+        assert res.status_code == 200
+        page = res.json()
+        seen += page["conversations"]
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+
+    assert len(seen) == 5
+    started = [c["started_at"] for c in seen]
+    assert started == sorted(started, reverse=True)
+    assert [m["content"] for m in seen[0]["messages"]] == ["question 4", "answer 4"]
+
+
+# Test the date range and feedback filters
+def test_talks_data_filters(seeded_config):
+    res = client.get("/talks-data", params={
+        "config": seeded_config,
+        "since": "2024-01-02T00:00:00",
+        "until": "2024-01-04T00:00:00",
+    })
+    assert len(res.json()["conversations"]) == 2
+
+    res = client.get("/talks-data", params={"config": seeded_config, "has_feedback": True})
+    conversations = res.json()["conversations"]
+    assert len(conversations) == 1
+    assert conversations[0]["messages"][1]["thumbs_up"] is True
+
+
+# Test that a malformed cursor is rejected
+def test_talks_data_invalid_cursor():
+    res = client.get("/talks-data", params={"cursor": "not-a-cursor"})
+    assert res.status_code == 400
+
+
+# Test the NDJSON stream returns one line per conversation
+def test_talks_data_stream(seeded_config):
+    res = client.get("/talks-data/stream", params={"config": seeded_config})
+    assert res.status_code == 200
+    assert res.headers["content-type"].startswith("application/x-ndjson")
+
+    lines = [json.loads(line) for line in res.text.splitlines()]
+    assert len(lines) == 5
+    assert all(len(c["messages"]) == 2 for c in lines)
+
+
+# Test the feedback filter on the stream, which joins messages itself
+def test_talks_data_stream_feedback_filter(seeded_config):
+    res = client.get("/talks-data/stream", params={"config": seeded_config, "has_feedback": True})
+    assert res.status_code == 200
+
+    [conversation] = [json.loads(line) for line in res.text.splitlines()]
+    assert conversation["messages"][1]["thumbs_up"] is True
+
+
+# Test a stream longer than one batch of the server-side cursor
+def test_talks_data_stream_batches(seeded_config, monkeypatch):
+    monkeypatch.setattr(talks, "STREAM_BATCH_SIZE", 3)
+    res = client.get("/talks-data/stream", params={"config": seeded_config})
+    assert res.status_code == 200
+
+    lines = [json.loads(line) for line in res.text.splitlines()]
+    assert [c["messages"][0]["content"] for c in lines] == [f"question {i}" for i in range(4, -1, -1)]
+    assert all([m["role"] for m in c["messages"]] == ["user", "assistant"] for c in lines)
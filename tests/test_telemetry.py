@@ -0,0 +1,107 @@
+# tests/test_telemetry.py
+
+import uuid
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.context import compact_summary
+from app.main import app
+from db.database import SessionLocal
+from db.models import Conversation, LLMCall, Message
+
+client = TestClient(app)
+
+
+pytestmark = pytest.mark.usefixtures("running_app")
+
+
+def usage(prompt, completion):
+    return SimpleNamespace(prompt_tokens=prompt, completion_tokens=completion)
+
+
+def completion(text, prompt_tokens=12, completion_tokens=5):
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content=text))],
+        usage=usage(prompt_tokens, completion_tokens),
+    )
+
+
+def chunk(text=None, tokens=None):
+    return SimpleNamespace(
+        choices=[SimpleNamespace(delta=SimpleNamespace(content=text))] if text else [],
+        x_groq=SimpleNamespace(usage=tokens) if tokens else None,
+    )
+
+
+class FakeStream:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def __aiter__(self):
+        for item in self.chunks:
+            yield item
+
+    async def close(self):
+        pass
+
+
+def stored_reply(message_id):
+    with SessionLocal() as db:
+        return db.get(Message, uuid.UUID(message_id))
+
+
+# Test that a reply stores its model, token counts and latency
+def test_chat_reply_telemetry():
+    with patch("app.chat.client.chat.completions.create",
+               new=AsyncMock(return_value=completion(f"Telemetry {uuid.uuid4()}", 42, 7))):
+        response = client.post("/chat", json={"message": f"How fast? {uuid.uuid4()}"})
+
+    assert response.status_code == 200
+    reply = stored_reply(response.json()["message_id"])
+    assert reply.model
+    assert (reply.prompt_tokens, reply.completion_tokens) == (42, 7)
+    assert reply.latency_ms is not None and reply.latency_ms >= 0
+    assert reply.ttft_ms is None
+
+
+# Test that a streamed reply also stores its time to first token and the final usage
+def test_stream_reply_telemetry():
+    stream = FakeStream([chunk("Hel"), chunk("lo"), chunk(tokens=usage(30, 2))])
+    with patch("app.chat.client.chat.completions.create", new=AsyncMock(return_value=stream)):
+        response = client.post("/chat", json={"message": f"Stream {uuid.uuid4()}", "stream": True})
+
+    assert response.status_code == 200
+    message_id = next(
+        line.split('"message_id": "')[1].split('"')[0]
+        for line in response.text.splitlines() if '"message_id"' in line
+    )
+    reply = stored_reply(message_id)
+    assert (reply.prompt_tokens, reply.completion_tokens) == (30, 2)
+    assert reply.ttft_ms is not None
+    assert reply.latency_ms >= reply.ttft_ms
+
+
+# Test that a summary call is recorded in llm_calls
+def test_summary_call_is_recorded():
+    with SessionLocal() as db:
+        convo = Conversation(config="A")
+        db.add(convo)
+        db.flush()
+        for seq, role in enumerate(("user", "assistant"), start=1):
+            db.add(Message(conversation_id=convo.id, seq=seq, role=role, content=f"{role} turn"))
+        db.commit()
+        convo_id = convo.id
+        before = db.query(LLMCall).filter_by(purpose="summary").count()
+
+    with patch("app.context.client.chat.completions.create",
+               new=AsyncMock(return_value=completion("Summary", 100, 20))):
+        client.portal.call(compact_summary, convo_id, "A", 2)
+
+    with SessionLocal() as db:
+        calls = db.query(LLMCall).filter_by(purpose="summary").order_by(LLMCall.id).all()
+        assert len(calls) == before + 1
+        assert (calls[-1].prompt_tokens, calls[-1].completion_tokens) == (100, 20)
+        assert calls[-1].latency_ms is not None
@@ -0,0 +1,85 @@
+# tests/test_variants.py
+
+import json
+import os
+
+import pytest
+
+from app.variants import ModelVariantRegistry
+
+VARIANT = {
+    "model": "llama3-8b-8192",
+    "temperature": 0.5,
+    "frequency_penalty": 0,
+    "max_tokens": 300,
+    "system_prompt": "This is a test prompt.",
+    "knowledge_sources": ["Test source one."]
+}
+
+
+def write_variants(path, variants, mtime=None):
+    path.write_text(json.dumps(variants))
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+# Test loading and looking up a valid variant
+def test_registry_loads_variants(tmp_path):
+    path = tmp_path / "variants.json"
+    write_variants(path, {"A": VARIANT})
+
+    registry = ModelVariantRegistry.from_file(str(path))
+    variant = registry.get("A")
+
+    assert registry.snapshot.version == 1
+    assert variant.max_tokens == 300
+    assert variant.presence_penalty == 0
+    assert variant.knowledge_sources == ["Test source one."]
+
+
+# Test that a malformed variant fails at load time instead of at call time
+def test_registry_rejects_missing_fields(tmp_path):
+    path = tmp_path / "variants.json"
+    broken = {k: v for k, v in VARIANT.items() if k != "max_tokens"}
+    write_variants(path, {"A": broken})
+
+    with pytest.raises(ValueError, match="Invalid configuration 'A'"):
+        ModelVariantRegistry.from_file(str(path))
+
+
+# Test that an unknown variant raises a clear error
+def test_registry_unknown_variant(tmp_path):
+    path = tmp_path / "variants.json"
+    write_variants(path, {"A": VARIANT})
+
+    registry = ModelVariantRegistry.from_file(str(path))
+    with pytest.raises(ValueError, match="No configuration 'Z'"):
+        registry.get("Z")
+
+
+# Test that editing the file swaps in a new version
+def test_registry_hot_reload(tmp_path):
+    path = tmp_path / "variants.json"
+    write_variants(path, {"A": VARIANT}, mtime=1_000)
+    registry = ModelVariantRegistry.from_file(str(path))
+
+    assert registry.reload_if_changed() is False
+
+    write_variants(path, {"A": VARIANT, "B": {**VARIANT, "max_tokens": 100}}, mtime=2_000)
+    assert registry.reload_if_changed() is True
+    assert registry.snapshot.version == 2
+    assert registry.get("B").max_tokens == 100
+
+
+# Test that a broken edit keeps serving the previous variants
+def test_registry_keeps_snapshot_on_invalid_reload(tmp_path):
+    path = tmp_path / "variants.json"
+    write_variants(path, {"A": VARIANT}, mtime=1_000)
+    registry = ModelVariantRegistry.from_file(str(path))
+
+    path.write_text("{not json")
+    os.utime(path, (2_000, 2_000))
+
+    assert registry.reload_if_changed() is False
+    assert registry.snapshot.version == 1
+    assert registry.get("A").model == "llama3-8b-8192"